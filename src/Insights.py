@@ -1,23 +1,25 @@
+import time
 from pathlib import Path
 
 import streamlit as st
 import streamlit.components.v1 as components
 
-import plotly_express as px
-import umap
 import numpy as np
 import pandas as pd
-from pandas.api.types import (
-    is_categorical_dtype,
-    is_numeric_dtype,
-)
-from sklearn.preprocessing import RobustScaler
 
+from one_music.aggregates import AGGREGATE_TABLES, compare_markets
+from one_music.charts import DEFAULT_HISTORY_DIR, ChartHistory
 from one_music.cohere import create_cohere_client, embed_texts
-from one_music.pinecone import initialize_pinecone, get_or_create_index, query_index, fetch_vectors
+from one_music.dashboard import filter_dataframe, get_filter_engine, get_lyrics_index, load_lyrics_text
+from one_music.datastore import shared_store
+from one_music.plotting import scatter
+from one_music.pinecone import initialize_pinecone, get_or_create_index, query_index
+from one_music.projection import load_coordinates
+from one_music.search import SemanticSearch, load_hybrid_index, metadata_filter
+from one_music.tables import column_values, select_lyrics, select_songs
 
 
-@st.experimental_singleton
+@st.cache_resource
 def boot_client():
     initialize_pinecone(st.secrets["pinecone"]["api_key"], st.secrets["pinecone"]["environment"])
     index = get_or_create_index(st.secrets["pinecone"]["index_name"], 768, metric="cosine")
@@ -27,92 +29,107 @@ def boot_client():
     return index, co
 
 
-@st.experimental_memo
-def load_lyrics_table(file_path):
-    return pd.read_parquet(file_path)
+@st.cache_resource
+def get_semantic_search(_pinecone_index, _co):
+    """Query embedding and result caches are shared across sessions"""
+    return SemanticSearch(
+        embed_query=lambda text: embed_texts(_co, texts=[text])[0],
+        query_vectors=lambda vector, top_k, filters: query_index(_pinecone_index, vector, top_k=top_k, filter=filters)["matches"],
+    )
+
+
+def get_data_store(tables_dir):
+    """Tables of the current data version, swapped in the background when a new export lands; see `one_music.datastore`"""
+    return shared_store(tables_dir)
+
+
+# loaders are keyed on the data version of the snapshot taken at the start of the rerun, so a new
+# export is picked up without a restart and without dropping the other cached artifacts
+@st.cache_data(max_entries=8)
+def load_language_codes(data_version, _snapshot):
+    """Language name (as in the lyrics table) to ISO code (as in the Pinecone metadata)"""
+    language_df = _snapshot["language_table"]
+    return dict(zip(language_df.language_name, language_df.iso_code))
+
+
+@st.cache_data(max_entries=32)
+def load_options(data_version, _snapshot, table, column):
+    return column_values(_snapshot[table], column)
+
+
+@st.cache_data(max_entries=64)
+def load_lyrics_table(data_version, _snapshot, playlists: tuple, languages: tuple):
+    """Playlist and language selections filter the in-memory tables; `lyrics_text` is never loaded"""
+    return select_lyrics(_snapshot["lyrics_table"], _snapshot["index_table"], playlists, languages)
+
 
+@st.cache_data(max_entries=64)
+def load_song_table(data_version, _snapshot, playlists: tuple, languages: tuple):
+    return select_songs(_snapshot["song_table"], load_lyrics_table(data_version, _snapshot, playlists, languages))
 
-@st.experimental_memo
-def load_song_table(file_path, lyrics_df):
-    song_df = pd.read_parquet(file_path)
-    return song_df.loc[song_df.song_spotify_id.isin(lyrics_df.song_spotify_id)]
 
+@st.cache_data(max_entries=64)
+def load_market_comparison(data_version, _snapshot, playlists: tuple):
+    """Read off the per-playlist aggregates of `scripts/aggregate_playlists.py`, no song rows involved"""
+    return compare_markets({name: _snapshot[name] for name in AGGREGATE_TABLES}, list(playlists))
 
-@st.experimental_memo
-def load_index_table(file_path, lyrics_df):
-    index_df = pd.read_parquet(file_path)
-    return index_df.loc[index_df.song_spotify_id.isin(lyrics_df.song_spotify_id)]
 
+@st.cache_resource
+def get_chart_history(history_dir):
+    """Appended to by every Spotify poll, see `one_music.charts`"""
+    return ChartHistory(history_dir)
 
-@st.experimental_memo
-def get_vectors(_pinecone_index, vector_ids):
-    ids, vectors = fetch_vectors(_pinecone_index, vector_ids)
-    return ids, vectors
 
+@st.cache_data(max_entries=256)
+def load_trajectory(history_version, _history, song_spotify_id):
+    return _history.trajectory(song_spotify_id)
 
-@st.experimental_memo
-def umap_reduce(X: np.ndarray) -> np.ndarray:
-    return umap.UMAP().fit_transform(X)
 
+@st.cache_data(max_entries=64)
+def load_entries_exits(history_version, _history, playlist_ids: tuple):
+    return _history.entries_exits(days=7, playlist_ids=list(playlist_ids))
 
-def add_lyrics_embedding(lyrics_df, ids, vectors):
-    umap_embedding = umap_reduce(np.array(vectors))
-    embedding_df = pd.DataFrame(umap_embedding, index=ids, columns=["lyrics_x", "lyrics_y"]).rename_axis("vector_id").reset_index()
-    return pd.merge(lyrics_df, embedding_df, on="vector_id")
 
+@st.cache_data
+def load_projection_table(file_path, id_column, columns):
+    """2-D coordinates precomputed by `scripts/project_umap.py`"""
+    return load_coordinates(file_path, id_column, columns)
 
-def add_audio_embedding(song_df, features: list[str]):
-    scaler = RobustScaler()
-    X = scaler.fit_transform(song_df[features])
-    umap_embedding = umap_reduce(X)
-    embedding_df = pd.concat([song_df, pd.DataFrame(umap_embedding, columns=["audio_x", "audio_y"])], axis=1)
-    return embedding_df
 
+def add_lyrics_embedding(lyrics_df, coordinates_df):
+    return pd.merge(lyrics_df, coordinates_df, on="vector_id")
 
-def filter_dataframe(df: pd.DataFrame, key) -> pd.DataFrame:
-    """Nested filter function; used to filter audio_features"""
-    modify = st.checkbox("Add filters", key=key)
 
-    if not modify:
-        return df
+def add_audio_embedding(song_df, coordinates_df):
+    return pd.merge(song_df, coordinates_df, on="song_spotify_id")
 
-    df = df.copy()
-    
-    df = df.copy()
 
-    modification_container = st.container()
-    with modification_container:
-        to_filter_columns = st.multiselect("Filter dataframe on", df.columns)
-        for column in to_filter_columns:
-            left, right = st.columns((1, 20))
-            # Treat columns with < 10 unique values as categorical
-            if is_categorical_dtype(df[column]) or df[column].nunique() < 10:
-                user_cat_input = right.multiselect(
-                    f"Values for {column}",
-                    df[column].unique(),
-                    default=list(df[column].unique()),
-                )
-                df = df[df[column].isin(user_cat_input)]
-            elif is_numeric_dtype(df[column]):
-                _min = float(df[column].min())
-                _max = float(df[column].max())
-                step = (_max - _min) / 100
-                user_num_input = right.slider(
-                    f"Values for {column}",
-                    min_value=_min,
-                    max_value=_max,
-                    value=(_min, _max),
-                    step=step,
-                )
-                df = df[df[column].between(*user_num_input)]
-            else:
-                user_text_input = right.text_input(
-                    f"Substring or regex in {column}",
-                )
-                if user_text_input:
-                    df = df[df[column].astype(str).str.contains(user_text_input)]
+@st.cache_resource
+def get_hybrid_index(index_dir):
+    """Built offline by `scripts/build_search_index.py`"""
+    return load_hybrid_index(index_dir)
 
-    return df
+
+def plot_embedding(df: pd.DataFrame, x: str, y: str, id_column: str, color: str, hover_data: list[str], key):
+    """Render with SVG, WebGL or density aggregation depending on the number of points in the zoom window"""
+    ranges = {}
+    # an axis along which every point has the same coordinate (e.g. a single point) has nothing to zoom,
+    # and a slider with equal bounds raises
+    zoomable = [(axis, column) for axis, column in (("x", x), ("y", y)) if len(df) and df[column].min() < df[column].max()]
+    if zoomable:
+        with st.expander("Zoom window"):
+            for axis, column in zoomable:
+                low, high = float(df[column].min()), float(df[column].max())
+                ranges[axis] = st.slider(column, min_value=low, max_value=high, value=(low, high), key=f"{key}_{axis}")
+    x_range, y_range = ranges.get("x"), ranges.get("y")
+
+    figure, render_mode = scatter(df, x=x, y=y, id_column=id_column, color=color, hover_data=hover_data,
+                                  x_range=x_range, y_range=y_range)
+    st.plotly_chart(figure)
+    if render_mode == "density":
+        st.caption("Showing point density; narrow the zoom window to see individual songs")
+    elif render_mode == "webgl":
+        st.caption(f"Hover shows `{id_column}`; paste it in the sidebar for details")
 
 
 def app():
@@ -126,17 +143,9 @@ def app():
     pinecone_index, co = boot_client()
 
     base_path = Path(__file__).parent
-    lyrics_df = load_lyrics_table(base_path.joinpath("data/tables/lyrics_table.parquet"))
-    song_df = load_song_table(base_path.joinpath("data/tables/song_table.parquet"), lyrics_df)
-    index_df = load_index_table(base_path.joinpath("data/tables/index_table.parquet"), lyrics_df)
-
-    # cache embeddings
-    lyrics_ids, lyrics_vectors = get_vectors(pinecone_index, lyrics_df.vector_id.unique().tolist())
-    lyrics_df = add_lyrics_embedding(lyrics_df, lyrics_ids, lyrics_vectors)
-
-    song_df = add_audio_embedding(song_df, features=['acousticness', 'danceability',
-                                  'duration_ms', 'energy', 'instrumentalness', 'liveness',
-                                  'speechiness', 'tempo', 'valence'])
+    lyrics_path = base_path.joinpath("data/tables/lyrics_table.parquet")
+    snapshot = get_data_store(base_path.joinpath("data/tables")).snapshot()
+    version = snapshot.version
 
     # CONTENT
     st.title("🎶 OneMusic")
@@ -146,29 +155,104 @@ def app():
         """
     )
 
-    playlist_selection = st.multiselect("Select playlist", options=index_df.playlist_name.sort_values().unique())
-    if not playlist_selection:
-        playlist_selection = index_df.playlist_name.sort_values().unique()
-
-    song_df = song_df.loc[index_df.playlist_name.isin(playlist_selection)]
-    lyrics_df = lyrics_df.loc[lyrics_df.song_spotify_id.isin(song_df.song_spotify_id)]
+    playlist_selection = tuple(st.multiselect("Select playlist", options=load_options(version, snapshot, "index_table", "playlist_name")))
+    language_selection = tuple(st.multiselect("Select language", options=load_options(version, snapshot, "lyrics_table", "language")))
+
+    # the selection; the plots and tables below only show its lyrics that have been projected
+    selected_lyrics_df = load_lyrics_table(version, snapshot, playlist_selection, language_selection)
+    song_df = load_song_table(version, snapshot, playlist_selection, language_selection)
+
+    # embeddings are projected offline; new songs are placed with `transform`, see `scripts/project_umap.py`
+    lyrics_coordinates_df = load_projection_table(base_path.joinpath("data/tables/lyrics_projection.parquet"),
+                                                  "vector_id", ["lyrics_x", "lyrics_y"])
+    lyrics_df = add_lyrics_embedding(selected_lyrics_df, lyrics_coordinates_df)
+
+    audio_coordinates_df = load_projection_table(base_path.joinpath("data/tables/audio_projection.parquet"),
+                                                 "song_spotify_id", ["audio_x", "audio_y"])
+    song_df = add_audio_embedding(song_df, audio_coordinates_df)
+
+    all_lyrics_df = load_lyrics_table(version, snapshot, (), ())
+    lyrics_index = get_lyrics_index(("lyrics_table", version), all_lyrics_df)
+
+    # engines cover every row of the data version; the playlist and language selection is one more mask
+    lyrics_engine = get_filter_engine(("Insights", "lyrics_table", version),
+                                      lambda: add_lyrics_embedding(all_lyrics_df, lyrics_coordinates_df))
+    audio_engine = get_filter_engine(("Insights", "song_table", version),
+                                     lambda: add_audio_embedding(load_song_table(version, snapshot, (), ()), audio_coordinates_df))
+
+    st.header("Market comparison")
+    if snapshot["playlist_table"].empty:
+        st.info("Compute the playlist aggregates with `scripts/aggregate_playlists.py`")
+    else:
+        comparison = load_market_comparison(version, snapshot, playlist_selection)
+        st.subheader("Audio features (mean)")
+        st.dataframe(comparison["features"])
+        st.subheader("Language mix (share of songs with lyrics)")
+        languages_df = comparison["languages"]
+        st.bar_chart(languages_df[languages_df.sum().nlargest(10).index])
+        with st.expander("Songs shared between markets"):
+            st.dataframe(comparison["overlap"])
+        if not comparison["lyrics_similarity"].empty:
+            with st.expander("Lyrics similarity between markets (cosine of the embedding centroids)"):
+                st.dataframe(comparison["lyrics_similarity"])
+
+    st.header("Chart history")
+    history = get_chart_history(DEFAULT_HISTORY_DIR)
+    history_version = history.version()
+    if not history_version:
+        st.info("Chart snapshots are recorded by `scripts/poll_spotify.py`")
+    else:
+        spotify_id_trajectory = st.text_input("Input Spotify id", value="0yLdNVWF3Srea0uzk55zFn", key="trajectory")
+        trajectory_df = load_trajectory(history_version, history, spotify_id_trajectory)
+        if len(trajectory_df):
+            st.line_chart(trajectory_df.pivot_table(index="date", columns="market", values="position"))
+            st.caption("Chart position by market (1 is the top)")
+        else:
+            st.write("This song never charted")
+
+        index_df = snapshot["index_table"]
+        playlist_ids = tuple(index_df.loc[index_df.playlist_name.isin(playlist_selection)].playlist_spotify_id.unique())
+        with st.expander("Entries and exits this week"):
+            changes_df = load_entries_exits(history_version, history, playlist_ids)
+            st.dataframe(changes_df.merge(snapshot["song_table"][["song_spotify_id", "song_name"]], on="song_spotify_id", how="left"))
+
+    st.header("Search lyrics")
+    search_text = st.text_input("Describe the lyrics you are looking for")
+    if search_text:
+        language_codes = load_language_codes(version, snapshot)
+        languages = [language_codes[name] for name in language_selection if name in language_codes]
+        unmapped = [name for name in language_selection if name not in language_codes]
+        if unmapped:
+            st.warning(f"No ISO code for {', '.join(unmapped)}: lyrics in these languages are left out of the search")
+        song_ids = selected_lyrics_df.song_spotify_id.unique().tolist() if playlist_selection else None
+        if (language_selection and not languages) or song_ids == []:
+            # an empty condition would drop the filter and search every lyrics
+            st.write("No lyrics match the selected playlists and languages")
+        else:
+            filters = metadata_filter(languages=languages, song_ids=song_ids)
+            matches, timings = get_semantic_search(pinecone_index, co).search(search_text, top_k=5, filters=filters)
+
+            start = time.perf_counter()
+            results_df = (
+                pd.DataFrame(matches, columns=["id", "score"])
+                .rename(columns={"id": "vector_id"})
+                .merge(all_lyrics_df[["vector_id", "song_spotify_id", "song_name", "language"]], on="vector_id")
+            )
+            results_df["snippet"] = [
+                (load_lyrics_text(lyrics_path, version, spotify_id, language) or "")[:200]
+                for spotify_id, language in zip(results_df.song_spotify_id, results_df.language)
+            ]
+            timings["snippets"] = time.perf_counter() - start
+
+            st.dataframe(results_df)
+            st.caption(" | ".join(f"{stage}: {seconds * 1000:.0f} ms" for stage, seconds in timings.items()))
 
     st.header("Multilingual lyrics embedding")
     color_lyrics = st.selectbox("Color selection", options=["song_name", "language"], index=0)
-    st.plotly_chart(
-        px.scatter(
-            data_frame=lyrics_df,
-            x="lyrics_x",
-            y="lyrics_y",
-            hover_data=["song_name", "language", "song_spotify_id"],
-            color=color_lyrics
-        )
-    )
+    plot_embedding(lyrics_df, x="lyrics_x", y="lyrics_y", id_column="song_spotify_id", color=color_lyrics,
+                   hover_data=["song_name", "language", "song_spotify_id"], key="lyrics")
     with st.expander("Multilingual lyrics embedding table"):
-        if st.checkbox("Add filters", key="lyrics"):
-            st.dataframe(filter_dataframe(lyrics_df, key="lyrics"))
-        else:
-            st.dataframe(lyrics_df)
+        st.dataframe(filter_dataframe(lyrics_df, lyrics_engine, "vector_id", key="lyrics"))
 
     st.header("Audio features embedding")
     color_audio = st.selectbox("Color selection",
@@ -177,28 +261,45 @@ def app():
                                           'speechiness', 'tempo'],
                                  index=0
                                  )
-    st.plotly_chart(
-        px.scatter(
-            data_frame=song_df,
-            x="audio_x", y="audio_y",
-            hover_data=['song_name', 'valence', 'acousticness', 'danceability',
-                        'duration_ms', 'energy', 'instrumentalness', 'liveness',
-                        'speechiness', 'tempo'],
-            color=color_audio
-        )
-    )
+    plot_embedding(song_df, x="audio_x", y="audio_y", id_column="song_spotify_id", color=color_audio,
+                   hover_data=['song_name', 'song_spotify_id', 'valence', 'acousticness', 'danceability',
+                               'duration_ms', 'energy', 'instrumentalness', 'liveness',
+                               'speechiness', 'tempo'],
+                   key="audio")
     with st.expander("Audio features embedding table"):
-        if st.checkbox("Add filters", key="audio"):
-            st.dataframe(filter_dataframe(song_df, key="audio"))
+        st.dataframe(filter_dataframe(song_df, audio_engine, "song_spotify_id", key="audio"))
+
+    st.header("Lyrics + audio similarity")
+    hybrid_index = get_hybrid_index(base_path.joinpath("data/search"))
+    if hybrid_index is None:
+        st.info("Build the search index with `scripts/build_search_index.py`")
+    else:
+        spotify_id_similar = st.text_input("Input Spotify id", value="0yLdNVWF3Srea0uzk55zFn", key="similar")
+        lyrics_weight = st.slider("Lyrics weight (audio weight is the complement)", min_value=0.0, max_value=1.0, value=0.5, step=0.05)
+        query_lyrics = [
+            all_lyrics_df.vector_id.iloc[position]
+            for position in lyrics_index.get(spotify_id_similar, {}).values()
+            if all_lyrics_df.vector_id.iloc[position] in hybrid_index.positions
+        ]
+        if query_lyrics:
+            similar_df = hybrid_index.similar(
+                query_lyrics[0],
+                k=10,
+                lyrics_weight=lyrics_weight,
+                audio_weight=1 - lyrics_weight,
+                mask=np.isin(hybrid_index.vector_ids, selected_lyrics_df.vector_id.to_numpy()),
+            )
+            st.dataframe(similar_df.merge(selected_lyrics_df[["vector_id", "song_name", "language"]], on="vector_id", how="left"))
         else:
-            st.dataframe(song_df)
+            st.write("No indexed lyrics for this song")
 
     with st.sidebar:
         spotify_id_request = st.text_input("Input Spotify id (from plot hover)", value="0yLdNVWF3Srea0uzk55zFn")
         components.iframe(f"https://open.spotify.com/embed/track/{spotify_id_request}?utm_source=generator")
-        available_language = lyrics_df.loc[lyrics_df.song_spotify_id == spotify_id_request, "language"].sort_values()
+        available_language = list(lyrics_index.get(spotify_id_request, {}))
         selected_language = st.selectbox("Select Lyrics Language", options=available_language)
-        st.text(lyrics_df.loc[(lyrics_df.song_spotify_id == spotify_id_request) & (lyrics_df.language == selected_language), "lyrics_text"].values[0])
+        if selected_language is not None:
+            st.text(load_lyrics_text(lyrics_path, version, spotify_id_request, selected_language))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+"""Per-playlist aggregates behind the market comparison views, small enough to keep in memory.
+
+Every `Top 50 - <market>` playlist stands for one market. The tables are keyed on `playlist_spotify_id`
+and rebuilt only for the playlists whose songs, audio features or lyrics changed, see
+`scripts/aggregate_playlists.py`:
+
+- `playlist_table`: name, market and counts of songs and lyrics
+- `playlist_features`: mean and quantiles of each audio feature
+- `playlist_languages`: songs with lyrics in each language, and their share of the playlist songs with lyrics
+- `playlist_centroids`: mean of the L2-normalized lyrics embeddings of the playlist songs
+- `playlist_overlap`: songs shared with every other playlist, stored in both directions
+"""
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .bulk import write_parquet
+from .tables import read_table
+
+
+# table name -> columns holding playlist ids; a playlist's rows are the ones where any of them matches
+AGGREGATE_TABLES = {
+    "playlist_table": ["playlist_spotify_id"],
+    "playlist_features": ["playlist_spotify_id"],
+    "playlist_languages": ["playlist_spotify_id"],
+    "playlist_centroids": ["playlist_spotify_id"],
+    "playlist_overlap": ["playlist_spotify_id", "other_spotify_id"],
+}
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+MARKET_PREFIX = "Top 50 - "
+
+
+def market_name(playlist_name: str) -> str:
+    return playlist_name[len(MARKET_PREFIX):] if playlist_name.startswith(MARKET_PREFIX) else playlist_name
+
+
+def playlist_summary(membership_df: pd.DataFrame, lyrics_df: pd.DataFrame) -> pd.DataFrame:
+    """`membership_df` has one row per (playlist, song) with `playlist_name`; `lyrics_df` one per lyrics with `song_spotify_id`"""
+    playlists = membership_df.groupby("playlist_spotify_id", sort=True).agg(
+        playlist_name=("playlist_name", "first"),
+        n_songs=("song_spotify_id", "nunique"),
+    )
+    with_lyrics = membership_df.loc[membership_df.song_spotify_id.isin(lyrics_df.song_spotify_id)]
+    playlists["n_songs_with_lyrics"] = with_lyrics.groupby("playlist_spotify_id").song_spotify_id.nunique()
+    playlists = playlists.fillna({"n_songs_with_lyrics": 0}).astype({"n_songs_with_lyrics": "int64"})
+    playlists.insert(1, "market", playlists.playlist_name.map(market_name))
+    return playlists.reset_index()
+
+
+def feature_stats(membership_df: pd.DataFrame, features_df: pd.DataFrame, features: list[str]) -> pd.DataFrame:
+    """One row per (playlist, feature): songs with the feature, mean and `QUANTILES`; songs without audio features are left out"""
+    values = (
+        membership_df[["playlist_spotify_id", "song_spotify_id"]]
+        .merge(features_df[["song_spotify_id", *features]], on="song_spotify_id")
+        .melt(id_vars=["playlist_spotify_id"], value_vars=features, var_name="feature")
+        .dropna(subset=["value"])
+    )
+    grouped = values.groupby(["playlist_spotify_id", "feature"], sort=True).value
+    quantiles = grouped.quantile(list(QUANTILES)).unstack()
+    quantiles.columns = [f"q{round(q * 100)}" for q in quantiles.columns]
+    return grouped.agg(n_songs="count", mean="mean").join(quantiles).reset_index()
+
+
+def language_mix(membership_df: pd.DataFrame, lyrics_df: pd.DataFrame) -> pd.DataFrame:
+    """A song counts once per language it has lyrics in, so shares may add up to more than 1 with translations"""
+    songs = (
+        membership_df[["playlist_spotify_id", "song_spotify_id"]]
+        .merge(lyrics_df[["song_spotify_id", "language"]].drop_duplicates(), on="song_spotify_id")
+    )
+    mix = songs.groupby(["playlist_spotify_id", "language"], sort=True).song_spotify_id.nunique().rename("n_songs").reset_index()
+    with_lyrics = songs.groupby("playlist_spotify_id").song_spotify_id.nunique()
+    mix["share"] = mix.n_songs / mix.playlist_spotify_id.map(with_lyrics)
+    return mix
+
+
+def lyrics_centroids(membership_df: pd.DataFrame, song_ids: Optional[np.ndarray] = None, vectors: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """Mean of the rows of `vectors` (one per lyrics, L2-normalized, possibly memory-mapped) whose song is in the playlist.
+
+    Only the rows of the playlist songs are read, in file order. Playlists without vectors get a null centroid.
+    """
+    song_ids = np.asarray(song_ids if song_ids is not None else [], dtype=object)
+    rows = pd.DataFrame(dict(song_spotify_id=song_ids, position=np.arange(len(song_ids))))
+    positions = membership_df[["playlist_spotify_id", "song_spotify_id"]].merge(rows, on="song_spotify_id")
+    positions = dict(list(positions.groupby("playlist_spotify_id").position))
+
+    records = []
+    for playlist_spotify_id in sorted(membership_df.playlist_spotify_id.unique()):
+        centroid = None
+        if playlist_spotify_id in positions:
+            centroid = np.asarray(vectors[np.sort(positions[playlist_spotify_id].to_numpy())], dtype=np.float32).mean(axis=0)
+        records.append(dict(playlist_spotify_id=playlist_spotify_id, n_vectors=len(positions.get(playlist_spotify_id, [])),
+                            centroid=centroid))
+    return pd.DataFrame(records, columns=["playlist_spotify_id", "n_vectors", "centroid"])
+
+
+def overlap_pairs(pairs_df: pd.DataFrame) -> pd.DataFrame:
+    """Add the reverse of each `(playlist_spotify_id, other_spotify_id, n_shared)` pair, so either side can be looked up"""
+    reverse = pairs_df.rename(columns=dict(playlist_spotify_id="other_spotify_id", other_spotify_id="playlist_spotify_id"))
+    return (
+        pd.concat([pairs_df, reverse[pairs_df.columns]], ignore_index=True)
+        .drop_duplicates(["playlist_spotify_id", "other_spotify_id"])
+        .sort_values(["playlist_spotify_id", "other_spotify_id"], ignore_index=True)
+    )
+
+
+def centroid_similarity(centroids_df: pd.DataFrame) -> pd.DataFrame:
+    """Cosine similarity of the playlist centroids, indexed both ways by `playlist_spotify_id`"""
+    centroids_df = centroids_df.dropna(subset=["centroid"])
+    if centroids_df.empty:
+        return pd.DataFrame()
+    centroids = np.stack(centroids_df.centroid.to_numpy()).astype(np.float32)
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    centroids = centroids / np.where(norms > 0, norms, 1)
+    ids = centroids_df.playlist_spotify_id.to_numpy()
+    return pd.DataFrame(centroids @ centroids.T, index=ids, columns=ids)
+
+
+def read_aggregate(tables_dir: str | Path, name: str) -> Optional[pd.DataFrame]:
+    file_path = Path(tables_dir).joinpath(f"{name}.parquet")
+    return read_table(file_path) if file_path.exists() else None
+
+
+def merge_aggregate(stored_df: Optional[pd.DataFrame], updated_df: pd.DataFrame, name: str,
+                    playlist_ids: Optional[set[str]] = None) -> pd.DataFrame:
+    """Replace the rows of `playlist_ids` with `updated_df`; every row when `playlist_ids` is None or nothing is stored"""
+    if stored_df is None or playlist_ids is None:
+        return updated_df.reset_index(drop=True)
+    touched = np.zeros(len(stored_df), dtype=bool)
+    for column in AGGREGATE_TABLES[name]:
+        touched |= stored_df[column].isin(playlist_ids).to_numpy()
+    kept_df = stored_df.loc[~touched]
+    merged_df = pd.concat([kept_df, updated_df], ignore_index=True) if len(kept_df) else updated_df
+    return merged_df.sort_values(AGGREGATE_TABLES[name], kind="stable", ignore_index=True)
+
+
+def write_aggregate(df: pd.DataFrame, tables_dir: str | Path, name: str) -> int:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return write_parquet(table.to_batches(), Path(tables_dir).joinpath(f"{name}.parquet"), schema=table.schema)
+
+
+def compare_markets(tables: dict[str, pd.DataFrame], playlist_names: Optional[list[str]] = None) -> dict[str, pd.DataFrame]:
+    """Market x value views of the aggregate `tables` for the selected playlists, all when None; nothing is recomputed from songs"""
+    playlist_df = tables["playlist_table"]
+    if playlist_names:
+        playlist_df = playlist_df.loc[playlist_df.playlist_name.isin(playlist_names)]
+    markets = dict(zip(playlist_df.playlist_spotify_id, playlist_df.market))
+
+    def selected(name: str) -> pd.DataFrame:
+        df = tables[name]
+        mask = np.ones(len(df), dtype=bool)
+        for column in AGGREGATE_TABLES[name]:
+            mask &= df[column].isin(markets).to_numpy()
+        return df.loc[mask].assign(market=lambda df: df.playlist_spotify_id.map(markets))
+
+    similarity_df = centroid_similarity(selected("playlist_centroids"))
+    return dict(
+        playlists=playlist_df.set_index("market")[["playlist_name", "n_songs", "n_songs_with_lyrics"]],
+        features=selected("playlist_features").pivot(index="market", columns="feature", values="mean"),
+        languages=selected("playlist_languages").pivot(index="market", columns="language", values="share").fillna(0),
+        overlap=(
+            selected("playlist_overlap")
+            .assign(other_market=lambda df: df.other_spotify_id.map(markets))
+            .pivot(index="market", columns="other_market", values="n_shared")
+            .fillna(0)
+        ),
+        lyrics_similarity=similarity_df.rename(index=markets, columns=markets),
+    )
@@ -0,0 +1,97 @@
+"""Bulk reads of the SQLite tables into Arrow, for exports and full scans.
+
+Core `SELECT`s are streamed in chunks and each chunk becomes one typed record batch, column by column,
+without ORM objects, identity map or per-row dicts.
+"""
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import types
+from sqlalchemy.sql import Select
+
+from .database import engine as default_engine
+
+
+# first match wins
+ARROW_TYPES = [
+    (types.Boolean, pa.bool_()),
+    (types.Integer, pa.int64()),
+    (types.Float, pa.float64()),
+    (types.Numeric, pa.float64()),
+    (types.DateTime, pa.timestamp("us")),
+    (types.Date, pa.date32()),
+    (types.LargeBinary, pa.binary()),
+    (types.String, pa.string()),
+]
+
+
+def arrow_type(column_type) -> Optional[pa.DataType]:
+    """None for column types without a mapping, left for Arrow to infer"""
+    for sql_type, arrow_type_ in ARROW_TYPES:
+        if isinstance(column_type, sql_type):
+            return arrow_type_
+    return None
+
+
+def arrow_schema(query: Select) -> pa.Schema:
+    return pa.schema([
+        pa.field(column.name, arrow_type(column.type) or pa.null())
+        for column in query.selected_columns
+    ])
+
+
+def iter_record_batches(query: Select, batch_size: int = 65536, engine=None) -> Iterator[pa.RecordBatch]:
+    """Stream the rows of `query` as record batches of at most `batch_size` rows, typed from the selected columns"""
+    schema = arrow_schema(query)
+    with (engine or default_engine).connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        for rows in result.partitions(batch_size):
+            columns = zip(*rows)
+            arrays = [
+                pa.array(values, type=None if pa.types.is_null(field.type) else field.type)
+                for field, values in zip(schema, columns)
+            ]
+            yield pa.RecordBatch.from_arrays(arrays, names=schema.names)
+
+
+def read_arrow(query: Select, batch_size: int = 65536, engine=None) -> pa.Table:
+    batches = list(iter_record_batches(query, batch_size, engine))
+    if not batches:
+        return arrow_schema(query).empty_table()
+    return pa.Table.from_batches(batches)
+
+
+def read_dataframe(query: Select, batch_size: int = 65536, engine=None) -> pd.DataFrame:
+    return read_arrow(query, batch_size, engine).to_pandas()
+
+
+def write_parquet(batches: Iterator[pa.RecordBatch], file_path: str | Path, schema: Optional[pa.Schema] = None) -> int:
+    """Write record batches as they come, so only one is held in memory; returns the rows written.
+
+    Without any batch, an empty file is written with `schema`, or nothing when it is None.
+    """
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+
+    n_rows = 0
+    writer = None
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, batch.schema)
+            writer.write_batch(batch)
+            n_rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        if schema is None:
+            return 0
+        pq.write_table(schema.empty_table(), tmp_path)
+    tmp_path.replace(file_path)  # readers never see a partial file
+    return n_rows
@@ -0,0 +1,112 @@
+"""Change-data-capture for the SQLite tables.
+
+SQLite triggers append every insert, update and delete to `changelog`, in the same transaction as the
+change, so ORM sessions, relationship link rows and raw SQL are all captured. Downstream consumers read
+the changes after their own cursor and advance it once handled; `compact` drops what every consumer has seen,
+except the last change of each table.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, text
+from sqlmodel import SQLModel, Session, func, select
+
+from .models import ChangeLog, ChangeLogCursor
+
+
+COMPACTED = "__compacted__"  # cursor row holding the highest sequence number removed by compaction
+
+
+def trigger_statements(table) -> list[str]:
+    statements = []
+    for operation, event, ref in (("insert", "INSERT", "NEW"), ("update", "UPDATE", "NEW"), ("delete", "DELETE", "OLD")):
+        name = f"changelog_{table.name}_{operation}"
+        row = ", ".join(f"'{column.name}', {ref}.\"{column.name}\"" for column in table.columns)
+        statements.append(f"DROP TRIGGER IF EXISTS {name}")
+        statements.append(
+            f"CREATE TRIGGER {name} AFTER {event} ON \"{table.name}\" BEGIN "
+            f"INSERT INTO {ChangeLog.__tablename__} (table_name, operation, row, changed_at) "
+            f"VALUES ('{table.name}', '{operation}', json_object({row}), strftime('%Y-%m-%dT%H:%M:%f', 'now')); END"
+        )
+    return statements
+
+
+def install_triggers(engine) -> None:
+    """(Re)create the triggers of every table, so they follow schema changes; tables with `info["changelog"]` False are skipped"""
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.info.get("changelog", True):
+                for statement in trigger_statements(table):
+                    connection.execute(text(statement))
+
+
+def latest_seq(session: Session, table_name: Optional[str] = None) -> int:
+    query = select(func.max(ChangeLog.seq))
+    if table_name is not None:
+        query = query.where(ChangeLog.table_name == table_name)  # the index on table_name ends with seq, the rowid
+    return session.exec(query).one() or 0
+
+
+def cursor_seq(session: Session, consumer: str) -> int:
+    cursor = session.get(ChangeLogCursor, consumer)
+    return cursor.seq if cursor is not None else 0
+
+
+def read_changes(session: Session, consumer: str, tables: Optional[list[str]] = None,
+                 until: Optional[int] = None) -> Optional[list[ChangeLog]]:
+    """Changes after the consumer's cursor up to `until`, oldest first.
+
+    None when the consumer has no cursor yet, or compaction removed changes it hasn't seen: it must rescan its tables.
+    """
+    cursor = session.get(ChangeLogCursor, consumer)
+    if cursor is None or cursor.seq < cursor_seq(session, COMPACTED):
+        return None
+    position = cursor.seq
+
+    query = select(ChangeLog).where(ChangeLog.seq > position).order_by(ChangeLog.seq)
+    if until is not None:
+        query = query.where(ChangeLog.seq <= until)
+    if tables is not None:
+        query = query.where(ChangeLog.table_name.in_(tables))
+    return session.exec(query).all()
+
+
+def net_changes(changes: list[ChangeLog]) -> list[tuple[str, str, dict]]:
+    """`(table name, operation, row)` of the last change of each row, so a row changed N times is handled once"""
+    latest = {}
+    for change in changes:
+        row = json.loads(change.row)
+        primary_key = tuple(row[column.name] for column in SQLModel.metadata.tables[change.table_name].primary_key.columns)
+        latest.pop((change.table_name, primary_key), None)  # keep the order of the last change
+        latest[(change.table_name, primary_key)] = (change.table_name, change.operation, row)
+    return list(latest.values())
+
+
+def advance_cursor(session: Session, consumer: str, seq: int) -> None:
+    cursor = session.get(ChangeLogCursor, consumer) or ChangeLogCursor(consumer=consumer, seq=seq)
+    cursor.seq = seq
+    cursor.updated_at = datetime.now(timezone.utc)
+    session.add(cursor)
+    session.commit()
+
+
+def compact(session: Session, retention: Optional[timedelta] = None) -> int:
+    """Delete the changes every consumer has handled and, with `retention`, any older than it.
+
+    The last change of each table is kept, so `latest_seq(session, table_name)` survives compaction.
+    Consumers lagging behind the retention get None from `read_changes` and rescan. Returns the rows deleted.
+    """
+    cursors = session.exec(select(ChangeLogCursor.seq).where(ChangeLogCursor.consumer != COMPACTED)).all()
+    upto = min(cursors, default=latest_seq(session))
+    if retention is not None:
+        cutoff = (datetime.now(timezone.utc) - retention).replace(tzinfo=None).isoformat(timespec="milliseconds")  # as written by the triggers
+        expired = session.exec(select(func.max(ChangeLog.seq)).where(ChangeLog.changed_at < cutoff)).one()
+        upto = max(upto, expired or 0)
+
+    last_changes = select(func.max(ChangeLog.seq)).group_by(ChangeLog.table_name)
+    deleted = session.execute(delete(ChangeLog).where(ChangeLog.seq <= upto, ChangeLog.seq.not_in(last_changes))).rowcount
+    if upto > cursor_seq(session, COMPACTED):
+        advance_cursor(session, COMPACTED, upto)
+    session.commit()
+    return deleted
@@ -0,0 +1,202 @@
+"""Chart history: one row per (date, playlist, position, song) of every Top 50 snapshot polled.
+
+`SongPlaylistLink` only holds the current membership, so every poll also appends its snapshot here.
+Rows are stored in one Parquet file per month (`month=YYYY-MM` directories), sorted by playlist, date
+and position, so that:
+
+- `date` and `position` are delta-encoded: within a playlist they step by 0 or 1 and pack to a few bits
+- ids and market names are dictionary-encoded: a month repeats a few thousand songs
+- date ranges only open the months they span, and only the columns a query needs are read
+- `songs.parquet` lists the months each song charted in, so a trajectory only opens those
+
+A month file is small (markets x 50 x 31 rows) and rewritten whole on append, through a temporary file.
+"""
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .tables import data_version
+
+
+SCHEMA = pa.schema([
+    ("date", pa.date32()),
+    ("playlist_spotify_id", pa.string()),
+    ("market", pa.string()),
+    ("position", pa.int16()),
+    ("song_spotify_id", pa.string()),
+])
+SORT_KEYS = [("playlist_spotify_id", "ascending"), ("date", "ascending"), ("position", "ascending")]
+DELTA_COLUMNS = ["date", "position"]
+DICTIONARY_COLUMNS = ["playlist_spotify_id", "market", "song_spotify_id"]
+# read as dictionaries too: filters compare the distinct values once, rows by integer code
+PARQUET_FORMAT = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=DICTIONARY_COLUMNS))
+SONG_INDEX = "songs.parquet"
+# where the pollers write and the dashboard reads, unless `charts.history_dir` points the pollers elsewhere
+DEFAULT_HISTORY_DIR = Path(__file__).parents[1].joinpath("data", "charts")
+
+
+def month_key(day: date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def write_atomic(table: pa.Table, file_path: Path, **kwargs) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    pq.write_table(table, tmp_path, compression="zstd", **kwargs)
+    tmp_path.replace(file_path)  # readers never see a partial file
+
+
+def write_month(table: pa.Table, file_path: Path) -> None:
+    write_atomic(table.sort_by(SORT_KEYS), file_path, use_dictionary=DICTIONARY_COLUMNS,
+                 column_encoding={name: "DELTA_BINARY_PACKED" for name in DELTA_COLUMNS})
+
+
+def latest_charts(df: pd.DataFrame, day: pd.Timestamp) -> pd.DataFrame:
+    """Rows of each playlist's last snapshot on or before `day`"""
+    df = df.loc[df.date <= day]
+    return df.loc[df.date == df.groupby("playlist_spotify_id").date.transform("max")]
+
+
+class ChartHistory:
+    """Append-only store of chart snapshots under `history_dir`"""
+
+    def __init__(self, history_dir: str | Path):
+        self.history_dir = Path(history_dir)
+
+    def month_path(self, month: str) -> Path:
+        return self.history_dir.joinpath(f"month={month}", "part-0.parquet")
+
+    def partitions(self) -> list[Path]:
+        return sorted(self.history_dir.glob("month=*/part-0.parquet"))
+
+    def version(self) -> str:
+        """Changes with every append, to key caches on"""
+        return "|".join(f"{path.parent.name}:{data_version(path)}" for path in self.partitions())
+
+    def append(self, rows: list[dict], day: Optional[date] = None) -> int:
+        """Record one poll: `rows` of `playlist_spotify_id`, `market`, `position` and `song_spotify_id`.
+
+        `day` defaults to today in UTC. A playlist polled again on the same day replaces its earlier snapshot of
+        that day. Returns the rows written.
+        """
+        if not rows:
+            return 0
+        day = day or datetime.now(timezone.utc).date()
+        snapshot = pa.Table.from_pylist([dict(row, date=day) for row in rows], schema=SCHEMA)
+
+        file_path = self.month_path(month_key(day))
+        if file_path.exists():
+            stored = pq.read_table(file_path, schema=SCHEMA)
+            polled = pc.and_(
+                pc.equal(stored["date"], pa.scalar(day, pa.date32())),
+                pc.is_in(stored["playlist_spotify_id"], value_set=snapshot["playlist_spotify_id"].unique()),
+            )
+            snapshot = pa.concat_tables([stored.filter(pc.invert(polled)), snapshot])
+        write_month(snapshot, file_path)
+        self.index_month(month_key(day), snapshot)
+        return len(rows)
+
+    def index_month(self, month: str, table: pa.Table) -> None:
+        """Replace the songs of `month` in the song index with the ones of its rows"""
+        songs = pa.table(dict(song_spotify_id=table["song_spotify_id"].unique()))
+        songs = songs.append_column("month", pa.array([month] * len(songs), type=pa.string()))
+        index_path = self.history_dir.joinpath(SONG_INDEX)
+        if index_path.exists():
+            index = pq.read_table(index_path)
+            songs = pa.concat_tables([index.filter(pc.not_equal(index["month"], month)), songs])
+        write_atomic(songs.sort_by([("song_spotify_id", "ascending"), ("month", "ascending")]), index_path,
+                     use_dictionary=["month"])
+
+    def song_months(self, song_spotify_id: str) -> Optional[set[str]]:
+        """Months the song charted in; None without a song index"""
+        index_path = self.history_dir.joinpath(SONG_INDEX)
+        if not index_path.exists():
+            return None
+        index = pq.read_table(index_path, filters=[("song_spotify_id", "==", song_spotify_id)], columns=["month"])
+        return set(index["month"].to_pylist())
+
+    def read(self, start: Optional[date] = None, end: Optional[date] = None, filter: Optional[ds.Expression] = None,
+             columns: Optional[list[str]] = None, months: Optional[set[str]] = None) -> pd.DataFrame:
+        """Rows between `start` and `end` included, matching `filter`; only the months in the range, and in `months`, are opened"""
+        first, last = month_key(start or date.min), month_key(end or date.max)
+        paths = [
+            path for path in self.partitions()
+            if first <= (month := path.parent.name.removeprefix("month=")) <= last and (months is None or month in months)
+        ]
+        if not paths:
+            return SCHEMA.empty_table().to_pandas(date_as_object=False)[columns or SCHEMA.names]
+
+        conditions = [] if filter is None else [filter]
+        if start is not None:
+            conditions.append(ds.field("date") >= pa.scalar(start, pa.date32()))
+        if end is not None:
+            conditions.append(ds.field("date") <= pa.scalar(end, pa.date32()))
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+
+        dataset = ds.dataset([str(path) for path in paths], format=PARQUET_FORMAT)
+        table = dataset.to_table(columns=columns, filter=expression)
+        table = table.cast(pa.schema([SCHEMA.field(name) for name in table.column_names]))  # dictionaries back to strings
+        return table.to_pandas(date_as_object=False)
+
+    def trajectory(self, song_spotify_id: str, start: Optional[date] = None, end: Optional[date] = None) -> pd.DataFrame:
+        """Daily position of a song in every market it charted in, by market then date"""
+        df = self.read(start, end, filter=ds.field("song_spotify_id") == song_spotify_id,
+                       columns=["date", "market", "playlist_spotify_id", "position"], months=self.song_months(song_spotify_id))
+        return df.sort_values(["market", "date"], ignore_index=True)
+
+    def chart(self, day: Optional[date] = None, playlist_ids: Optional[list[str]] = None, lookback: int = 7) -> pd.DataFrame:
+        """Each playlist's last snapshot on or before `day` (the latest polled day by default), up to `lookback` days old"""
+        day = day or self.last_day()
+        if day is None:
+            return self.read(columns=SCHEMA.names)
+        filter = ds.field("playlist_spotify_id").isin(playlist_ids) if playlist_ids else None
+        df = self.read(day - timedelta(days=lookback), day, filter=filter)
+        return latest_charts(df, pd.Timestamp(day)).reset_index(drop=True)
+
+    def entries_exits(self, day: Optional[date] = None, days: int = 7, playlist_ids: Optional[list[str]] = None,
+                      lookback: int = 7) -> pd.DataFrame:
+        """Songs that entered or left each chart between `days` before `day` and `day`.
+
+        Each side is the playlist's last snapshot on or before that date, up to `lookback` days older; playlists
+        without a snapshot on either side are left out. `position` is the current one for entries, the last one for exits.
+        """
+        day = day or self.last_day()
+        if day is None:
+            return pd.DataFrame(columns=["playlist_spotify_id", "market", "song_spotify_id", "change", "position"])
+        before = day - timedelta(days=days)
+        filter = ds.field("playlist_spotify_id").isin(playlist_ids) if playlist_ids else None
+        df = self.read(before - timedelta(days=lookback), day, filter=filter)
+
+        current = latest_charts(df, pd.Timestamp(day))
+        previous = latest_charts(df, pd.Timestamp(before))
+        current = current.loc[current.date > pd.Timestamp(before)]  # a playlist not polled since is unchanged, not emptied
+        playlists = set(current.playlist_spotify_id) & set(previous.playlist_spotify_id)
+        current = current.loc[current.playlist_spotify_id.isin(playlists)]
+        previous = previous.loc[previous.playlist_spotify_id.isin(playlists)]
+
+        keys = ["playlist_spotify_id", "song_spotify_id"]
+        columns = ["playlist_spotify_id", "market", "song_spotify_id", "position"]
+        merged = current.merge(previous[keys].drop_duplicates(), on=keys, how="left", indicator=True)
+        entries = merged.loc[merged._merge == "left_only", columns]
+        merged = previous.merge(current[keys].drop_duplicates(), on=keys, how="left", indicator=True)
+        exits = merged.loc[merged._merge == "left_only", columns]
+        return (
+            pd.concat([entries.assign(change="entry"), exits.assign(change="exit")], ignore_index=True)
+            [["playlist_spotify_id", "market", "song_spotify_id", "change", "position"]]
+            .sort_values(["market", "change", "position"], ignore_index=True)
+        )
+
+    def last_day(self) -> Optional[date]:
+        """Latest polled day, read from the last month only"""
+        paths = self.partitions()
+        if not paths:
+            return None
+        return pc.max(pq.read_table(paths[-1], columns=["date"])["date"]).as_py()
@@ -1,8 +1,9 @@
-import time
 from requests.exceptions import RetryError
 
 import cohere
 
+from . import metrics
+
 
 def wait_retry(wait_time, exceptions):
     def decorator(func):
@@ -10,7 +11,8 @@ def wait_retry(wait_time, exceptions):
             try:
                 return func(*args, **kwargs)
             except exceptions:
-                time.sleep(wait_time)
+                metrics.record_retry("cohere", func.__name__)
+                metrics.rate_limit_sleep("cohere", wait_time)
             return func(*args, **kwargs)
         return newfunc
     return decorator
@@ -21,12 +23,14 @@ def create_cohere_client(api_key: str) -> cohere.Client:
 
 
 @wait_retry(wait_time=60, exceptions=(RetryError,))
+@metrics.instrument()
 def detect_lyrics_language(cohere_client: cohere.Client, lyrics_snippet) -> tuple[str, str]:
     response = cohere_client.detect_language(texts=[lyrics_snippet])
     return response.results[0].language_name, response.results[0].language_code
 
 
 @wait_retry(wait_time=60, exceptions=(RetryError,))
+@metrics.instrument(size=len)
 def embed_texts(cohere_client: cohere.Client, texts=[]):
     embeds = cohere_client.embed(
         texts=texts,
@@ -36,3 +40,15 @@ def embed_texts(cohere_client: cohere.Client, texts=[]):
     return embeds
 
 
+@metrics.instrument()
+def stream_lyrics(cohere_client: cohere.Client, prompt: str, model: str = "xlarge", max_tokens: int = 300, temperature: float = 2):
+    """Yield generated text as tokens arrive"""
+    response = cohere_client.generate(
+        model=model,
+        prompt=prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+    )
+    for token in response:
+        yield token.text
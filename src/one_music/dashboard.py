@@ -0,0 +1,76 @@
+"""Cached loaders and widgets shared by the dashboard pages.
+
+Streamlit keys `st.cache_data` and `st.cache_resource` on the function, so defining them once here
+also shares their caches between the pages; keys that differ per page say so.
+"""
+import pandas as pd
+import streamlit as st
+
+from .filters import FilterEngine
+from .tables import build_lyrics_index, read_lyrics_text
+
+
+@st.cache_data(max_entries=1024)
+def load_lyrics_text(file_path, data_version, song_spotify_id, language):
+    return read_lyrics_text(file_path, song_spotify_id, language)
+
+
+@st.cache_resource(max_entries=4)
+def get_lyrics_index(data_version, _lyrics_df):
+    """(song, language) lookups for the sidebar; built once per data version and shared across sessions.
+
+    `_lyrics_df` holds every row of the lyrics table in order, so positions are valid for any page's copy.
+    """
+    return build_lyrics_index(_lyrics_df)
+
+
+@st.cache_resource(max_entries=4)
+def get_filter_engine(key, _build_df):
+    """One engine per page, table and data version, shared across sessions and reruns; `_build_df` only runs on a miss"""
+    return FilterEngine(_build_df())
+
+
+def filter_dataframe(df: pd.DataFrame, engine: FilterEngine, id_column: str, key) -> pd.DataFrame:
+    """Nested filter function; used to filter audio_features. `df` is a selection of the engine rows, matched on `id_column`"""
+    modify = st.checkbox("Add filters", key=key)
+
+    if not modify:
+        return df
+
+    masks = []
+    if len(df) != len(engine):
+        masks.append(engine.category_mask(id_column, df[id_column].unique()))
+
+    modification_container = st.container()
+    with modification_container:
+        to_filter_columns = st.multiselect("Filter dataframe on", df.columns)
+        for column in to_filter_columns:
+            left, right = st.columns((1, 20))
+            stats = engine.column_stats(column)
+            if stats["kind"] == "categorical":
+                user_cat_input = right.multiselect(
+                    f"Values for {column}",
+                    stats["unique"],
+                    default=stats["unique"],
+                )
+                masks.append(engine.category_mask(column, user_cat_input))
+            elif stats["kind"] == "numeric":
+                _min = stats["min"]
+                _max = stats["max"]
+                step = (_max - _min) / 100
+                user_num_input = right.slider(
+                    f"Values for {column}",
+                    min_value=_min,
+                    max_value=_max,
+                    value=(_min, _max),
+                    step=step,
+                )
+                masks.append(engine.range_mask(column, *user_num_input))
+            else:
+                user_text_input = right.text_input(
+                    f"Substring or regex in {column}",
+                )
+                if user_text_input:
+                    masks.append(engine.text_mask(column, user_text_input))
+
+    return engine.apply(masks)
@@ -1,15 +1,22 @@
 from sqlmodel import SQLModel, Session, create_engine
 from sqlmodel.main import SQLModelMetaclass
 
+from . import metrics
+
 
 sqlite_url = "sqlite:///database.db"
-engine = create_engine(sqlite_url, echo=False)
+engine = create_engine(sqlite_url, echo=False, connect_args=dict(timeout=30))  # wait on locks held by concurrent pipeline stages
+metrics.instrument_database(engine)
 
 
 def create_db_and_tables():
+    from .changelog import install_triggers
+
     SQLModel.metadata.create_all(engine)
+    install_triggers(engine)
 
 
+@metrics.instrument()
 def get_or_create(session: Session, record: dict, class_: SQLModelMetaclass, primary_key: str):
     # assert class_ in METACLASSES
 
@@ -0,0 +1,199 @@
+"""Dashboard tables kept in memory per data version, reloaded in the background when a new export lands.
+
+A table is `<tables_dir>/<name>.parquet`, either one file or a directory of partition files (hive
+`key=value` directories allowed). Each partition has a version: the one listed in `manifest.json`,
+written last by the exporter, or else its mtime, size and a hash of its Parquet footer. On refresh only
+new or changed partitions are read; the others are reused, and the new snapshot replaces the old one
+in a single assignment, so readers always see a complete data version.
+"""
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from .tables import LYRICS_COLUMNS
+
+
+MANIFEST = "manifest.json"
+# what the dashboard keeps in memory: table name -> columns, None for all; lyrics texts are read on demand
+DASHBOARD_TABLES = {
+    "lyrics_table": LYRICS_COLUMNS,
+    "song_table": None,
+    "index_table": None,
+    "language_table": ["iso_code", "language_name"],
+    # per-playlist aggregates, see `aggregates`
+    "playlist_table": None,
+    "playlist_features": None,
+    "playlist_languages": None,
+    "playlist_centroids": None,
+    "playlist_overlap": None,
+}
+FOOTER_BYTES = 65536  # the Parquet footer holds the schema and row group statistics, it changes with the data
+
+
+def file_version(file_path: Path) -> str:
+    stat = file_path.stat()
+    with open(file_path, mode="rb") as f:
+        f.seek(max(stat.st_size - FOOTER_BYTES, 0))
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    return f"{stat.st_mtime_ns}-{stat.st_size}-{digest}"
+
+
+def partition_files(table_path: Path) -> list[Path]:
+    if table_path.is_dir():
+        return sorted(path for path in table_path.rglob("*.parquet") if path.is_file())
+    return [table_path] if table_path.exists() else []
+
+
+def read_manifest(tables_dir: Path) -> dict:
+    try:
+        with open(tables_dir.joinpath(MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(tables_dir: str | Path, table_names: list[str]) -> dict:
+    """Record the version of every partition of the tables, keeping the entries of the other tables.
+
+    Written atomically once the tables are complete.
+    """
+    tables_dir = Path(tables_dir)
+    manifest = read_manifest(tables_dir)
+    manifest.setdefault("tables", {}).update({
+        name: dict(partitions={
+            path.relative_to(tables_dir).as_posix(): file_version(path)
+            for path in partition_files(tables_dir.joinpath(f"{name}.parquet"))
+        })
+        for name in table_names
+    })
+    tmp_path = tables_dir.joinpath(MANIFEST + ".tmp")
+    with open(tmp_path, mode="w") as f:
+        json.dump(manifest, f, indent=2)
+    tmp_path.replace(tables_dir.joinpath(MANIFEST))
+    return manifest
+
+
+def partition_versions(tables_dir: Path, name: str, manifest: Optional[dict] = None) -> dict[str, str]:
+    """Relative path -> version of each partition of a table, from the manifest when it lists the table"""
+    manifest = read_manifest(tables_dir) if manifest is None else manifest
+    if name in manifest.get("tables", {}):
+        return dict(manifest["tables"][name]["partitions"])
+    return {
+        path.relative_to(tables_dir).as_posix(): file_version(path)
+        for path in partition_files(tables_dir.joinpath(f"{name}.parquet"))
+    }
+
+
+def read_partition(tables_dir: Path, name: str, relative_path: str, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    table_path = tables_dir.joinpath(f"{name}.parquet")
+    file_path = tables_dir.joinpath(relative_path)
+    if file_path == table_path:
+        dataset = ds.dataset(file_path, format="parquet")
+    else:  # keep the hive partition keys of the directory path as columns
+        dataset = ds.dataset([str(file_path)], format="parquet", partitioning="hive", partition_base_dir=str(table_path))
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def combined_version(versions: dict) -> str:
+    return hashlib.sha1(json.dumps(versions, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """One data version of every table; never modified, a refresh builds a new one"""
+    version: str
+    table_versions: dict[str, str]
+    tables: dict[str, pd.DataFrame]
+    partitions: dict[str, dict[str, tuple[str, pd.DataFrame]]]  # table -> relative path -> (version, rows)
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        return self.tables[name]
+
+
+class DataStore:
+    """Snapshot of the tables in `columns` (table name -> columns to keep, None for all), refreshed every `interval` seconds"""
+
+    def __init__(self, tables_dir: str | Path, columns: dict[str, Optional[list[str]]] = DASHBOARD_TABLES, interval: float = 30.0):
+        self.tables_dir = Path(tables_dir)
+        self.columns = columns
+        self.interval = interval
+        self._snapshot: Optional[Snapshot] = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refresh()
+
+    def snapshot(self) -> Snapshot:
+        """Take it once per rerun, so every table read in the rerun comes from the same data version"""
+        return self._snapshot
+
+    def refresh(self) -> bool:
+        """Load the partitions that changed since the current snapshot; True when a new snapshot was swapped in"""
+        with self._refresh_lock:
+            manifest = read_manifest(self.tables_dir)
+            previous = self._snapshot.partitions if self._snapshot is not None else {}
+
+            partitions = {}
+            for name, columns in self.columns.items():
+                known = previous.get(name, {})
+                partitions[name] = {}
+                for relative_path, version in partition_versions(self.tables_dir, name, manifest).items():
+                    if relative_path in known and known[relative_path][0] == version:
+                        partitions[name][relative_path] = known[relative_path]
+                    else:
+                        partitions[name][relative_path] = (version, read_partition(self.tables_dir, name, relative_path, columns))
+
+            table_versions = {name: combined_version({path: version for path, (version, _) in table.items()})
+                              for name, table in partitions.items()}
+            if self._snapshot is not None and table_versions == self._snapshot.table_versions:
+                return False
+
+            tables = {}
+            for name, table in partitions.items():
+                if self._snapshot is not None and table_versions[name] == self._snapshot.table_versions[name]:
+                    tables[name] = self._snapshot.tables[name]
+                elif table:
+                    tables[name] = pd.concat([rows for _, rows in table.values()], ignore_index=True)
+                else:
+                    tables[name] = pd.DataFrame(columns=self.columns[name] or [])
+
+            self._snapshot = Snapshot(combined_version(table_versions), table_versions, tables, partitions)
+            return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                if self.refresh():
+                    print(f"[datastore] data version {self._snapshot.version} loaded")
+            except Exception as e:  # e.g. an export in progress; the current snapshot stays in use
+                print(f"[datastore] refresh failed: {type(e).__name__}: {e}")
+
+    def start(self) -> "DataStore":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="datastore-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+_stores: dict[Path, DataStore] = {}
+_stores_lock = threading.Lock()
+
+
+def shared_store(tables_dir: str | Path, interval: float = 30.0) -> DataStore:
+    """One started store of the `DASHBOARD_TABLES` per tables directory, shared by every page and session of the process"""
+    tables_dir = Path(tables_dir).resolve()
+    with _stores_lock:
+        if tables_dir not in _stores:
+            _stores[tables_dir] = DataStore(tables_dir, interval=interval).start()
+        return _stores[tables_dir]
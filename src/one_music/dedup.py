@@ -0,0 +1,108 @@
+"""Near-duplicate lyrics detection with MinHash signatures and an LSH index stored in SQLite.
+
+Genius serves the same lyrics under several URLs: re-uploads, near-identical romanizations and "translations"
+in the original language. Each parsed lyrics gets a MinHash signature of its word shingles, cut into bands;
+lyrics sharing the bucket of any band are candidates, kept when their estimated Jaccard similarity reaches
+the threshold. A cluster is represented by its first indexed lyrics, the only one embedded downstream.
+"""
+import hashlib
+import re
+from typing import Optional
+
+import numpy as np
+from sqlmodel import Session, select
+
+from .models import Lyrics, LyricsBand, LyricsDuplicate, LyricsSignature
+
+
+NUM_PERM = 128
+N_BANDS = 32  # 4 rows per band: pairs above ~0.45 similarity almost always share a bucket
+SHINGLE_SIZE = 3  # words
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+# fixed seed: signatures are stored, the permutations must not change between runs
+_rng = np.random.default_rng(20230127)
+_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)  # a * 32 bit hash + b stays below 2**64
+_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set[int]:
+    """32 bit hashes of the lowercased word `size`-grams; case, punctuation and line breaks are ignored"""
+    words = re.findall(r"\w+", text.lower())
+    grams = {" ".join(words[i:i+size]) for i in range(max(len(words) - size + 1, 1))} if words else set()
+    return {int.from_bytes(hashlib.sha1(gram.encode("utf-8")).digest()[:4], "big") for gram in grams}
+
+
+def minhash(hashes: set[int]) -> np.ndarray:
+    """Minimum of each of the `NUM_PERM` universal hash permutations over the shingle hashes"""
+    x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    return ((np.outer(x, _A) + _B) % MERSENNE_PRIME).min(axis=0)
+
+
+def band_buckets(signature: np.ndarray) -> list[str]:
+    """Bucket of each band of the signature"""
+    return [hashlib.sha1(band.tobytes()).hexdigest()[:16] for band in np.split(signature, N_BANDS)]
+
+
+def similarity(signature: np.ndarray, other: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingles behind two signatures"""
+    return float(np.mean(signature == other))
+
+
+def representative_url(session: Session, genius_url: str) -> str:
+    duplicate = session.get(LyricsDuplicate, genius_url)
+    return duplicate.representative_url if duplicate is not None else genius_url
+
+
+def cluster_members(session: Session, representative: str) -> list[str]:
+    """Genius urls of the duplicates represented by `representative`, itself excluded"""
+    query = select(LyricsDuplicate.genius_url).where(LyricsDuplicate.representative_url == representative)
+    return sorted(session.exec(query))
+
+
+def index_lyrics(session: Session, genius_url: str, lyrics_txt: str, threshold: float = 0.8) -> Optional[LyricsDuplicate]:
+    """Add parsed lyrics to the LSH index and link them to the most similar indexed lyrics' cluster, if any.
+
+    Returns the duplicate link, None for lyrics represented by themselves. The caller commits, and serializes
+    indexing: two lyrics indexed in concurrent transactions can't see each other and would both represent themselves.
+    """
+    if session.get(LyricsSignature, genius_url) is not None:  # already indexed
+        return session.get(LyricsDuplicate, genius_url)
+
+    hashes = shingles(lyrics_txt)
+    if not hashes:
+        # empty signature, in no bucket: marks the lyrics as indexed so later runs don't retry them
+        session.add(LyricsSignature(genius_url=genius_url, signature=b""))
+        return None
+    signature = minhash(hashes)
+    buckets = band_buckets(signature)
+
+    query = select(LyricsBand).where(LyricsBand.bucket.in_(buckets))
+    candidates = {band.genius_url for band in session.exec(query) if buckets[band.band] == band.bucket}
+
+    best_url, best_similarity = None, threshold
+    for candidate in sorted(candidates):
+        stored = np.frombuffer(session.get(LyricsSignature, candidate).signature, dtype=np.uint64)
+        if (candidate_similarity := similarity(signature, stored)) >= best_similarity:
+            best_url, best_similarity = candidate, candidate_similarity
+
+    session.add(LyricsSignature(genius_url=genius_url, signature=signature.tobytes()))
+    for band, bucket in enumerate(buckets):
+        session.add(LyricsBand(band=band, bucket=bucket, genius_url=genius_url))
+
+    if best_url is None:
+        return None
+    duplicate = LyricsDuplicate(genius_url=genius_url, representative_url=representative_url(session, best_url),
+                                similarity=best_similarity)
+    session.add(duplicate)
+    return duplicate
+
+
+def lyrics_missing_signature(session: Session) -> list[Lyrics]:
+    """Lyrics not indexed yet, oldest first so the earliest lyrics of a cluster represents it"""
+    query = (
+        select(Lyrics)
+        .where(Lyrics.genius_url.not_in(select(LyricsSignature.genius_url)))
+        .order_by(Lyrics.created_at, Lyrics.genius_url)
+    )
+    return session.exec(query).all()
@@ -0,0 +1,232 @@
+"""In-process stand-ins for the Spotify, Genius, Cohere and Pinecone clients, and a local server for Genius HTML pages.
+
+They answer the calls made by the wrappers in `one_music` with a synthetic corpus, after a configurable
+latency and under a configurable rate limit, so ingestion can be benchmarked without spending API quota.
+"""
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Optional
+
+import numpy as np
+
+from . import metrics
+
+
+LANGUAGES = [("English", "en"), ("Spanish", "es"), ("Portuguese", "pt"), ("French", "fr"), ("Korean", "ko")]
+
+
+class Throttle:
+    """Fixed latency per call and at most `rate_limit` calls per second across threads (0 for no limit)"""
+
+    def __init__(self, service: str, latency: float = 0.0, rate_limit: float = 0.0):
+        self.service = service
+        self.latency = latency
+        self.interval = 1 / rate_limit if rate_limit else 0.0
+        self.calls = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            self.calls += 1
+            now = time.perf_counter()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            metrics.rate_limit_sleep(self.service, slot - now)
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def synthetic_lyrics(seed: int, length: int) -> str:
+    rng = np.random.default_rng(seed)
+    words = rng.choice(["love", "night", "baby", "dance", "heart", "fire", "corazón", "noche", "saudade", "lune"], size=length // 6)
+    lines = [" ".join(words[i:i + 8]) for i in range(0, len(words), 8)]
+    return f"Song {seed} Lyrics[Verse 1]\n" + "\n".join(lines)
+
+
+class FakeSpotify:
+    """`spotipy.Spotify` subset: paged user playlists, playlist items and audio features"""
+
+    def __init__(self, n_playlists: int = 10, songs_per_playlist: int = 50, n_artists: int = 200,
+                 page_size: int = 50, latency: float = 0.0, rate_limit: float = 0.0, seed: int = 0):
+        self.throttle = Throttle("spotify", latency, rate_limit)
+        self.page_size = page_size
+        self.rng = np.random.default_rng(seed)
+        self.playlists = [
+            dict(id=f"playlist{i}", name=f"Top 50 - Market {i}", description=f"Top songs of market {i}", snapshot_id=f"snapshot{i}")
+            for i in range(n_playlists)
+        ]
+        # songs are shared between playlists, as they are between markets
+        n_songs = max(1, n_playlists * songs_per_playlist // 2)
+        self.songs = {
+            f"playlist{i}": [f"song{j}" for j in self.rng.choice(n_songs, size=min(songs_per_playlist, n_songs), replace=False)]
+            for i in range(n_playlists)
+        }
+        self.artists = {f"song{j}": [f"artist{a}" for a in self.rng.choice(n_artists, size=1 + j % 2, replace=False)] for j in range(n_songs)}
+
+    def user_playlists(self, user_id: str, limit: Optional[int] = None, offset: int = 0):
+        self.throttle.wait()
+        limit = limit or self.page_size
+        items = self.playlists[offset:offset + limit]
+        next_offset = offset + limit if offset + limit < len(self.playlists) else None
+        return dict(items=items, next=next_offset, limit=limit, offset=offset, total=len(self.playlists))
+
+    def next(self, response):
+        return self.user_playlists("spotify", limit=response["limit"], offset=response["next"])
+
+    def playlist_items(self, playlist_id: str, fields: Optional[str] = None):
+        self.throttle.wait()
+        return dict(items=[
+            dict(track=dict(
+                id=song_id,
+                name=f"Song {song_id[4:]}",
+                album=dict(release_date="2023-01-27"),
+                artists=[dict(id=artist_id, name=f"Artist {artist_id[6:]}") for artist_id in self.artists[song_id]],
+            ))
+            for song_id in self.songs[playlist_id]
+        ])
+
+    def audio_features(self, song_id: str):
+        self.throttle.wait()
+        rng = np.random.default_rng(int(song_id[4:]))
+        return [dict(
+            id=song_id,
+            acousticness=rng.random(), danceability=rng.random(), duration_ms=int(rng.integers(120_000, 300_000)),
+            energy=rng.random(), speechiness=rng.random(), instrumentalness=rng.random(), key=int(rng.integers(0, 12)),
+            liveness=rng.random(), mode=int(rng.integers(0, 2)), tempo=float(rng.uniform(60, 180)), valence=rng.random(),
+        )]
+
+
+class GeniusPages:
+    """Local HTTP server for the song pages read by `crawl_for_translations`"""
+
+    def __init__(self, translations_per_song: int = 1, latency: float = 0.0):
+        pages = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(latency)
+                slug = self.path.strip("/")
+                items = "".join(
+                    f'<li class="LyricsControls__DropdownItem-sc-1"><a href="{pages.url}/{slug}-translation-{i}">'
+                    f'<div>{LANGUAGES[i % len(LANGUAGES)][0] if i % 4 != 3 else "Romanization"}</div></a></li>'
+                    for i in range(translations_per_song)
+                )
+                body = (
+                    f'<html><body><div class="LyricsControls__Container-sc-1"><span>Translations</span><ul>{items}</ul></div>'
+                    f'<div id="lyrics">{slug}</div></body></html>'
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeGenius:
+    """`lyricsgenius.Genius` subset; song urls point to `pages` so translations are crawled over HTTP"""
+
+    def __init__(self, pages: GeniusPages, lyrics_length: int = 2000, latency: float = 0.0, rate_limit: float = 0.0):
+        self.pages = pages
+        self.lyrics_length = lyrics_length
+        self.throttle = Throttle("genius", latency, rate_limit)
+
+    def search_song(self, song_name: str, artist_name: Optional[str] = None):
+        self.throttle.wait()
+        slug = song_name.lower().replace(" ", "-") + "-lyrics"
+        return SimpleNamespace(url=f"{self.pages.url}/{slug}", lyrics=synthetic_lyrics(zlib.crc32(slug.encode()), self.lyrics_length))
+
+    def lyrics(self, song_url: str, remove_section_headers: bool = False) -> str:
+        self.throttle.wait()
+        return synthetic_lyrics(zlib.crc32(song_url.encode()), self.lyrics_length)
+
+
+class FakeCohere:
+    """`cohere.Client` subset: language detection, embeddings of a fixed dimension and streamed generation"""
+
+    def __init__(self, dimension: int = 768, latency: float = 0.0, rate_limit: float = 0.0):
+        self.dimension = dimension
+        self.throttle = Throttle("cohere", latency, rate_limit)
+
+    def detect_language(self, texts: list[str]):
+        self.throttle.wait()
+        results = []
+        for text in texts:
+            language_name, language_code = LANGUAGES[len(text) % len(LANGUAGES)]
+            results.append(SimpleNamespace(language_name=language_name, language_code=language_code))
+        return SimpleNamespace(results=results)
+
+    def embed(self, texts: list[str], model: Optional[str] = None, truncate: Optional[str] = None):
+        self.throttle.wait()
+        embeddings = [
+            np.random.default_rng(zlib.crc32(text.encode())).standard_normal(self.dimension).astype(np.float32).tolist()
+            for text in texts
+        ]
+        return SimpleNamespace(embeddings=embeddings)
+
+    def generate(self, prompt: str, model: Optional[str] = None, max_tokens: int = 300, temperature: float = 1.0, stream: bool = False):
+        self.throttle.wait()
+        words = synthetic_lyrics(zlib.crc32(prompt.encode()), max_tokens * 6).partition("]")[-1].split()[:max_tokens]
+        tokens = [SimpleNamespace(text=word + " ") for word in words]
+        return iter(tokens) if stream else SimpleNamespace(generations=[SimpleNamespace(text="".join(t.text for t in tokens))])
+
+
+class FakePineconeIndex:
+    """`pinecone.Index` subset kept in memory: upsert, delete, metadata update, fetch and brute-force cosine query with `$in` metadata filters"""
+
+    def __init__(self, latency: float = 0.0, rate_limit: float = 0.0):
+        self.throttle = Throttle("pinecone", latency, rate_limit)
+        self.vectors: dict[str, tuple[list[float], dict]] = {}
+
+    def upsert(self, vectors: list[tuple]):
+        self.throttle.wait()
+        for vector_id, values, metadata in vectors:
+            self.vectors[vector_id] = (np.ravel(values).tolist(), metadata)
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def delete(self, ids: list[str]):
+        self.throttle.wait()
+        for vector_id in ids:
+            self.vectors.pop(vector_id, None)
+        return {}
+
+    def update(self, id: str, set_metadata: dict):
+        self.throttle.wait()
+        if id in self.vectors:
+            self.vectors[id][1].update(set_metadata)
+        return {}
+
+    def fetch(self, ids: list[str]):
+        self.throttle.wait()
+        return dict(vectors={
+            vector_id: dict(id=vector_id, values=self.vectors[vector_id][0], metadata=self.vectors[vector_id][1])
+            for vector_id in ids if vector_id in self.vectors
+        })
+
+    def query(self, vector: list[float], top_k: int = 5, filter: Optional[dict] = None, **kwargs):
+        self.throttle.wait()
+        ids = [
+            vector_id for vector_id, (_, metadata) in self.vectors.items()
+            if all(metadata.get(field) in condition["$in"] for field, condition in (filter or {}).items())
+        ]
+        if not ids:
+            return dict(matches=[])
+        X = np.array([self.vectors[vector_id][0] for vector_id in ids], dtype=np.float32)
+        scores = X @ np.asarray(vector, dtype=np.float32) / (np.linalg.norm(X, axis=1) * np.linalg.norm(vector) + 1e-12)
+        order = np.argsort(-scores)[:top_k]
+        return dict(matches=[dict(id=ids[i], score=float(scores[i]), metadata=self.vectors[ids[i]][1]) for i in order])
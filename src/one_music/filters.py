@@ -0,0 +1,88 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import (
+    is_categorical_dtype,
+    is_numeric_dtype,
+)
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern: str) -> re.Pattern:
+    """Compile user input as regex; fall back to a plain substring if it isn't a valid pattern"""
+    try:
+        return re.compile(pattern)
+    except re.error:
+        return re.compile(re.escape(pattern))
+
+
+class FilterEngine:
+    """Build filters as boolean masks over a fixed DataFrame.
+
+    Column statistics and factorized values are computed once per column and reused until the
+    engine is discarded, so one engine should be created per data version.
+    """
+
+    def __init__(self, df: pd.DataFrame, categorical_threshold: int = 10):
+        self.df = df
+        self.categorical_threshold = categorical_threshold
+        self._stats = {}
+        self._factorized = {}
+        self._values = {}
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def factorize(self, column: str) -> tuple[np.ndarray, np.ndarray]:
+        """(codes, uniques) of a column; text filters only evaluate each distinct value once"""
+        if column not in self._factorized:
+            codes, uniques = pd.factorize(self.df[column], use_na_sentinel=True)
+            self._factorized[column] = codes, np.asarray(uniques, dtype=object)
+        return self._factorized[column]
+
+    def values(self, column: str) -> np.ndarray:
+        if column not in self._values:
+            self._values[column] = self.df[column].to_numpy()
+        return self._values[column]
+
+    def column_stats(self, column: str) -> dict:
+        if column in self._stats:
+            return self._stats[column]
+
+        series = self.df[column]
+        _, uniques = self.factorize(column)
+        # Treat columns with < `categorical_threshold` unique values as categorical
+        if is_categorical_dtype(series) or len(uniques) < self.categorical_threshold:
+            stats = dict(kind="categorical", unique=uniques.tolist())
+        elif is_numeric_dtype(series):
+            values = self.values(column)
+            stats = dict(kind="numeric", min=float(np.nanmin(values)), max=float(np.nanmax(values)))
+        else:
+            stats = dict(kind="text")
+
+        self._stats[column] = stats
+        return stats
+
+    def category_mask(self, column: str, selected_values: list) -> np.ndarray:
+        codes, uniques = self.factorize(column)
+        is_selected = pd.Index(uniques).isin(selected_values)
+        # NaN rows (code -1) index the trailing `False`
+        return np.append(is_selected, False)[codes]
+
+    def range_mask(self, column: str, low: float, high: float) -> np.ndarray:
+        values = self.values(column)
+        return (values >= low) & (values <= high)
+
+    def text_mask(self, column: str, pattern: str) -> np.ndarray:
+        codes, uniques = self.factorize(column)
+        regex = compile_pattern(pattern)
+        is_match = np.fromiter((regex.search(str(value)) is not None for value in uniques), dtype=bool, count=len(uniques))
+        return np.append(is_match, False)[codes]
+
+    def apply(self, masks: list[np.ndarray]) -> pd.DataFrame:
+        """Combine masks and slice the DataFrame once"""
+        if not masks:
+            return self.df
+        return self.df[np.logical_and.reduce(masks)]
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Iterable, Optional
+
+import numpy as np
+
+
+def select_snippets(texts: list[str], length: int = 100, seed: int = 0) -> list[str]:
+    """One window of `length` characters per text, at a random offset drawn for all texts at once"""
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    starts = (np.random.default_rng(seed).random(len(texts)) * np.maximum(lengths - length, 0)).astype(np.int64)
+    return [text[start:start + length] for text, start in zip(texts, starts)]
+
+
+def lyrics_prompt(snippets: list[str]) -> str:
+    """Prompt naming as many snippets as there are, each numbered on its own paragraph"""
+    count = "the following snippet" if len(snippets) == 1 else f"the {len(snippets)} following snippets"
+    return f"Write song lyrics based on {count}:\n\n" + "\n\n".join(f"{i}. {snippet}" for i, snippet in enumerate(snippets, start=1))
+
+
+class GenerationJob:
+    """Text generated in the background; `text` can be read while chunks are still arriving"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def run(self, generate: Callable[[], Iterable[str]]) -> None:
+        try:
+            for chunk in generate():
+                self.chunks.append(chunk)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+class GenerationCache:
+    """Completed and in-flight generations keyed by (prompt, snippets, params), least recently used evicted first.
+
+    Jobs run on a thread pool so a Streamlit rerun can stop rendering without cancelling the generation,
+    and the next rerun picks up the same job.
+    """
+
+    def __init__(self, max_entries: int = 128, max_workers: int = 2):
+        self.max_entries = max_entries
+        self._jobs: OrderedDict[Hashable, GenerationJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def get(self, key: Hashable) -> Optional[GenerationJob]:
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                self._jobs.move_to_end(key)
+            return job
+
+    def submit(self, key: Hashable, generate: Callable[[], Iterable[str]]) -> GenerationJob:
+        """Start `generate` unless the key is cached or in flight; failed jobs are retried"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.error is None:
+                self._jobs.move_to_end(key)
+                return job
+
+            job = GenerationJob()
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+            while len(self._jobs) > self.max_entries:
+                self._jobs.popitem(last=False)
+
+        self._executor.submit(job.run, generate)
+        return job
@@ -5,19 +5,24 @@ import uuid
 from bs4 import BeautifulSoup
 from lyricsgenius import Genius
 
+from . import metrics
+
 
 def create_genius_client(client_token: str) -> Genius:
     return Genius(client_token)
 
 
+@metrics.instrument(size=lambda song: len(song.lyrics or ""))
 def search_song(client: Genius, song_name: str, artist_name: str = None):
     return client.search_song(song_name)  # , artist_name)
 
 
+@metrics.instrument(size=len)
 def get_song_lyrics(client: Genius, song_url: str):
     return client.lyrics(song_url=song_url, remove_section_headers=False)  # TODO parse headers before embedding
 
 
+@metrics.instrument()
 def crawl_for_translations(genius_url):
     r = requests.get(genius_url, timeout=5)
 
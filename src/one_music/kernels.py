@@ -0,0 +1,54 @@
+"""Fused scoring loops of `quantization.QuantizedMatrix`, compiled with numba.
+
+Each row is decoded in registers and dotted with the query in one pass, so only the compressed bytes
+are read from memory and no float32 copy of the matrix is made. The loops release the GIL, so
+concurrent dashboard sessions score in parallel. Imported on the first query: importing numba takes
+a while, and compiled code is cached in the directory set by `configure_numba_cache`.
+"""
+import numpy as np
+
+from .startup import configure_numba_cache
+
+configure_numba_cache()
+import numba  # noqa: E402
+
+
+FLOAT16_REBIAS = np.float32(2.0 ** 112)  # 2 ** (127 - 15), the float32 minus the float16 exponent bias
+
+
+@numba.njit(cache=True, fastmath=True, nogil=True)
+def score_float16(halves: np.ndarray, query: np.ndarray, out: np.ndarray) -> None:
+    """`halves` is the float16 matrix viewed as uint16 and `query` is scaled by `FLOAT16_REBIAS`.
+
+    numba has no float16: shifting the sign, exponent and mantissa bits into place gives a float32 equal to
+    the half times 2 ** -112, zeros and subnormals included, and the scaled query cancels the factor.
+    """
+    bits = np.empty(halves.shape[1], dtype=np.uint32)
+    values = bits.view(np.float32)
+    for i in range(halves.shape[0]):
+        for j in range(halves.shape[1]):
+            half = np.uint32(halves[i, j])
+            bits[j] = ((half & np.uint32(0x8000)) << np.uint32(16)) | ((half & np.uint32(0x7fff)) << np.uint32(13))
+        total = np.float32(0)
+        for j in range(halves.shape[1]):
+            total += values[j] * query[j]
+        out[i] = total
+
+
+@numba.njit(cache=True, fastmath=True, nogil=True)
+def score_int8(codes: np.ndarray, weights: np.ndarray, out: np.ndarray) -> None:
+    for i in range(codes.shape[0]):
+        total = np.float32(0)
+        for j in range(codes.shape[1]):
+            total += np.float32(codes[i, j]) * weights[j]
+        out[i] = total
+
+
+@numba.njit(cache=True, fastmath=True, nogil=True)
+def score_pq(codes: np.ndarray, lut: np.ndarray, out: np.ndarray) -> None:
+    """Sum over subspaces of the lookup table entry of each row's code"""
+    for i in range(codes.shape[0]):
+        total = np.float32(0)
+        for m in range(codes.shape[1]):
+            total += lut[m, codes[i, m]]
+        out[i] = total
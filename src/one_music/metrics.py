@@ -0,0 +1,262 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+
+
+# off unless requested; instrumented functions then only pay a global lookup per call
+ENABLED = os.environ.get("ONE_MUSIC_METRICS", "") not in ("", "0")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+HELP = {
+    "one_music_calls_total": "Wrapper function calls by outcome",
+    "one_music_call_seconds": "Wrapper function latency; time spent inside the generator for generator functions",
+    "one_music_payload_size": "Size of the wrapper results (items, characters or vectors)",
+    "one_music_retries_total": "Calls retried after an error",
+    "one_music_wait_seconds_total": "Time spent sleeping to respect rate limits",
+    "one_music_waits_total": "Rate limit sleeps",
+    "one_music_db_execute_seconds": "SQLite statement latency by statement kind",
+    "one_music_db_commit_seconds": "Session commit latency, including the flush",
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate interpolated within the bucket holding the quantile, like Prometheus' `histogram_quantile`"""
+        if not self.count:
+            return float("nan")
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and cumulative + count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound
+        return self.buckets[-1]  # in the +Inf bucket
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and sorted label pairs"""
+
+    def __init__(self):
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self.counters), ("histogram", self.histograms)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric_name, labels), value in sorted(metrics.items(), key=lambda item: item[0]):
+                        if metric_name != name:
+                            continue
+                        if kind == "counter":
+                            lines.append(f"{name}{format_labels(labels)} {value:g}")
+                            continue
+
+                        cumulative = 0
+                        for bound, count in zip(value.buckets, value.counts):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value.count}")
+                        lines.append(f"{name}_sum{format_labels(labels)} {value.sum:g}")
+                        lines.append(f"{name}_count{format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+REGISTRY = Registry()
+
+
+def enable(enabled: bool = True) -> None:
+    global ENABLED
+    ENABLED = enabled
+
+
+def instrument(size: Optional[Callable] = None):
+    """Record calls, latency and, with `size`, the payload size of the result of a wrapper function.
+
+    The service label is the wrapper module name, e.g. `spotify`. Generator functions are timed
+    while they produce items, and their payload size is the number of items yielded.
+    """
+    def decorator(func):
+        service = func.__module__.rpartition(".")[-1]
+        labels = dict(service=service, function=func.__name__)
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    yield from func(*args, **kwargs)
+                    return
+
+                iterator = func(*args, **kwargs)
+                elapsed = 0.0
+                n_items = 0
+                status = "ok"  # also when the consumer stops early
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                        except BaseException:
+                            status = "error"
+                            raise
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        n_items += 1
+                        yield item
+                finally:
+                    iterator.close()
+                    REGISTRY.inc("one_music_calls_total", status=status, **labels)
+                    REGISTRY.observe("one_music_call_seconds", elapsed, **labels)
+                    REGISTRY.observe("one_music_payload_size", n_items, buckets=SIZE_BUCKETS, **labels)
+
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                REGISTRY.inc("one_music_calls_total", status="error", **labels)
+                raise
+            finally:
+                REGISTRY.observe("one_music_call_seconds", time.perf_counter() - start, **labels)
+
+            REGISTRY.inc("one_music_calls_total", status="ok", **labels)
+            if size is not None and result is not None:
+                REGISTRY.observe("one_music_payload_size", size(result), buckets=SIZE_BUCKETS, **labels)
+            return result
+
+        return wrapper
+    return decorator
+
+
+def record_retry(service: str, function: str) -> None:
+    if ENABLED:
+        REGISTRY.inc("one_music_retries_total", service=service, function=function)
+
+
+def rate_limit_sleep(service: str, seconds: float) -> None:
+    """`time.sleep` that counts the wait against `service`"""
+    if ENABLED:
+        REGISTRY.inc("one_music_waits_total", service=service)
+        REGISTRY.inc("one_music_wait_seconds_total", seconds, service=service)
+    time.sleep(seconds)
+
+
+def instrument_database(engine) -> None:
+    """Time statements on `engine` and commits of every session; listeners return early when disabled"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if ENABLED:
+            conn.info.setdefault("one_music_execute_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("one_music_execute_start")
+        if ENABLED and starts:
+            kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+            REGISTRY.observe("one_music_db_execute_seconds", time.perf_counter() - starts.pop(), kind=kind)
+
+    @event.listens_for(Session, "before_commit")
+    def before_commit(session):
+        if ENABLED:
+            session.info["one_music_commit_start"] = time.perf_counter()
+
+    @event.listens_for(Session, "after_commit")
+    def after_commit(session):
+        start = session.info.pop("one_music_commit_start", None)
+        if ENABLED and start is not None:
+            REGISTRY.observe("one_music_db_commit_seconds", time.perf_counter() - start)
+
+
+def write_textfile(file_path: str | Path) -> None:
+    """Write the metrics atomically, e.g. for node_exporter's textfile collector"""
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+    tmp_path.write_text(REGISTRY.render(), encoding="utf-8")
+    tmp_path.replace(file_path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the pipeline output
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the metrics on `http://host:port/` from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
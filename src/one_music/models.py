@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Optional
 
 from sqlmodel import SQLModel, Field, Relationship
@@ -24,7 +24,7 @@ class SongArtistLink(SQLModel, table=True):
 
 class Playlist(SQLModel, table=True):
     spotify_id: str = Field(primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
     name: str
     description: str
 
@@ -40,7 +40,7 @@ class Artist(SQLModel, table=True):
 
 class Song(SQLModel, table=True):
     spotify_id: str = Field(primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
     name: str
 
     playlists: List[Playlist] = Relationship(back_populates="songs", link_model=SongPlaylistLink)
@@ -51,7 +51,7 @@ class Song(SQLModel, table=True):
 
 class Lyrics(SQLModel, table=True):
     genius_url: str = Field(primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
     language: str
     file_name: str
 
@@ -75,3 +75,47 @@ class AudioFeatures(SQLModel, table=True):
     valence: float
 
     song: Optional[Song] = Relationship(back_populates="audio_features")
+
+
+class LyricsDuplicate(SQLModel, table=True):
+    """Lyrics found to be a near-duplicate of `representative_url`, whose vector stands for both"""
+    genius_url: str = Field(primary_key=True, foreign_key="lyrics.genius_url")
+    representative_url: str = Field(foreign_key="lyrics.genius_url", index=True)
+    similarity: float  # estimated Jaccard similarity of their shingles
+
+
+class LyricsSignature(SQLModel, table=True):
+    """MinHash signature of parsed lyrics, see `dedup`"""
+    __table_args__ = dict(info=dict(changelog=False))  # derived data, downstream consumers don't need it
+
+    genius_url: str = Field(primary_key=True, foreign_key="lyrics.genius_url")
+    signature: bytes
+
+
+class LyricsBand(SQLModel, table=True):
+    """LSH bucket of each band of a signature; lyrics sharing a bucket are duplicate candidates"""
+    __table_args__ = dict(info=dict(changelog=False))
+
+    band: int = Field(primary_key=True)
+    bucket: str = Field(primary_key=True)
+    genius_url: str = Field(primary_key=True, foreign_key="lyrics.genius_url")
+
+
+class ChangeLog(SQLModel, table=True):
+    """Row changes of the tables above, written by the triggers of `changelog.install_triggers`"""
+    __table_args__ = dict(sqlite_autoincrement=True, info=dict(changelog=False))  # sequence numbers are never reused, even after compaction
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str = Field(index=True)
+    operation: str  # insert, update or delete
+    row: str  # JSON of the new row, or of the deleted one
+    changed_at: str
+
+
+class ChangeLogCursor(SQLModel, table=True):
+    """Last change sequence number handled by each downstream consumer"""
+    __table_args__ = dict(info=dict(changelog=False))
+
+    consumer: str = Field(primary_key=True)
+    seq: int
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
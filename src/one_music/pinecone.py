@@ -1,10 +1,13 @@
 import pinecone
 
+from . import metrics
+
 
 def initialize_pinecone(api_key: str, environment: str) -> None:
     pinecone.init(api_key, environment=environment)
 
 
+@metrics.instrument()
 def get_or_create_index(index_name: str, dimension: int, metric: str) -> pinecone.Index:
     if index_name not in pinecone.list_indexes():
 
@@ -21,12 +24,14 @@ def delete_index(index_name: str) -> None:
     pinecone.delete_index(index_name)
 
 
+@metrics.instrument(size=lambda response: len(response["matches"]))
 def query_index(index: pinecone.Index, embedded_query: list[float], top_k: int = 5, **kwargs):
     assert isinstance(embedded_query, list)
 
     return index.query(embedded_query, top_k=top_k, **kwargs)
 
 
+@metrics.instrument(size=lambda response: len(response[0]))
 def fetch_vectors(index: pinecone.Index, vector_ids: list[str]) -> tuple[list[str], list[list[float]]]:
     response = index.fetch(vector_ids)
     ids = []
@@ -36,3 +41,29 @@ def fetch_vectors(index: pinecone.Index, vector_ids: list[str]) -> tuple[list[st
         vectors.append(obj["values"])
 
     return ids, vectors
+
+
+@metrics.instrument(size=lambda response: response.upserted_count)
+def upsert_vectors(index: pinecone.Index, vectors: list[tuple]):
+    return index.upsert(vectors=vectors)
+
+
+@metrics.instrument()
+def delete_vectors(index: pinecone.Index, vector_ids: list[str]):
+    return index.delete(ids=vector_ids)
+
+
+@metrics.instrument()
+def update_metadata(index: pinecone.Index, vector_id: str, metadata: dict):
+    return index.update(id=vector_id, set_metadata=metadata)
+
+
+def fetch_vectors_in_batches(index: pinecone.Index, vector_ids: list[str], batch_size: int) -> tuple[list[str], list[list[float]]]:
+    ids = []
+    vectors = []
+    for i in range(0, len(vector_ids), batch_size):
+        batch_ids, batch_vectors = fetch_vectors(index, vector_ids[i:i+batch_size])
+        ids.extend(batch_ids)
+        vectors.extend(batch_vectors)
+
+    return ids, vectors
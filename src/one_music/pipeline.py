@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+
+from sqlmodel import SQLModel, Session, select
+
+from .database import engine
+
+
+@dataclass
+class Stage:
+    """A pipeline step; dependencies are derived from the resources other stages output"""
+    name: str
+    run: Callable[..., None]
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+
+
+def table_fingerprint(table_name: str) -> str:
+    """Sequence number of the table's last change, which compaction keeps; other tables' changes don't affect it.
+
+    Tables of a database created before the change log are hashed row by row, ordered by primary key.
+    """
+    from sqlalchemy import inspect
+    from .changelog import latest_seq
+    from .models import ChangeLog
+
+    with Session(engine) as session:
+        if inspect(engine).has_table(ChangeLog.__tablename__):
+            return f"changelog:{latest_seq(session, table_name)}"
+
+        table = SQLModel.metadata.tables[table_name]
+        digest = hashlib.sha1()
+        for row in session.exec(select(table).order_by(*table.primary_key.columns)):
+            digest.update(repr(tuple(row)).encode("utf-8"))
+        return digest.hexdigest()
+
+
+def fingerprint(resource: str) -> Optional[str]:
+    """Fingerprint of a `table:<name>` resource; other resources (external services) can't be fingerprinted"""
+    kind, _, name = resource.partition(":")
+    if kind == "table":
+        return table_fingerprint(name)
+    return None
+
+
+def inputs_fingerprint(stage: Stage) -> Optional[str]:
+    """None when the stage reads anything that can't be fingerprinted, i.e. it must always run"""
+    fingerprints = [fingerprint(resource) for resource in stage.inputs]
+    if not fingerprints or None in fingerprints:
+        return None
+    return hashlib.sha1("".join(fingerprints).encode("utf-8")).hexdigest()
+
+
+def load_state(state_path: Path) -> dict:
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state: dict, state_path: Path) -> None:
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(state_path, mode="w") as f:
+        json.dump(state, f, indent=2)
+
+
+def resolve_dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """Upstream stages of each stage: the earlier declared ones producing any of its inputs, so there are no cycles"""
+    dependencies = {}
+    for position, stage in enumerate(stages):
+        dependencies[stage.name] = {
+            upstream.name for upstream in stages[:position]
+            if set(upstream.outputs) & set(stage.inputs)
+        }
+    return dependencies
+
+
+def run_pipeline(stages: list[Stage], cfg, selection: Optional[list[str]] = None, force: bool = False,
+                 max_workers: int = 2, state_path: str | Path = "pipeline_state.json") -> dict[str, tuple[str, float]]:
+    """Run the selected stages, concurrently when independent, and skip the ones whose inputs are unchanged.
+
+    Returns `{stage name: (status, seconds)}` with status `done`, `skipped` or `failed`.
+    """
+    state_path = Path(state_path)
+    state = load_state(state_path)
+
+    if selection:
+        unknown = set(selection) - {stage.name for stage in stages}
+        if unknown:
+            raise ValueError(f"Unknown stages: {sorted(unknown)}")
+        stages = [stage for stage in stages if stage.name in selection]
+    stages_by_name = {stage.name: stage for stage in stages}
+    dependencies = resolve_dependencies(stages)
+    state_lock = threading.Lock()
+
+    def execute(stage: Stage) -> tuple[str, float]:
+        start = time.perf_counter()
+        current = inputs_fingerprint(stage)
+        if not force and current is not None and state.get(stage.name) == current:
+            return "skipped", time.perf_counter() - start
+
+        stage.run(cfg)
+        if current is not None:
+            with state_lock:
+                state[stage.name] = current
+                save_state(state, state_path)
+        return "done", time.perf_counter() - start
+
+    results = {}
+    submitted_at = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while len(results) < len(stages):
+            for name, stage in stages_by_name.items():
+                if name in results or name in running.values():
+                    continue
+                if any(results.get(dependency, ("",))[0] == "failed" for dependency in dependencies[name]):
+                    results[name] = ("failed", 0.0)
+                    print(f"[{name}] not run: an upstream stage failed")
+                elif all(dependency in results for dependency in dependencies[name]):
+                    print(f"[{name}] started")
+                    submitted_at[name] = time.perf_counter()
+                    running[executor.submit(execute, stage)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = ("failed", time.perf_counter() - submitted_at[name])
+                    print(f"[{name}] failed: {e!r}")
+                print(f"[{name}] {results[name][0]} in {results[name][1]:.1f}s")
+
+    return results
@@ -0,0 +1,69 @@
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+
+
+WEBGL_THRESHOLD = 5_000  # above: WebGL trace, hover limited to the id
+DENSITY_THRESHOLD = 50_000  # above: server-side 2-D histogram instead of points
+MAX_COLOR_CATEGORIES = 50  # plotly creates one trace per category
+
+
+def window_mask(df: pd.DataFrame, x: str, y: str, x_range: Optional[tuple] = None, y_range: Optional[tuple] = None) -> np.ndarray:
+    """Rows inside the zoom window; None ranges are unbounded"""
+    mask = np.ones(len(df), dtype=bool)
+    for column, bounds in ((x, x_range), (y, y_range)):
+        if bounds is not None:
+            values = df[column].to_numpy()
+            mask &= (values >= bounds[0]) & (values <= bounds[1])
+    return mask
+
+
+def density_figure(df: pd.DataFrame, x: str, y: str, bins: int = 200) -> "go.Figure":
+    """Aggregate points into a `bins` x `bins` grid; only the grid is sent to the browser"""
+    import plotly.graph_objects as go
+
+    counts, x_edges, y_edges = np.histogram2d(df[x].to_numpy(), df[y].to_numpy(), bins=bins)
+    counts = np.where(counts > 0, counts, np.nan)  # leave empty cells transparent
+    figure = go.Figure(
+        go.Heatmap(
+            x=(x_edges[:-1] + x_edges[1:]) / 2,
+            y=(y_edges[:-1] + y_edges[1:]) / 2,
+            z=np.log10(counts).T,
+            colorscale="Viridis",
+            colorbar=dict(title="log10(count)"),
+            hovertemplate=f"{x}: %{{x:.2f}}<br>{y}: %{{y:.2f}}<br>log10(count): %{{z:.2f}}<extra></extra>",
+        )
+    )
+    return figure.update_layout(xaxis_title=x, yaxis_title=y)
+
+
+def scatter(df: pd.DataFrame, x: str, y: str, id_column: str, color: Optional[str] = None, hover_data: Optional[list[str]] = None,
+            x_range: Optional[tuple] = None, y_range: Optional[tuple] = None,
+            webgl_threshold: int = WEBGL_THRESHOLD, density_threshold: int = DENSITY_THRESHOLD) -> tuple["go.Figure", str]:
+    """Scatter plot of the points inside the zoom window, rendered according to the point count.
+
+    Returns the figure and the render mode: `svg`, `webgl` or `density`.
+    Above `webgl_threshold` points, hover only carries `id_column`; details are loaded on demand from the id.
+    """
+    import plotly_express as px
+
+    mask = window_mask(df, x, y, x_range, y_range)
+    n_points = int(mask.sum())
+
+    if n_points > density_threshold:
+        return density_figure(df.loc[mask, [x, y]], x, y), "density"
+
+    if n_points > webgl_threshold:
+        if color and not is_numeric_dtype(df[color]) and df.loc[mask, color].nunique() > MAX_COLOR_CATEGORIES:
+            color = None
+        columns = list(dict.fromkeys([x, y, id_column, *([color] if color else [])]))
+        figure = px.scatter(data_frame=df.loc[mask, columns], x=x, y=y, hover_data=[id_column], color=color, render_mode="webgl")
+        return figure, "webgl"
+
+    figure = px.scatter(data_frame=df.loc[mask], x=x, y=y, hover_data=hover_data, color=color, render_mode="svg")
+    return figure, "svg"
@@ -0,0 +1,184 @@
+import multiprocessing
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from .startup import configure_numba_cache
+
+if TYPE_CHECKING:
+    import umap
+    from sklearn.pipeline import Pipeline
+
+# umap and sklearn are imported where a model is created: importing umap compiles numba code for
+# several seconds, which the dashboard only reading saved coordinates never needs
+
+
+def create_lyrics_reducer(**umap_kwargs) -> "umap.UMAP":
+    configure_numba_cache()
+    import umap
+
+    return umap.UMAP(**umap_kwargs)
+
+
+def create_audio_reducer(**umap_kwargs) -> "Pipeline":
+    """Audio features have heterogeneous units (ms, bpm, ratios) and need scaling before UMAP"""
+    configure_numba_cache()
+    import umap
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import RobustScaler
+
+    return make_pipeline(RobustScaler(), umap.UMAP(**umap_kwargs))
+
+
+def save_reducer(reducer, file_path: str | Path) -> None:
+    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(reducer, file_path)
+
+
+def load_reducer(file_path: str | Path):
+    configure_numba_cache()  # unpickling a reducer imports umap
+    try:
+        return joblib.load(file_path)
+    except FileNotFoundError:
+        print(f"`{file_path}` not found")
+
+
+def to_coordinates(ids, embedding: np.ndarray, id_column: str, columns: list[str]) -> pd.DataFrame:
+    return pd.DataFrame(embedding, columns=columns).assign(**{id_column: list(ids)})[[id_column, *columns]]
+
+
+def fit_coordinates(reducer, ids, X, id_column: str, columns: list[str]) -> pd.DataFrame:
+    """Fit reducer on all points; only used on full refit"""
+    embedding = reducer.fit_transform(X)
+    return to_coordinates(ids, embedding, id_column, columns)
+
+
+def update_coordinates(reducer, coordinates_df: pd.DataFrame, ids, X, id_column: str, columns: list[str]) -> pd.DataFrame:
+    """Place points missing from `coordinates_df` with `transform` on the fitted reducer"""
+    ids = np.asarray(ids)
+    is_new = ~np.isin(ids, coordinates_df[id_column].to_numpy())
+    if not is_new.any():
+        return coordinates_df
+
+    embedding = reducer.transform(np.asarray(X)[is_new])
+    new_df = to_coordinates(ids[is_new], embedding, id_column, columns)
+    return pd.concat([coordinates_df, new_df], ignore_index=True)
+
+
+def load_coordinates(file_path: str | Path, id_column: str, columns: list[str]) -> pd.DataFrame:
+    try:
+        return pd.read_parquet(file_path, columns=[id_column, *columns])
+    except FileNotFoundError:
+        return pd.DataFrame(columns=[id_column, *columns])
+
+
+def save_coordinates(coordinates_df: pd.DataFrame, file_path: str | Path) -> None:
+    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+    coordinates_df.to_parquet(file_path, index=False)
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return float("nan")
+
+
+@contextmanager
+def report_phase(name: str):
+    """Print wall time and the RSS of this process before and after `name` once it completes.
+
+    `ru_maxrss` is a high-water mark over the whole process (and over all reaped workers), so the peaks
+    are printed as peaks so far: a phase only owns them when they grew during it.
+    """
+    start, rss_start = time.perf_counter(), current_rss_mb()
+    yield
+    wall_time = time.perf_counter() - start
+    peak_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(f"[{name}] wall time: {wall_time:.1f}s | RSS main: {rss_start:.0f} -> {current_rss_mb():.0f} MB | "
+          f"peak RSS so far main: {peak_self:.0f} MB, workers: {peak_children:.0f} MB")
+
+
+def stratified_sample(strata: pd.Series, n_samples: int, seed: int = 0) -> np.ndarray:
+    """Sorted positions of a sample allocated proportionally to each stratum, with at least one point per stratum.
+    Missing values (e.g. songs without a language) form a stratum of their own.
+    """
+    rng = np.random.default_rng(seed)
+    codes, uniques = pd.factorize(strata, use_na_sentinel=False)
+    counts = np.bincount(codes, minlength=len(uniques))
+    quotas = np.maximum(1, np.round(counts * n_samples / len(codes)).astype(int))
+
+    order = np.argsort(codes, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    sample = [
+        rng.choice(order[offsets[i]:offsets[i+1]], size=min(quotas[i], counts[i]), replace=False)
+        for i in range(len(uniques))
+    ]
+    return np.sort(np.concatenate(sample))
+
+
+# set in each transform worker process by `_init_transform_worker`
+_worker_reducer: Optional["umap.UMAP"] = None
+_worker_vectors: Optional[np.memmap] = None
+_worker_embedding: Optional[np.memmap] = None
+
+
+def _init_transform_worker(reducer_path, vectors_path, embedding_path):
+    global _worker_reducer, _worker_vectors, _worker_embedding
+    _worker_reducer = joblib.load(reducer_path)
+    _worker_vectors = np.load(vectors_path, mmap_mode="r")
+    _worker_embedding = np.load(embedding_path, mmap_mode="r+")
+
+
+def _transform_batch(positions: np.ndarray) -> int:
+    assert _worker_reducer is not None and _worker_vectors is not None and _worker_embedding is not None
+    _worker_embedding[positions] = _worker_reducer.transform(np.asarray(_worker_vectors[positions]))
+    _worker_embedding.flush()
+    return len(positions)
+
+
+def fit_transform_large(vectors_path: str | Path, reducer_path: str | Path, embedding_path: str | Path,
+                        strata: pd.Series, n_samples: int, batch_size: int, n_jobs: int, **umap_kwargs) -> np.ndarray:
+    """Fit UMAP on a stratified sample, then transform the remaining points in memory-mapped batches.
+
+    `vectors_path` is a float32 `.npy` file read through a memory map so the full matrix is never loaded.
+    Coordinates are written to the `.npy` memory map at `embedding_path`, aligned with the vector rows.
+    """
+    vectors = np.load(vectors_path, mmap_mode="r")
+
+    with report_phase("sample"):
+        sample = stratified_sample(strata, n_samples)
+
+    with report_phase("fit"):
+        reducer = create_lyrics_reducer(**umap_kwargs).fit(np.asarray(vectors[sample]))
+        save_reducer(reducer, reducer_path)
+
+    embedding = np.lib.format.open_memmap(embedding_path, mode="w+", dtype=np.float32, shape=(len(vectors), 2))
+    embedding[sample] = reducer.embedding_
+    embedding.flush()
+    del reducer
+
+    remaining = np.setdiff1d(np.arange(len(vectors)), sample, assume_unique=True)
+    batches = [remaining[i:i+batch_size] for i in range(0, len(remaining), batch_size)]
+    with report_phase("transform"):
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),  # forking after numba threads started can deadlock
+            initializer=_init_transform_worker,
+            initargs=(str(reducer_path), str(vectors_path), str(embedding_path)),
+        ) as executor:
+            done = 0
+            for n_points in executor.map(_transform_batch, batches):
+                done += n_points
+                print(f"transformed {done}/{len(remaining)}")
+
+    return embedding
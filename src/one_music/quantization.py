@@ -0,0 +1,142 @@
+"""Compressed vector matrices with asymmetric scoring: the query stays float32, only the rows are compressed.
+
+- `float16`: 2 bytes per value
+- `int8`: 1 byte per value, affine per column (`x ~ code * scale + offset`)
+- `pq`: product quantization, one byte per subspace indexing a 256-centroid codebook
+
+Scores are approximate; callers keep the full-precision matrix on disk and re-rank the top candidates with it.
+"""
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+
+KINDS = ("float16", "int8", "pq")
+PQ_CENTROIDS = 256  # codes fit in a uint8
+PQ_SUBSPACE_WIDTH = 8
+DECODE_BLOCK = 4096  # rows decoded at once, so the float32 temporary stays cache-sized
+
+
+def pad_columns(X: np.ndarray, n_columns: int) -> np.ndarray:
+    """Zero columns up to `n_columns`, so every subspace has the same width and padded columns never score"""
+    return np.pad(X, [(0, 0)] * (X.ndim - 1) + [(0, n_columns - X.shape[-1])])
+
+
+def train_codebook(X: np.ndarray, n_subspaces: int, sample_size: int = 16384, seed: int = 0) -> np.ndarray:
+    """(n_subspaces, centroids, subspace width) k-means centroids of each column slice, fit on a row sample
+    zero-padded to a multiple of `n_subspaces` columns
+    """
+    from sklearn.cluster import KMeans  # deferred: sklearn adds seconds to app start
+
+    rng = np.random.default_rng(seed)
+    sample = X[np.sort(rng.choice(len(X), size=min(sample_size, len(X)), replace=False))]
+    sample = pad_columns(np.asarray(sample, dtype=np.float32), -(-X.shape[1] // n_subspaces) * n_subspaces)
+    n_centroids = min(PQ_CENTROIDS, len(sample))
+    return np.stack([
+        KMeans(n_clusters=n_centroids, n_init=1, max_iter=25, random_state=seed).fit(subspace).cluster_centers_
+        for subspace in np.split(sample, n_subspaces, axis=1)
+    ]).astype(np.float32)
+
+
+def encode_pq(X: np.ndarray, codebook: np.ndarray, block_size: int = DECODE_BLOCK) -> np.ndarray:
+    codes = np.empty((len(X), len(codebook)), dtype=np.uint8)
+    for start in range(0, len(X), block_size):
+        block = pad_columns(np.asarray(X[start:start + block_size], dtype=np.float32), codebook.shape[0] * codebook.shape[2])
+        for m, (subspace, centroids) in enumerate(zip(np.split(block, len(codebook), axis=1), codebook)):
+            # argmin ||x - c||^2 = argmin ||c||^2 - 2 x.c
+            distances = (centroids ** 2).sum(axis=1) - 2 * subspace @ centroids.T
+            codes[start:start + block_size, m] = distances.argmin(axis=1)
+    return codes
+
+
+class QuantizedMatrix:
+    """Read-only compressed stand-in for a float32 matrix, scored blockwise against float32 queries"""
+
+    def __init__(self, kind: str, codes: np.ndarray, scale: Optional[np.ndarray] = None, offset: Optional[np.ndarray] = None,
+                 codebook: Optional[np.ndarray] = None, n_columns: Optional[int] = None):
+        assert kind in KINDS, kind
+        self.kind = kind
+        self.codes = codes
+        self.n_columns = n_columns or codes.shape[1]
+        self.scale = scale
+        self.offset = offset
+        self.codebook = codebook
+
+    @classmethod
+    def fit(cls, X: np.ndarray, kind: str = "int8", n_subspaces: Optional[int] = None) -> "QuantizedMatrix":
+        """`n_subspaces` (pq only) defaults to one per 8 columns; columns are zero-padded to a multiple of it"""
+        X = np.asarray(X, dtype=np.float32)
+        if kind == "float16":
+            return cls(kind, X.astype(np.float16))
+        if kind == "int8":
+            low, high = X.min(axis=0), X.max(axis=0)
+            scale = np.where(high > low, (high - low) / 255, 1).astype(np.float32)
+            codes = (np.clip(np.rint((X - low) / scale), 0, 255) - 128).astype(np.int8)
+            return cls(kind, codes, scale=scale, offset=(low + 128 * scale).astype(np.float32))
+
+        n_subspaces = n_subspaces or -(-X.shape[1] // PQ_SUBSPACE_WIDTH)
+        codebook = train_codebook(X, n_subspaces)
+        return cls(kind, encode_pq(X, codebook), codebook=codebook, n_columns=X.shape[1])
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.codes), self.n_columns
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.codes, self.scale, self.offset, self.codebook) if array is not None)
+
+    def decode(self, positions) -> np.ndarray:
+        """Approximate float32 rows"""
+        codes = self.codes[positions]
+        if self.kind == "float16":
+            return codes.astype(np.float32)
+        if self.kind == "int8":
+            return codes.astype(np.float32) * self.scale + self.offset
+        rows = np.concatenate([self.codebook[m][codes[..., m]] for m in range(len(self.codebook))], axis=-1)
+        return rows[..., :self.n_columns]
+
+    def __getitem__(self, position) -> np.ndarray:
+        return self.decode(position)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate `matrix @ query` in one pass over the codes, see `kernels`"""
+        from .kernels import FLOAT16_REBIAS, score_float16, score_int8, score_pq  # deferred: numba takes a while to import
+
+        query = np.asarray(query, dtype=np.float32)
+        scores = np.empty(len(self), dtype=np.float32)
+        if self.kind == "float16":
+            score_float16(self.codes.view(np.uint16), query * FLOAT16_REBIAS, scores)
+        elif self.kind == "int8":
+            # x ~ code * scale + offset, so x.q = code.(scale * q) + offset.q
+            score_int8(self.codes, query * self.scale, scores)
+            scores += np.float32(self.offset @ query)
+        else:
+            # lookup table of each centroid's dot product with the query slice of its subspace
+            padded = pad_columns(query, self.codebook.shape[0] * self.codebook.shape[2])
+            lut = np.einsum("mcw,mw->mc", self.codebook, padded.reshape(len(self.codebook), -1))
+            score_pq(self.codes, np.ascontiguousarray(lut, dtype=np.float32), scores)
+        return scores
+
+    def save(self, index_dir: str | Path) -> None:
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.save(index_dir.joinpath("codes.npy"), self.codes)
+        arrays = dict(scale=self.scale, offset=self.offset, codebook=self.codebook)
+        np.savez(index_dir.joinpath("quantizer.npz"), **{name: array for name, array in arrays.items() if array is not None})
+        with open(index_dir.joinpath("quantizer.json"), mode="w") as f:
+            json.dump(dict(kind=self.kind, n_columns=self.n_columns), f)
+
+    @classmethod
+    def load(cls, index_dir: str | Path, mmap: bool = False) -> "QuantizedMatrix":
+        index_dir = Path(index_dir)
+        with open(index_dir.joinpath("quantizer.json")) as f:
+            meta = json.load(f)
+        with np.load(index_dir.joinpath("quantizer.npz")) as arrays:
+            params = {name: arrays[name] for name in arrays.files}
+        return cls(codes=np.load(index_dir.joinpath("codes.npy"), mmap_mode="r" if mmap else None), **meta, **params)
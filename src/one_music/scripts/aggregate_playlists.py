@@ -0,0 +1,158 @@
+from pathlib import Path
+from typing import Optional
+
+import hydra
+from omegaconf import OmegaConf
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+
+from ..models import AudioFeatures, Lyrics, Playlist, SongPlaylistLink
+from ..database import engine, create_db_and_tables
+from ..aggregates import (
+    AGGREGATE_TABLES,
+    feature_stats,
+    language_mix,
+    lyrics_centroids,
+    merge_aggregate,
+    overlap_pairs,
+    playlist_summary,
+    read_aggregate,
+    write_aggregate,
+)
+from ..bulk import read_dataframe
+from ..changelog import advance_cursor, latest_seq, net_changes, read_changes
+from ..datastore import file_version, write_manifest
+from ..search import load_hybrid_index
+from ..tables import AUDIO_FEATURES, read_table
+
+
+CHANGELOG_CONSUMER = "aggregates"
+CHANGELOG_TABLES = ["playlist", "songplaylistlink", "audiofeatures", "lyrics"]
+
+
+def in_playlists(query, column, playlist_ids: Optional[set[str]]):
+    return query if playlist_ids is None else query.where(column.in_(sorted(playlist_ids)))
+
+
+def membership_query(playlist_ids: Optional[set[str]] = None):
+    """Playlists without songs are kept, with a null song"""
+    query = (
+        select(Playlist.spotify_id.label("playlist_spotify_id"), Playlist.name.label("playlist_name"), SongPlaylistLink.song_spotify_id)
+        .join(SongPlaylistLink, SongPlaylistLink.playlist_spotify_id == Playlist.spotify_id, isouter=True)
+    )
+    return in_playlists(query, Playlist.spotify_id, playlist_ids)
+
+
+def features_query(playlist_ids: Optional[set[str]] = None):
+    features = [getattr(AudioFeatures, name) for name in AUDIO_FEATURES]
+    query = (
+        select(AudioFeatures.spotify_id.label("song_spotify_id"), *features)
+        .join(SongPlaylistLink, SongPlaylistLink.song_spotify_id == AudioFeatures.spotify_id)
+        .distinct()
+    )
+    return in_playlists(query, SongPlaylistLink.playlist_spotify_id, playlist_ids)
+
+
+def lyrics_query(playlist_ids: Optional[set[str]] = None):
+    query = (
+        select(Lyrics.song_spotify_id, Lyrics.language)
+        .join(SongPlaylistLink, SongPlaylistLink.song_spotify_id == Lyrics.song_spotify_id)
+        .distinct()
+    )
+    return in_playlists(query, SongPlaylistLink.playlist_spotify_id, playlist_ids)
+
+
+def overlap_query(playlist_ids: Optional[set[str]] = None):
+    """Songs each playlist shares with each other playlist, counted by SQLite"""
+    other = aliased(SongPlaylistLink)
+    query = (
+        select(SongPlaylistLink.playlist_spotify_id, other.playlist_spotify_id.label("other_spotify_id"),
+               func.count().label("n_shared"))
+        .join(other, other.song_spotify_id == SongPlaylistLink.song_spotify_id)
+        .where(other.playlist_spotify_id != SongPlaylistLink.playlist_spotify_id)
+        .group_by(SongPlaylistLink.playlist_spotify_id, other.playlist_spotify_id)
+    )
+    return in_playlists(query, SongPlaylistLink.playlist_spotify_id, playlist_ids)
+
+
+def changed_playlists(session: Session, changes) -> set[str]:
+    """Playlists whose membership, or the audio features or lyrics of one of whose songs, changed"""
+    playlist_ids, song_ids = set(), set()
+    for table_name, operation, row in net_changes(changes):
+        if table_name == "songplaylistlink":
+            playlist_ids.add(row["playlist_spotify_id"])
+        elif table_name == "playlist":
+            playlist_ids.add(row["spotify_id"])
+        elif table_name == "audiofeatures":
+            song_ids.add(row["spotify_id"])
+        elif row["song_spotify_id"] is not None:
+            song_ids.add(row["song_spotify_id"])
+
+    if song_ids:
+        query = select(SongPlaylistLink.playlist_spotify_id).where(SongPlaylistLink.song_spotify_id.in_(sorted(song_ids))).distinct()
+        playlist_ids.update(session.exec(query).all())
+    return playlist_ids
+
+
+def aggregate_playlists(cfg, full_scan: bool = False) -> dict[str, int]:
+    """Update the per-playlist aggregates in `export.tables_dir` for the playlists changed since the last run.
+
+    Everything is recomputed on the first run, with `full_scan`, or when the lyrics vectors of the hybrid index
+    in `search.index_dir` were rebuilt. Returns the rows of each table.
+    """
+    tables_dir = Path(cfg.export.tables_dir)
+    index_dir = OmegaConf.select(cfg, "search.index_dir")
+
+    with Session(engine) as session:
+        head = latest_seq(session)
+        changes = None if full_scan else read_changes(session, CHANGELOG_CONSUMER, tables=CHANGELOG_TABLES, until=head)
+        playlist_ids = None if changes is None else changed_playlists(session, changes)
+
+    stored = {name: read_aggregate(tables_dir, name) for name in AGGREGATE_TABLES}
+    hybrid_index = load_hybrid_index(index_dir, mmap=True) if index_dir else None
+    index_version = file_version(Path(index_dir).joinpath("matrix.npy")) if hybrid_index is not None else None
+    if any(df is None for df in stored.values()) or set(stored["playlist_centroids"].index_version.fillna("")) - {index_version or ""}:
+        playlist_ids = None
+
+    rows = {name: len(df) for name, df in stored.items() if df is not None}
+    if playlist_ids is None or playlist_ids:
+        language_df = read_table(tables_dir.joinpath("language_table.parquet"), columns=["iso_code", "language_name"])
+        membership_df = read_dataframe(membership_query(playlist_ids))
+        lyrics_df = read_dataframe(lyrics_query(playlist_ids))
+        lyrics_df["language"] = lyrics_df.language.map(dict(zip(language_df.iso_code, language_df.language_name))).fillna(lyrics_df.language)
+
+        if hybrid_index is not None:
+            vectors = hybrid_index.matrix if hybrid_index.full_matrix is None else hybrid_index.full_matrix
+            centroids_df = lyrics_centroids(membership_df, hybrid_index.song_ids, vectors[:, :hybrid_index.lyrics_dim])
+        else:
+            centroids_df = lyrics_centroids(membership_df)
+        centroids_df["index_version"] = index_version
+
+        updated = dict(
+            playlist_table=playlist_summary(membership_df, lyrics_df),
+            playlist_features=feature_stats(membership_df, read_dataframe(features_query(playlist_ids)), AUDIO_FEATURES),
+            playlist_languages=language_mix(membership_df, lyrics_df),
+            playlist_centroids=centroids_df.astype({"index_version": "string"}),
+            playlist_overlap=overlap_pairs(read_dataframe(overlap_query(playlist_ids))),
+        )
+        for name, df in updated.items():
+            rows[name] = write_aggregate(merge_aggregate(stored[name], df, name, playlist_ids), tables_dir, name)
+        write_manifest(tables_dir, list(updated))  # last, so running apps swap in all the tables at once
+
+    with Session(engine) as session:
+        advance_cursor(session, CHANGELOG_CONSUMER, head)
+
+    scope = "all" if playlist_ids is None else len(playlist_ids)
+    print(f"[aggregates] {scope} playlists updated, " + ", ".join(f"{name}: {n_rows} rows" for name, n_rows in rows.items()))
+    return rows
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    create_db_and_tables()
+    aggregate_playlists(cfg)
+
+
+if __name__ == "__main__":
+    main()
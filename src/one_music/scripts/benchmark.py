@@ -0,0 +1,261 @@
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import hydra
+from omegaconf import OmegaConf
+
+
+def count_rows(table) -> int:
+    from sqlmodel import Session, func, select
+    from ..database import engine
+
+    with Session(engine) as session:
+        return session.exec(select(func.count()).select_from(table)).one()
+
+
+def bench_poll_spotify(cfg) -> int:
+    from ..database import create_db_and_tables
+    from ..fakes import FakeSpotify
+    from ..models import Song
+    from .poll_spotify import poll_spotify
+
+    create_db_and_tables()
+    OmegaConf.update(cfg, "charts.history_dir", "chart_history", force_add=True)  # in the workdir, not the dashboard's
+    corpus = cfg.benchmark.corpus
+    client = FakeSpotify(corpus.n_playlists, corpus.songs_per_playlist, corpus.n_artists,
+                         latency=cfg.benchmark.latency.spotify, rate_limit=cfg.benchmark.rate_limit.spotify)
+    poll_spotify(cfg, spotify_client=client)
+    return count_rows(Song)
+
+
+def bench_poll_audio_features(cfg) -> int:
+    from ..fakes import FakeSpotify
+    from ..models import AudioFeatures
+    from .poll_spotify import poll_audio_features
+
+    client = FakeSpotify(latency=cfg.benchmark.latency.spotify, rate_limit=cfg.benchmark.rate_limit.spotify)
+    poll_audio_features(cfg, spotify_client=client)
+    return count_rows(AudioFeatures)
+
+
+def bench_poll_genius(cfg) -> int:
+    from ..fakes import FakeCohere, FakeGenius, GeniusPages
+    from ..models import Lyrics
+    from .poll_genius import poll_genius
+
+    Path(cfg.genius.save_dir).mkdir(parents=True, exist_ok=True)
+    pages = GeniusPages(cfg.benchmark.corpus.translations_per_song, latency=cfg.benchmark.latency.genius_pages)
+    try:
+        genius_client = FakeGenius(pages, cfg.benchmark.corpus.lyrics_length, latency=cfg.benchmark.latency.genius,
+                                   rate_limit=cfg.benchmark.rate_limit.genius)
+        cohere_client = FakeCohere(cfg.benchmark.corpus.dimension, latency=cfg.benchmark.latency.cohere,
+                                   rate_limit=cfg.benchmark.rate_limit.cohere)
+        poll_genius(cfg, genius_client=genius_client, cohere_client=cohere_client, translation_sleep=(0, 0))
+    finally:
+        pages.close()
+    return count_rows(Lyrics)
+
+
+def bench_dedup_lyrics(cfg) -> int:
+    from ..models import LyricsSignature
+    from .dedup_lyrics import dedup_lyrics
+
+    dedup_lyrics(cfg)
+    return count_rows(LyricsSignature)
+
+
+def bench_push_to_pinecone(cfg) -> int:
+    from ..fakes import FakeCohere, FakePineconeIndex
+    from .push_to_pinecone import push_to_pinecone
+
+    index = FakePineconeIndex(latency=cfg.benchmark.latency.pinecone, rate_limit=cfg.benchmark.rate_limit.pinecone)
+    cohere_client = FakeCohere(cfg.benchmark.corpus.dimension, latency=cfg.benchmark.latency.cohere,
+                               rate_limit=cfg.benchmark.rate_limit.cohere)
+    push_to_pinecone(cfg, index=index, cohere_client=cohere_client, full_scan=True)
+    return len(index.vectors)
+
+
+def bench_dashboard_loaders(cfg) -> int:
+    """What the Insights page runs on the shipped tables: the `DataStore` snapshot of a data version, the lyrics
+    index and filter engines built once per version, then the rows of a few playlist and language selections
+    as reruns select them. Each is timed `repeats` times.
+    """
+    from .. import metrics, tables
+    from ..datastore import DataStore
+    from ..filters import FilterEngine
+
+    load_snapshot = metrics.instrument()(DataStore)
+    select_lyrics = metrics.instrument()(tables.select_lyrics)
+    select_songs = metrics.instrument()(tables.select_songs)
+    build_lyrics_index = metrics.instrument()(tables.build_lyrics_index)
+    build_filter_engine = metrics.instrument()(FilterEngine)
+
+    n_rows = 0
+    for _ in range(cfg.benchmark.repeats):
+        snapshot = load_snapshot(cfg.benchmark.tables_dir).snapshot()
+        lyrics_df, song_df, index_df = snapshot["lyrics_table"], snapshot["song_table"], snapshot["index_table"]
+        build_lyrics_index(lyrics_df)
+        for df in (lyrics_df, song_df):
+            engine = build_filter_engine(df)
+            for column in df.columns:
+                engine.column_stats(column)
+
+        playlists = tuple(tables.column_values(index_df, "playlist_name")[:2])
+        languages = tuple(tables.column_values(lyrics_df, "language")[:2])
+        for selection in [((), ()), (playlists, ()), ((), languages), (playlists, languages)]:
+            selected_df = select_lyrics(lyrics_df, index_df, *selection)
+            n_rows += len(selected_df) + len(select_songs(song_df, selected_df))
+    return n_rows
+
+
+def bench_hybrid_search(cfg) -> int:
+    """`HybridIndex.similar` on a synthetic index of `benchmark.search.rows` lyrics (two per song), saved and
+    loaded like the shipped one; e.g. `benchmark.search.rows=1000000 benchmark.search.quantization=pq`
+    """
+    import numpy as np
+    from .. import metrics
+    from ..search import HybridIndex, load_hybrid_index, save_hybrid_index
+    from ..tables import AUDIO_FEATURES
+
+    n_rows = OmegaConf.select(cfg, "benchmark.search.rows", default=100_000)
+    n_queries = OmegaConf.select(cfg, "benchmark.search.queries", default=50)
+    lyrics_dim, audio_dim = cfg.benchmark.corpus.dimension, len(AUDIO_FEATURES)
+
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((n_rows, lyrics_dim + audio_dim), dtype=np.float32)
+    for start in range(0, n_rows, 100_000):  # in place and in chunks, the matrix is 3 GB at 1M rows
+        for part in (slice(None, lyrics_dim), slice(lyrics_dim, None)):
+            block = matrix[start:start + 100_000, part]
+            block /= np.linalg.norm(block, axis=1, keepdims=True)
+    vector_ids = np.arange(n_rows).astype(str)
+    index = HybridIndex(vector_ids, (np.arange(n_rows) // 2).astype(str), matrix, lyrics_dim,
+                        np.zeros(audio_dim), np.ones(audio_dim))
+    save_hybrid_index(index, "search", quantization=OmegaConf.select(cfg, "benchmark.search.quantization"))
+    del index, matrix
+
+    index = load_hybrid_index("search", mmap=True)
+    similar = metrics.instrument()(index.similar)
+    for vector_id in rng.choice(vector_ids, size=n_queries):
+        similar(vector_id, k=10)
+    return n_queries
+
+
+TARGETS = {
+    "poll_spotify": bench_poll_spotify,
+    "poll_audio_features": bench_poll_audio_features,
+    "poll_genius": bench_poll_genius,
+    "dedup_lyrics": bench_dedup_lyrics,
+    "push_to_pinecone": bench_push_to_pinecone,
+    "dashboard_loaders": bench_dashboard_loaders,
+    "hybrid_search": bench_hybrid_search,
+}
+
+
+def run_target(name: str, cfg_dict: dict, workdir: str) -> dict:
+    """Run one target in the current (fresh) process; the SQLite database and lyrics files live in `workdir`"""
+    from .. import metrics
+
+    os.chdir(workdir)  # `database.db` is resolved on first connection
+    metrics.enable()
+    cfg = OmegaConf.create(cfg_dict)
+
+    start = time.perf_counter()
+    records = TARGETS[name](cfg)
+    seconds = time.perf_counter() - start
+
+    latency = {}
+    for (metric, labels), histogram in metrics.REGISTRY.histograms.items():
+        if metric == "one_music_call_seconds":
+            labels = dict(labels)
+            latency[f"{labels['service']}.{labels['function']}"] = dict(
+                calls=histogram.count,
+                p50=histogram.quantile(0.5),
+                p95=histogram.quantile(0.95),
+            )
+    waits = sum(value for (metric, _), value in metrics.REGISTRY.counters.items() if metric == "one_music_wait_seconds_total")
+
+    return dict(
+        records=records,
+        seconds=seconds,
+        records_per_sec=records / seconds if seconds else float("inf"),
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        rate_limit_wait_seconds=waits,
+        latency=latency,
+    )
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def append_history(history_path: str | Path, run: dict) -> list[dict]:
+    history_path = Path(history_path)
+    try:
+        with open(history_path) as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        history = []
+
+    history.append(run)
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(history_path, mode="w") as f:
+        json.dump(history, f, indent=2)
+    return history
+
+
+def print_report(history: list[dict]) -> None:
+    """Current results and the records/sec change since the previous run of each target"""
+    run = history[-1]
+    print(f"\n{'target':<22}{'records':>9}{'rec/s':>10}{'change':>9}{'RSS MB':>9}{'waits s':>9}")
+    for name, result in run["results"].items():
+        previous = next((r["results"][name] for r in reversed(history[:-1]) if name in r["results"]), None)
+        change = f"{result['records_per_sec'] / previous['records_per_sec'] - 1:+.0%}" if previous else ""
+        print(f"{name:<22}{result['records']:>9}{result['records_per_sec']:>10.1f}{change:>9}"
+              f"{result['peak_rss_mb']:>9.0f}{result['rate_limit_wait_seconds']:>9.1f}")
+        for function, stats in sorted(result["latency"].items()):
+            print(f"    {function:<36}{stats['calls']:>7} calls  p50 {stats['p50'] * 1e3:8.2f}ms  p95 {stats['p95'] * 1e3:8.2f}ms")
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def benchmark(cfg) -> None:
+    """Drive the ingestion stages and dashboard loaders against local fakes, e.g.
+    `python -m one_music.scripts.benchmark benchmark.latency.genius=0.2 benchmark.rate_limit.cohere=10`
+    """
+    workdir = Path(cfg.benchmark.workdir) if cfg.benchmark.workdir else Path(tempfile.mkdtemp(prefix="one_music_benchmark_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    lyrics_dir = workdir.joinpath("lyrics")
+
+    cfg_dict = OmegaConf.to_container(cfg, resolve=True)
+    cfg_dict["genius"] = dict(save_dir=str(lyrics_dir))
+    cfg_dict["pinecone"] = dict(batch_size=cfg.pinecone.batch_size)
+    cfg_dict["benchmark"]["tables_dir"] = str(Path(cfg.benchmark.tables_dir).resolve())
+
+    results = {}
+    for name in cfg.benchmark.targets:
+        # one fresh process per target, so its peak RSS is its own
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            results[name] = executor.submit(run_target, name, cfg_dict, str(workdir)).result()
+        print(f"[{name}] {results[name]['records']} records in {results[name]['seconds']:.1f}s")
+
+    history = append_history(cfg.benchmark.history_path, dict(
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        revision=git_revision(),
+        config=cfg_dict["benchmark"],
+        results=results,
+    ))
+    print_report(history)
+
+
+if __name__ == "__main__":
+    benchmark()
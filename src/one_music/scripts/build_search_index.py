@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import hydra
+import pandas as pd
+from omegaconf import OmegaConf
+
+from ..pinecone import initialize_pinecone, get_or_create_index, fetch_vectors_in_batches
+from ..search import build_hybrid_index, save_hybrid_index
+from ..tables import AUDIO_FEATURES
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def build_search_index(cfg) -> None:
+    """Build the lyrics + audio hybrid index read by the dashboard, compressed with `search.quantization` (float16, int8 or pq) when set"""
+    tables_dir = Path(cfg.search.tables_dir)
+
+    initialize_pinecone(cfg.pinecone.api_key, cfg.pinecone.environment)
+    index = get_or_create_index(cfg.pinecone.index_name, dimension=cfg.pinecone.dimension, metric="cosine")
+
+    lyrics_df = pd.read_parquet(tables_dir.joinpath("lyrics_table.parquet"), columns=["vector_id", "song_spotify_id"])
+    song_df = pd.read_parquet(tables_dir.joinpath("song_table.parquet"), columns=["song_spotify_id", *AUDIO_FEATURES])
+
+    vector_ids, vectors = fetch_vectors_in_batches(index, lyrics_df.vector_id.unique().tolist(), cfg.pinecone.batch_size)
+    hybrid_index = build_hybrid_index(vector_ids, vectors, lyrics_df, song_df, AUDIO_FEATURES)
+    save_hybrid_index(hybrid_index, cfg.search.index_dir, quantization=OmegaConf.select(cfg, "search.quantization"))
+
+
+if __name__ == "__main__":
+    build_search_index()
@@ -0,0 +1,58 @@
+from pathlib import Path
+from typing import Optional
+
+import hydra
+from omegaconf import OmegaConf
+from sqlalchemy import text
+from sqlmodel import Session
+
+from ..models import Lyrics
+from ..database import engine, create_db_and_tables
+from ..dedup import index_lyrics, lyrics_missing_signature
+from ..genius import parse_lyrics
+
+
+def dedup_lyrics_record(session: Session, lyrics: Lyrics, data_dir: str, threshold: float = 0.8) -> Optional[str]:
+    """Index one lyrics file; the url of its cluster representative when it is a near-duplicate.
+
+    A missing file is indexed as empty lyrics, so it isn't retried on every run.
+    """
+    genius_url, file_path = lyrics.genius_url, Path(data_dir).joinpath(lyrics.file_name)
+    try:
+        with open(file_path, mode="r", encoding="utf-8") as f:
+            lyrics_txt = parse_lyrics(f.read())
+    except FileNotFoundError:
+        print("FileNotFoundError:", file_path)
+        lyrics_txt = ""
+
+    session.commit()  # end the caller's transaction, if any, to open one holding the write lock
+    # take the SQLite write lock before reading the LSH buckets: streaming consumers in other threads and
+    # processes index one lyrics at a time, so near-duplicates always see each other
+    session.execute(text("BEGIN IMMEDIATE"))
+    duplicate = index_lyrics(session, genius_url, lyrics_txt, threshold=threshold)
+    session.commit()
+    return duplicate.representative_url if duplicate is not None else None
+
+
+def dedup_lyrics(cfg) -> None:
+    """Index the lyrics added since the last run; `dedup.threshold` is the similarity making a duplicate"""
+    threshold = OmegaConf.select(cfg, "dedup.threshold", default=0.8)
+
+    n_duplicates = 0
+    with Session(engine) as session:
+        missing = lyrics_missing_signature(session)
+        for lyrics in missing:
+            if dedup_lyrics_record(session, lyrics, cfg.genius.save_dir, threshold=threshold) is not None:
+                n_duplicates += 1
+
+    print(f"[dedup] {len(missing)} lyrics indexed, {n_duplicates} near-duplicates")
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    create_db_and_tables()
+    dedup_lyrics(cfg)
+
+
+if __name__ == "__main__":
+    main()
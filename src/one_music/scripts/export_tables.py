@@ -0,0 +1,127 @@
+from pathlib import Path
+from typing import Iterator, Optional
+
+import hydra
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
+from sqlmodel import select
+
+from ..models import Artist, AudioFeatures, Lyrics, LyricsDuplicate, Playlist, Song, SongArtistLink, SongPlaylistLink
+from ..database import create_db_and_tables
+from ..bulk import arrow_schema, iter_record_batches, write_parquet
+from ..datastore import write_manifest
+from ..genius import parse_lyrics
+from ..tables import read_table
+
+
+SONG_FEATURES = ["acousticness", "danceability", "duration_ms", "energy", "instrumentalness", "key", "liveness", "mode",
+                 "speechiness", "tempo", "valence"]
+LYRICS_SCHEMA = pa.schema([(name, pa.string()) for name in
+                           ["genius_url", "vector_id", "song_spotify_id", "song_name", "language", "lyrics_text"]])
+
+
+def song_query():
+    features = [getattr(AudioFeatures, name) for name in SONG_FEATURES]
+    return (
+        select(Song.spotify_id.label("song_spotify_id"), Song.name.label("song_name"), *features)
+        .join(AudioFeatures, AudioFeatures.spotify_id == Song.spotify_id, isouter=True)
+        .order_by(Song.spotify_id)
+    )
+
+
+def index_query():
+    return (
+        select(
+            Playlist.spotify_id.label("playlist_spotify_id"),
+            Playlist.name.label("playlist_name"),
+            Playlist.description.label("playlist_description"),
+            SongPlaylistLink.song_spotify_id,
+            SongArtistLink.artist_spotify_id,
+            Artist.name.label("artist_name"),
+        )
+        .join(SongPlaylistLink, SongPlaylistLink.playlist_spotify_id == Playlist.spotify_id)
+        .join(SongArtistLink, SongArtistLink.song_spotify_id == SongPlaylistLink.song_spotify_id)
+        .join(Artist, Artist.spotify_id == SongArtistLink.artist_spotify_id)
+        .order_by(Playlist.spotify_id, SongPlaylistLink.song_spotify_id)
+    )
+
+
+def lyrics_query():
+    """Near-duplicates carry the file, hence the vector id, of their representative"""
+    representative = aliased(Lyrics)
+    return (
+        select(
+            Lyrics.genius_url,
+            func.coalesce(representative.file_name, Lyrics.file_name).label("vector_file_name"),
+            Lyrics.file_name,
+            Lyrics.song_spotify_id,
+            Song.name.label("song_name"),
+            Lyrics.language,
+        )
+        .join(Song, Song.spotify_id == Lyrics.song_spotify_id)
+        .join(LyricsDuplicate, LyricsDuplicate.genius_url == Lyrics.genius_url, isouter=True)
+        .join(representative, representative.genius_url == LyricsDuplicate.representative_url, isouter=True)
+        .order_by(Lyrics.song_spotify_id, Lyrics.genius_url)
+    )
+
+
+def read_lyrics_file(file_path: Path) -> Optional[str]:
+    try:
+        with open(file_path, mode="r", encoding="utf-8") as f:
+            return parse_lyrics(f.read())
+    except FileNotFoundError:
+        print("FileNotFoundError:", file_path)
+        return None
+
+
+def lyrics_batches(batches: Iterator[pa.RecordBatch], language_names: dict, data_dir: str) -> Iterator[pa.RecordBatch]:
+    """Vector ids and language names computed on the Arrow columns; only the texts are read row by row, from files"""
+    codes = pa.array(list(language_names), type=pa.string())
+    names = pa.array(list(language_names.values()), type=pa.string())
+    for batch in batches:
+        language = pc.coalesce(pc.take(names, pc.index_in(batch["language"], value_set=codes)), batch["language"])
+        lyrics_text = pa.array([read_lyrics_file(Path(data_dir).joinpath(name)) for name in batch["file_name"].to_pylist()],
+                               type=pa.string())
+        yield pa.RecordBatch.from_arrays(
+            [
+                batch["genius_url"],
+                pc.replace_substring_regex(batch["vector_file_name"], pattern=r"\.[^.]*$", replacement=""),
+                batch["song_spotify_id"],
+                batch["song_name"],
+                language,
+                lyrics_text,
+            ],
+            schema=LYRICS_SCHEMA,
+        )
+
+
+def export_tables(cfg, batch_size: int = 65536) -> dict[str, int]:
+    """Write the dashboard tables to `export.tables_dir`, streaming each one from the database in record batches"""
+    tables_dir = Path(cfg.export.tables_dir)
+    language_df = read_table(tables_dir.joinpath("language_table.parquet"), columns=["iso_code", "language_name"])
+
+    rows = {}
+    for name, query in [("song_table", song_query()), ("index_table", index_query())]:
+        rows[name] = write_parquet(iter_record_batches(query, batch_size), tables_dir.joinpath(f"{name}.parquet"),
+                                   schema=arrow_schema(query))
+
+    batches = lyrics_batches(iter_record_batches(lyrics_query(), batch_size),
+                             dict(zip(language_df.iso_code, language_df.language_name)), cfg.genius.save_dir)
+    rows["lyrics_table"] = write_parquet(batches, tables_dir.joinpath("lyrics_table.parquet"), schema=LYRICS_SCHEMA)
+    write_manifest(tables_dir, list(rows))  # last, so running apps only swap in complete exports
+
+    for name, n_rows in rows.items():
+        print(f"[export] {name}: {n_rows} rows")
+    return rows
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    create_db_and_tables()
+    export_tables(cfg)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+import functools
+import random
+import resource
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import hydra
+import numpy as np
+import pandas as pd
+
+
+APP_DIR = Path(__file__).parents[2]
+MAIN_SCRIPT = APP_DIR.joinpath("Insights.py")
+# pages of the app started from `MAIN_SCRIPT`, relative to it
+PAGES = {
+    "insights": "Insights.py",
+    "generative": "pages/01_Generative.py",
+}
+SECRETS = dict(
+    cohere=dict(api_key="local"),
+    pinecone=dict(api_key="local", environment="local", index_name="one-music"),
+)
+
+
+class CacheStats:
+    """Calls and executions (misses) of every function cached with `st.cache_data` or `st.cache_resource`"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+    def counting(self, cache_decorator):
+        def decorator(func=None, **kwargs):
+            if func is None:
+                return functools.partial(decorator, **kwargs)
+            name = f"{Path(func.__code__.co_filename).stem}.{func.__qualname__}"  # pages share function names
+
+            @functools.wraps(func)  # Streamlit keys the cache on the wrapped function's source and hashes its signature
+            def body(*args, **kw):
+                with self._lock:
+                    self.misses[name] += 1
+                return func(*args, **kw)
+
+            cached = cache_decorator(body, **kwargs)
+
+            @functools.wraps(func)
+            def counted(*args, **kw):
+                with self._lock:
+                    self.calls[name] += 1
+                return cached(*args, **kw)
+
+            return counted
+        return decorator
+
+    def hit_rates(self) -> dict[str, dict]:
+        return {
+            name: dict(calls=calls, misses=self.misses[name], hit_rate=1 - self.misses[name] / calls)
+            for name, calls in sorted(self.calls.items())
+        }
+
+
+@contextmanager
+def patched(*patches):
+    """Temporarily set `(obj, attribute, value)` triples"""
+    originals = [(obj, attribute, getattr(obj, attribute)) for obj, attribute, _ in patches]
+    for obj, attribute, value in patches:
+        setattr(obj, attribute, value)
+    try:
+        yield
+    finally:
+        for obj, attribute, value in originals:
+            setattr(obj, attribute, value)
+
+
+def fixture_index(tables_dir: Path, dimension: int, latency: float):
+    """Fake Pinecone index holding a random vector per lyrics of the local tables, with the `push_to_pinecone` metadata"""
+    from ..fakes import FakePineconeIndex
+
+    lyrics_df = pd.read_parquet(tables_dir.joinpath("lyrics_table.parquet"), columns=["vector_id", "song_spotify_id", "language"])
+    language_codes = pd.read_parquet(tables_dir.joinpath("language_table.parquet")).set_index("language_name").iso_code
+    vectors = np.random.default_rng(0).standard_normal((len(lyrics_df), dimension)).astype(np.float32)
+
+    index = FakePineconeIndex()
+    index.upsert([
+        (vector_id, vector, dict(language=language_codes.get(language, language), song_spotify_id=song_id))
+        for vector_id, vector, song_id, language in zip(lyrics_df.vector_id, vectors, lyrics_df.song_spotify_id, lyrics_df.language)
+    ])
+    index.throttle.latency = latency
+    index.throttle.calls = 0
+    return index
+
+
+class RuntimeSlot:
+    """Stand-in for `Runtime` in the AppTest module, receiving the runtime each `AppTest._run` installs"""
+    _instance = None
+
+
+@contextmanager
+def shared_runtime():
+    """One mock Streamlit runtime and one set of secrets for every AppTest session, as in one server process.
+
+    `AppTest._run` installs a new mock runtime (and the secrets) for each script run and removes them when
+    the run ends, which would pull them from under the runs of other sessions in flight. Here its
+    assignments go to `RuntimeSlot`, so sessions run their scripts concurrently in their own threads,
+    sharing the runtime, the `st.cache_*` caches and the secrets installed below. Pages are compiled once
+    into a shared script cache, as a server does, rather than by every run: compiling concurrently in
+    threads can fail (the AST constructor is not thread-safe) and leaves an empty page.
+    """
+    import streamlit
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import patch_config_options
+
+    class RunPagesManager(PagesManager):
+        """Takes the reset of `uses_pages_directory` done by every `AppTest._run`, which script runners of
+        other sessions would read mid-run; the flag they read stays set for the app's `pages` directory"""
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = app_test.MediaFileManager(app_test.MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = app_test.DataframeSourceManager()
+    runtime.cache_storage_manager = app_test.MemoryCacheStorageManager()
+    secrets = Secrets()
+    secrets._secrets = SECRETS
+    script_cache = app_test.ScriptCache()
+
+    patches = [
+        (app_test, "Runtime", RuntimeSlot),
+        (Runtime, "_instance", runtime),
+        (app_test, "ScriptCache", lambda: script_cache),
+        (local_script_runner, "ScriptCache", lambda: script_cache),
+        (app_test, "PagesManager", RunPagesManager),
+        (PagesManager, "uses_pages_directory", MAIN_SCRIPT.parent.joinpath("pages").exists()),
+        (streamlit, "secrets", secrets),
+    ]
+    # runs restore the option to its value when they started, so it stays set until every run is over
+    with patched(*patches), patch_config_options({"global.appTest": True}):
+        yield
+
+
+class ConcurrentRuns:
+    """Wraps `AppTest._run` to record how many script runs were in flight when each one started"""
+
+    def __init__(self, run):
+        self.run = run
+        self.in_flight = 0
+        self.overlaps: list[int] = []
+        self._lock = threading.Lock()
+
+    def __get__(self, at, owner=None):
+        return self if at is None else functools.partial(self, at)  # bind like the method it replaces
+
+    def __call__(self, at, *args, **kwargs):
+        with self._lock:
+            self.overlaps.append(self.in_flight)
+            self.in_flight += 1
+        try:
+            return self.run(at, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def by_label(widgets, label: str):
+    for widget in widgets:
+        if widget.label.startswith(label):
+            return widget
+    raise LookupError(f"no widget labelled {label!r} among {[widget.label for widget in widgets]}")
+
+
+def playlist_languages(tables_dir: Path) -> dict[str, list[str]]:
+    """Playlist name -> sorted languages of its lyrics that have an ISO code, i.e. selections a lyrics search has candidates for"""
+    index_df = pd.read_parquet(tables_dir.joinpath("index_table.parquet"), columns=["playlist_name", "song_spotify_id"])
+    lyrics_df = pd.read_parquet(tables_dir.joinpath("lyrics_table.parquet"), columns=["song_spotify_id", "language"])
+    language_names = pd.read_parquet(tables_dir.joinpath("language_table.parquet"), columns=["language_name"]).language_name
+    df = index_df.merge(lyrics_df.loc[lyrics_df.language.isin(language_names)], on="song_spotify_id")
+    return {playlist: sorted(languages.unique()) for playlist, languages in df.groupby("playlist_name").language}
+
+
+def insights_steps(song_ids: list[str], selections: dict[str, list[str]], rng: random.Random):
+    """Typical analyst session: narrow the selection to lyrics that exist, search, recolor, inspect a song, reset"""
+    def select_playlist(at):
+        widget = by_label(at.multiselect, "Select playlist")
+        return widget.set_value(rng.sample(sorted(set(widget.options) & set(selections)), k=1)).run()
+
+    def select_language(at):
+        playlists = by_label(at.multiselect, "Select playlist").value or list(selections)
+        languages = sorted({language for playlist in playlists for language in selections.get(playlist, [])})
+        return by_label(at.multiselect, "Select language").set_value(rng.sample(languages, k=min(2, len(languages)))).run()
+
+    def search(at):
+        query = rng.choice(["heartbreak at night", "summer dance party", "saudade do mar", "amor y fuego", "lonely city lights"])
+        return by_label(at.text_input, "Describe the lyrics").input(query).run()
+
+    def recolor(at):
+        return by_label(at.selectbox, "Color selection").select(rng.choice(["song_name", "language"])).run()
+
+    def inspect_song(at):
+        return at.sidebar.text_input[0].input(rng.choice(song_ids)).run()
+
+    def reset(at):
+        for label in ["Select playlist", "Select language"]:
+            by_label(at.multiselect, label).set_value([])
+        return by_label(at.text_input, "Describe the lyrics").input("").run()
+
+    return [select_playlist, select_language, search, recolor, inspect_song, reset]
+
+
+def generative_steps(song_ids: list[str], selections: dict[str, list[str]], rng: random.Random):
+    """Pick a song, filter the table, generate, try another seed, inspect a song"""
+    def pick_song(at):
+        return by_label(at.text_input, "Input Spotify id to Generate").input(rng.choice(song_ids)).run()
+
+    def toggle_filters(at):
+        widget = by_label(at.checkbox, "Add filters")
+        return widget.set_value(not widget.value).run()
+
+    def generate(at):
+        return by_label(at.button, "Generate").click().run()
+
+    def reseed(at):
+        return by_label(at.number_input, "Snippet seed").set_value(rng.randint(0, 3)).run()
+
+    def inspect_song(at):
+        return at.sidebar.text_input[0].input(rng.choice(song_ids)).run()
+
+    return [pick_song, toggle_filters, generate, reseed, inspect_song]
+
+
+STEPS = dict(insights=insights_steps, generative=generative_steps)
+
+
+def new_app(page: str, timeout: float):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(str(MAIN_SCRIPT), default_timeout=timeout)  # secrets come from `shared_runtime`
+    return at if PAGES[page] == MAIN_SCRIPT.name else at.switch_page(PAGES[page])
+
+
+def run_session(page: str, song_ids: list[str], selections: dict[str, list[str]], reruns: int, seed: int, timeout: float,
+                barrier: threading.Barrier, latencies: dict, errors: Counter) -> None:
+    rng = random.Random(seed)
+    at = new_app(page, timeout)
+
+    def load(_):
+        return new_app(page, timeout).run()  # a new browser tab, also after a failure
+
+    steps = [load, *STEPS[page](song_ids, selections, rng)]
+    failed = False
+    barrier.wait()  # every session starts together
+    for rerun in range(reruns):
+        step = steps[0] if rerun == 0 or failed else steps[1 + (rerun - 1) % (len(steps) - 1)]
+        start = time.perf_counter()
+        try:
+            at = step(at)
+        except Exception as e:
+            errors[f"{page}.{step.__name__}: {type(e).__name__}: {e}"] += 1
+            failed = True  # the page may be missing widgets now, start over
+            continue
+        latencies[(page, step.__name__)].append(time.perf_counter() - start)
+        failed = bool(at.exception) or not at.main.children
+        if at.exception:
+            errors[f"{page}.{step.__name__}: {at.exception[0].message}"] += 1
+        elif failed:  # e.g. the script failed to compile
+            errors[f"{page}.{step.__name__}: rendered nothing"] += 1
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return float("nan")
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    return dict(zip(["p50", "p95", "p99"], np.percentile(values, [50, 95, 99]))) if values else {}
+
+
+def load_test(sessions: int, reruns: int, pages: list[str], tables_dir: Path, dimension: int = 768,
+              cohere_latency: float = 0.0, pinecone_latency: float = 0.0, timeout: float = 60.0, seed: int = 0) -> dict:
+    """Drive `sessions` concurrent AppTest sessions per page, each in its own thread, against local tables and fake services.
+
+    Sessions share one runtime and its caches (see `shared_runtime`); `reruns_per_second` is the throughput
+    of all sessions together and `concurrency` the number of other script runs in flight as each run started.
+    """
+    import streamlit
+    from streamlit.testing.v1 import AppTest
+
+    from .. import cohere, pinecone
+    from ..fakes import FakeCohere
+
+    cohere_client = FakeCohere(dimension, latency=cohere_latency)
+    pinecone_index = fixture_index(tables_dir, dimension, pinecone_latency)
+    song_ids = pd.read_parquet(tables_dir.joinpath("lyrics_table.parquet"), columns=["song_spotify_id"]).song_spotify_id.unique().tolist()
+    selections = playlist_languages(tables_dir)
+    cache_stats = CacheStats()
+
+    runs = ConcurrentRuns(AppTest._run)
+    latencies = defaultdict(list)
+    errors = Counter()
+    with shared_runtime(), patched(
+        (AppTest, "_run", runs),
+        (streamlit, "cache_data", cache_stats.counting(streamlit.cache_data)),
+        (streamlit, "cache_resource", cache_stats.counting(streamlit.cache_resource)),
+        (cohere, "create_cohere_client", lambda api_key: cohere_client),
+        (pinecone, "initialize_pinecone", lambda api_key, environment: None),
+        (pinecone, "get_or_create_index", lambda index_name, dimension, metric: pinecone_index),
+    ):
+        start = time.perf_counter()
+        barrier = threading.Barrier(sessions * len(pages))
+        threads = [
+            threading.Thread(target=run_session, args=(page, song_ids, selections, reruns, seed + i, timeout, barrier, latencies, errors))
+            for page in pages for i in range(sessions)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+    n_reruns = sum(len(values) for values in latencies.values())
+    return dict(
+        sessions=sessions,
+        seconds=seconds,
+        reruns_per_second=n_reruns / seconds,
+        reruns={page: percentiles([v for (p, _), values in latencies.items() if p == page for v in values]) for page in pages},
+        concurrency=dict(mean=float(np.mean(runs.overlaps)) if runs.overlaps else 0.0, max=max(runs.overlaps, default=0)),
+        steps={f"{page}.{step}": percentiles(values) for (page, step), values in sorted(latencies.items())},
+        caches=cache_stats.hit_rates(),
+        service_calls=dict(cohere=cohere_client.throttle.calls, pinecone=pinecone_index.throttle.calls),
+        errors=dict(errors),
+        rss_mb=current_rss_mb(),
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    )
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['sessions']} concurrent sessions per page in {report['seconds']:.1f}s, "
+          f"{report['reruns_per_second']:.1f} reruns/s, RSS {report['rss_mb']:.0f} MB (peak {report['peak_rss_mb']:.0f} MB)")
+    print(f"other runs in flight at each run start: mean {report['concurrency']['mean']:.1f}, max {report['concurrency']['max']}")
+    for name, stats in [*report["reruns"].items(), *report["steps"].items()]:
+        if stats:
+            print(f"  {name:<34} p50 {stats['p50'] * 1e3:8.0f}ms  p95 {stats['p95'] * 1e3:8.0f}ms  p99 {stats['p99'] * 1e3:8.0f}ms")
+    print("caches")
+    for name, stats in report["caches"].items():
+        print(f"  {name:<34} {stats['calls']:>6} calls  {stats['misses']:>5} misses  hit rate {stats['hit_rate']:.1%}")
+    print("service calls", report["service_calls"])
+    for error, count in report["errors"].items():
+        print(f"  error x{count}: {error}")
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    """e.g. `python -m one_music.scripts.load_test load_test.sessions=12 load_test.reruns=30`"""
+    report = load_test(
+        sessions=cfg.load_test.sessions,
+        reruns=cfg.load_test.reruns,
+        pages=list(cfg.load_test.pages),
+        tables_dir=APP_DIR.joinpath("data/tables"),
+        cohere_latency=cfg.load_test.latency.cohere,
+        pinecone_latency=cfg.load_test.latency.pinecone,
+        timeout=cfg.load_test.timeout,
+        seed=cfg.load_test.seed,
+    )
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
-import time
+import hashlib
+import multiprocessing
+import queue
 import random
+import time
+from collections import Counter
+from typing import Collection
 
 import hydra
+from omegaconf import OmegaConf
 from sqlmodel import Session, select
 
+from .. import metrics
 from ..models import Song, Lyrics
 from ..database import engine, create_db_and_tables, get_or_create
 
@@ -21,75 +28,194 @@ from ..cohere import (
 )
 
 
-@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
-def poll_genius(cfg) -> None:
+def fetch_song_lyrics(song_spotify_id: str, song_name: str, artist_name: str, genius_client, cohere_client,
+                      save_dir: str, translation_sleep: tuple[int, int] = (45, 60), saved_urls: Collection[str] = ()):
+    """Yield a `Lyrics` record for the song and each of its translations, saving the texts to `save_dir`.
 
-    cohere_client = create_cohere_client(cfg.cohere.api_key)
-    genius_client = create_genius_client(cfg.genius.client_token)
+    The translation sleep happens when the next record is requested, so consumers can commit before it.
+    Lyrics whose url is in `saved_urls` are neither fetched nor yielded, so an interrupted song can be resumed.
+    """
+    # NOTE Genius could return translations as primary result
+    song_genius = search_song(client=genius_client, song_name=song_name, artist_name=artist_name)
 
-    with Session(engine) as session:
-        query = select(Song, Lyrics).join(Lyrics, isouter=True)
-        results = session.exec(query)
+    if song_genius is None:  # couldn't find a result for query
+        return
+    elif song_genius.lyrics is None:  # some song page are blank
+        return
+    elif song_genius.url in ['https://genius.com/Lao-ma--annotated', 'https://genius.com/Gazapizm-heyecan-yok-lyrics']:
+        return
 
-        for song, lyrics in results:
-            if lyrics is not None:
-                continue
-            # NOTE Genius could return translations as primary result
-            song_genius = search_song(client=genius_client, song_name=song.name, artist_name=song.artists[0].name)
+    if song_genius.url not in saved_urls:
+        lyrics_snippet = song_genius.lyrics[200:]  # selecting end of text because beginning has variable headers
+        detected_language_name, detected_language_code = detect_lyrics_language(cohere_client, lyrics_snippet)
 
-            if song_genius is None:  # couldn't find a result for query
-                continue
-            elif song_genius.lyrics is None:  # some song page are blank
-                continue
-            elif song_genius.url in ['https://genius.com/Lao-ma--annotated', 'https://genius.com/Gazapizm-heyecan-yok-lyrics']:
-                continue
+        file_name = generate_file_name(song_genius.url)
+        save_lyrics_to_file(lyrics=song_genius.lyrics, file_name=file_name, save_dir=save_dir)
 
-            lyrics_snippet = song_genius.lyrics[200:]  # selecting end of text because beginning has variable headers
-            detected_language_name, detected_language_code = detect_lyrics_language(cohere_client, lyrics_snippet)
+        yield dict(
+            genius_url=song_genius.url,
+            song_spotify_id=song_spotify_id,
+            language=detected_language_code,
+            file_name=file_name,
+        )
 
-            file_name = generate_file_name(song_genius.url)
-            save_lyrics_to_file(lyrics=song_genius.lyrics, file_name=file_name, save_dir=cfg.genius.save_dir)
+    for translation_url, scraped_language in crawl_for_translations(song_genius.url):
+        if translation_url is None:  # exhaust crawling results
+            break
+        if translation_url in saved_urls:
+            continue
 
-            lyrics_record = dict(
-                genius_url=song_genius.url,
-                song_spotify_id=song.spotify_id,
-                language=detected_language_code,
-                file_name=file_name,
-            )
-            lyrics_obj = get_or_create(session, lyrics_record, Lyrics, "song_spotify_id")
-            session.add(lyrics_obj)
+        translation_lyrics = get_song_lyrics(client=genius_client, song_url=translation_url)
+        if translation_lyrics is None:  # some song page are blank
+            continue
 
-            for translation_url, scraped_language in crawl_for_translations(song_genius.url):
-                if translation_url is None:  # exhaust crawling results
-                    break
+        lyrics_snippet = translation_lyrics[:200]
+        detected_language_name, detected_language_code = detect_lyrics_language(cohere_client, lyrics_snippet)
 
-                translation_lyrics = get_song_lyrics(client=genius_client, song_url=translation_url)
-                if translation_lyrics is None:  # some song page are blank
-                    continue
+        if scraped_language in ["Romanization", "romanization"]:
+            detected_language_code += "_rom"
 
-                lyrics_snippet = translation_lyrics[:200]
-                detected_language_name, detected_language_code = detect_lyrics_language(cohere_client, lyrics_snippet)
+        file_name = generate_file_name(song_genius.url)
+        save_lyrics_to_file(translation_lyrics, file_name=file_name, save_dir=save_dir)
 
-                if scraped_language in ["Romanization", "romanization"]:
-                    detected_language_code += "_rom"
+        yield dict(
+            genius_url=translation_url,
+            song_spotify_id=song_spotify_id,
+            language=detected_language_code,
+            file_name=file_name,
+        )
 
-                file_name = generate_file_name(song_genius.url)
-                save_lyrics_to_file(translation_lyrics, file_name=file_name, save_dir=cfg.genius.save_dir)
+        metrics.rate_limit_sleep("genius", random.randint(*translation_sleep))  # sleep for Genius API calls
 
-                lyrics_record = dict(
-                    genius_url=translation_url,
-                    song_spotify_id=song.spotify_id,
-                    language=detected_language_code,
-                    file_name=file_name,
-                )
-                lyrics_obj = get_or_create(session, lyrics_record, Lyrics, "song_spotify_id")
-                session.add(lyrics_obj)
 
-                time.sleep(30 + random.randint(15, 30))  # sleep for Genius API calls
+def save_lyrics_record(session: Session, record: dict) -> None:
+    session.add(get_or_create(session, record, Lyrics, "genius_url"))
+    session.commit()  # release the SQLite write lock before sleeping, other stages may be writing
 
-            session.commit()
 
+def songs_missing_lyrics() -> list[tuple[str, str, str]]:
+    """`(spotify_id, name, first artist name)` of the songs without any lyrics"""
+    with Session(engine) as session:
+        query = select(Song).where(~Song.lyrics.any())
+        return [(song.spotify_id, song.name, song.artists[0].name) for song in session.exec(query)]
 
-if __name__ == "__main__":
+
+def poll_genius(cfg, genius_client=None, cohere_client=None, translation_sleep: tuple[int, int] = (45, 60)) -> None:
+    """Clients default to the configured ones; `translation_sleep` is the range in seconds waited between translations"""
+    if cohere_client is None:
+        cohere_client = create_cohere_client(cfg.cohere.api_key)
+    if genius_client is None:
+        genius_client = create_genius_client(cfg.genius.client_token)
+
+    with Session(engine) as session:
+        for spotify_id, song_name, artist_name in songs_missing_lyrics():
+            records = fetch_song_lyrics(spotify_id, song_name, artist_name, genius_client, cohere_client,
+                                        save_dir=cfg.genius.save_dir, translation_sleep=translation_sleep)
+            for record in records:
+                save_lyrics_record(session, record)
+
+
+def shard_of(spotify_id: str, n_shards: int) -> int:
+    """Stable across processes and runs, unlike `hash` of a str"""
+    return int.from_bytes(hashlib.sha1(spotify_id.encode("utf-8")).digest()[:8], "big") % n_shards
+
+
+def create_clients(credentials: dict):
+    """Genius and Cohere clients of one shard, from its `client_token` and `cohere_api_key`"""
+    return create_genius_client(credentials["client_token"]), create_cohere_client(credentials["cohere_api_key"])
+
+
+def poll_genius_shard(shard: int, songs: list[tuple[str, str, str]], credentials: dict, save_dir: str,
+                      translation_sleep: tuple[int, int], results: multiprocessing.Queue, clients_factory=create_clients) -> None:
+    """Worker process: call the APIs with the shard's own credentials and send the records to the writer"""
+    try:
+        genius_client, cohere_client = clients_factory(credentials)
+        for spotify_id, song_name, artist_name in songs:
+            for record in fetch_song_lyrics(spotify_id, song_name, artist_name, genius_client, cohere_client,
+                                            save_dir=save_dir, translation_sleep=translation_sleep):
+                results.put(("lyrics", shard, record))
+            results.put(("song", shard, spotify_id))
+    except Exception as e:
+        results.put(("error", shard, f"{type(e).__name__}: {e}"))
+    results.put(("done", shard, None))
+
+
+def poll_genius_sharded(cfg, translation_sleep: tuple[int, int] = (45, 60), clients_factory=create_clients,
+                        progress_every: float = 30.0) -> Counter:
+    """Split the songs missing lyrics across one worker process per entry of `cfg.genius.shards`.
+
+    Each entry holds the worker's `client_token` and optionally its `cohere_api_key` (`cfg.cohere.api_key`
+    otherwise). Workers only call the APIs and write lyrics files; this process is the single SQLite writer.
+    `clients_factory` must be importable, workers are spawned. Raises once every shard is drained when any failed.
+    """
+    shards = [
+        dict(client_token=shard.client_token, cohere_api_key=shard.get("cohere_api_key") or cfg.cohere.api_key)
+        for shard in cfg.genius.shards
+    ]
+    songs = songs_missing_lyrics()
+    songs_per_shard = [[] for _ in shards]
+    for song in songs:
+        songs_per_shard[shard_of(song[0], len(shards))].append(song)
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [
+        context.Process(target=poll_genius_shard, daemon=True,
+                        args=(shard, songs_per_shard[shard], credentials, cfg.genius.save_dir, translation_sleep, results, clients_factory))
+        for shard, credentials in enumerate(shards)
+    ]
+    for worker in workers:
+        worker.start()
+
+    progress = Counter()
+    songs_done = Counter()
+    running = set(range(len(workers)))
+    last_report = time.perf_counter()
+    with Session(engine) as session:
+        while running:
+            try:
+                kind, shard, payload = results.get(timeout=1)
+            except queue.Empty:
+                for shard in list(running):
+                    if not workers[shard].is_alive():  # killed without reporting
+                        print(f"[genius shard {shard}] exited with code {workers[shard].exitcode}")
+                        progress["failed_shards"] += 1
+                        running.discard(shard)
+                continue
+
+            if kind == "lyrics":
+                save_lyrics_record(session, payload)
+                progress["lyrics"] += 1
+            elif kind == "song":
+                songs_done[shard] += 1
+                progress["songs"] += 1
+            elif kind == "error":
+                print(f"[genius shard {shard}] {payload}")
+                progress["failed_shards"] += 1
+            elif kind == "done":
+                running.discard(shard)
+
+            if time.perf_counter() - last_report > progress_every or not running:
+                last_report = time.perf_counter()
+                per_shard = " ".join(f"{songs_done[i]}/{len(songs_per_shard[i])}" for i in range(len(shards)))
+                print(f"[genius] {progress['songs']}/{len(songs)} songs, {progress['lyrics']} lyrics; per shard {per_shard}")
+
+    for worker in workers:
+        worker.join()
+    if progress["failed_shards"]:  # the lyrics saved are kept; the pipeline must not record the stage as done
+        raise RuntimeError(f"{progress['failed_shards']} of {len(shards)} Genius shards failed")
+    return progress
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    """Sharded across processes when `genius.shards` lists credentials, e.g. `genius.shards=[{client_token: ...}, ...]`"""
     create_db_and_tables()
-    poll_genius()
+    if OmegaConf.select(cfg, "genius.shards"):
+        poll_genius_sharded(cfg)
+    else:
+        poll_genius(cfg)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,45 @@
+from typing import Callable, Optional
+
 import hydra
-from sqlmodel import Session
+from omegaconf import OmegaConf
+from sqlalchemy import inspect
+from sqlmodel import Session, select
 
 from ..models import Playlist, Song, Artist, AudioFeatures
 from ..database import engine, create_db_and_tables, get_or_create
+from ..aggregates import market_name
+from ..charts import DEFAULT_HISTORY_DIR, ChartHistory
 
 from ..spotify import (
     create_authenticator,
     create_spotify_client,
-    get_user_playlists,
+    discover_user_playlists,
+    cached_user_playlists,
     get_playlist_songs,
     get_audio_features
 )
 
 
-@hydra.main(config_name="spotify.yaml", config_path="../../config", version_base="1.2")
-def poll_spotify(cfg) -> None:
+def poll_spotify(cfg, spotify_client=None, on_new_songs: Optional[Callable[[list[str]], None]] = None) -> None:
+    """`on_new_songs` receives the ids of the songs seen for the first time, once they are committed.
 
-    spotify_authenticator = create_authenticator(cfg.client_id, cfg.client_secret)
-    spotify_client = create_spotify_client(auth_manager=spotify_authenticator)
+    The charts polled are appended, with their positions, to the chart history in `charts.history_dir`
+    (by default `charts.DEFAULT_HISTORY_DIR`, the one the dashboard reads).
+    """
+    if spotify_client is None:
+        spotify_authenticator = create_authenticator(cfg.spotify.client_id, cfg.spotify.client_secret)
+        spotify_client = create_spotify_client(auth_manager=spotify_authenticator)
 
-    spotify_playlists = get_user_playlists(client=spotify_client, user_id="spotify")
+    # the catalogue of the `spotify` user is thousands of playlists and rarely changes
+    cache_path = OmegaConf.select(cfg, "spotify.playlists_cache.path")
+    max_workers = OmegaConf.select(cfg, "spotify.discovery_workers", default=8)
+    if cache_path:
+        spotify_playlists = cached_user_playlists(spotify_client, "spotify", cache_path, max_workers=max_workers,
+                                                  ttl=OmegaConf.select(cfg, "spotify.playlists_cache.ttl", default=86400))
+    else:
+        spotify_playlists = discover_user_playlists(spotify_client, "spotify", max_workers=max_workers)
     filter_func = lambda p: "Top 50 -" in p["name"]
+    chart_rows = []
 
     # TODO optimization: multiprocessing, async API calls, batch SQL inserts
     with Session(engine) as session:
@@ -37,18 +56,20 @@ def poll_spotify(cfg) -> None:
             if songs is None:
                 continue
 
-            for song in songs:
+            new_song_ids = []
+            for position, song in enumerate(songs, start=1):
                 song_record = dict(
                     spotify_id=song["id"],
                     name=song["name"],
                 )
                 song_obj = get_or_create(session, song_record, Song, "spotify_id")
-                song_obj.playlists.append(playlist_obj)
+                if inspect(song_obj).transient:
+                    new_song_ids.append(song_obj.spotify_id)
+                if playlist_obj not in song_obj.playlists:  # songs chart in several markets and across polls
+                    song_obj.playlists.append(playlist_obj)
                 session.add(song_obj)
-
-                audio_features_record = get_audio_features(spotify_client, song_id=song["id"])
-                audio_features_obj = get_or_create(session, audio_features_record, AudioFeatures, "spotify_id")
-                session.add(audio_features_obj)
+                chart_rows.append(dict(playlist_spotify_id=playlist["id"], market=market_name(playlist["name"]),
+                                       position=position, song_spotify_id=song["id"]))
 
                 for artist in song["artists"]:
                     artist_record = dict(
@@ -56,12 +77,45 @@ def poll_spotify(cfg) -> None:
                         name=artist["name"],
                     )
                     artist_obj = get_or_create(session, artist_record, Artist, "spotify_id")
-                    artist_obj.songs.append(song_obj)
+                    if song_obj not in artist_obj.songs:
+                        artist_obj.songs.append(song_obj)
                     session.add(artist_obj)
 
             session.commit()
+            if on_new_songs is not None and new_song_ids:
+                on_new_songs(new_song_ids)
 
+    # one append per poll, so each month file is rewritten once
+    ChartHistory(OmegaConf.select(cfg, "charts.history_dir", default=str(DEFAULT_HISTORY_DIR))).append(chart_rows)
 
-if __name__ == "__main__":
+
+def poll_audio_features(cfg, spotify_client=None) -> None:
+    """Fetch audio features of the songs that don't have them yet"""
+    if spotify_client is None:
+        spotify_authenticator = create_authenticator(cfg.spotify.client_id, cfg.spotify.client_secret)
+        spotify_client = create_spotify_client(auth_manager=spotify_authenticator)
+
+    with Session(engine) as session:
+        query = select(Song.spotify_id).join(AudioFeatures, isouter=True).where(AudioFeatures.spotify_id.is_(None))
+        song_ids = session.exec(query).all()
+
+        for song_id in song_ids:
+            save_audio_features(session, spotify_client, song_id)
+
+
+def save_audio_features(session: Session, spotify_client, song_id: str) -> None:
+    audio_features_record = get_audio_features(spotify_client, song_id=song_id)
+    audio_features_obj = get_or_create(session, audio_features_record, AudioFeatures, "spotify_id")
+    session.add(audio_features_obj)
+    session.commit()
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
     create_db_and_tables()
-    poll_spotify()
+    poll_spotify(cfg)
+    poll_audio_features(cfg)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+from pathlib import Path
+
+import hydra
+import numpy as np
+import pandas as pd
+
+from ..pinecone import initialize_pinecone, get_or_create_index, fetch_vectors, fetch_vectors_in_batches
+from ..tables import AUDIO_FEATURES
+from ..projection import (
+    create_lyrics_reducer,
+    create_audio_reducer,
+    save_reducer,
+    load_reducer,
+    fit_coordinates,
+    fit_transform_large,
+    report_phase,
+    to_coordinates,
+    update_coordinates,
+    load_coordinates,
+    save_coordinates,
+)
+
+
+def fetch_vectors_to_memmap(index, vector_ids: list[str], batch_size: int, dimension: int, file_path: Path) -> list[str]:
+    """Stream vectors from Pinecone into a float32 `.npy` memory map; returns ids in row order"""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    vectors = np.lib.format.open_memmap(file_path, mode="w+", dtype=np.float32, shape=(len(vector_ids), dimension))
+    ids = []
+    for i in range(0, len(vector_ids), batch_size):
+        batch_ids, batch_vectors = fetch_vectors(index, vector_ids[i:i+batch_size])
+        vectors[len(ids):len(ids)+len(batch_ids)] = batch_vectors
+        ids.extend(batch_ids)
+
+    vectors.flush()
+    del vectors
+    if len(ids) < len(vector_ids):  # drop rows of vectors missing from the index
+        trimmed_path = file_path.with_name(file_path.stem + "_trimmed.npy")
+        np.save(trimmed_path, np.load(file_path, mmap_mode="r")[:len(ids)])
+        trimmed_path.replace(file_path)
+
+    return ids
+
+
+def project_lyrics_large(cfg, index, tables_dir: Path, model_dir: Path) -> None:
+    """Large-scale mode: stratified sample fit + batched parallel transform over memory-mapped vectors"""
+    lyrics_df = pd.read_parquet(tables_dir.joinpath("lyrics_table.parquet"), columns=["vector_id", "song_spotify_id", "language"])
+    lyrics_df = lyrics_df.drop_duplicates("vector_id")
+    index_df = pd.read_parquet(tables_dir.joinpath("index_table.parquet"), columns=["song_spotify_id", "playlist_name"])
+    primary_playlist = index_df.drop_duplicates("song_spotify_id").set_index("song_spotify_id").playlist_name
+
+    vectors_path = model_dir.joinpath("lyrics_vectors.npy")
+    with report_phase("fetch"):
+        vector_ids = fetch_vectors_to_memmap(index, lyrics_df.vector_id.tolist(), cfg.pinecone.batch_size,
+                                             cfg.pinecone.dimension, vectors_path)
+
+    lyrics_df = lyrics_df.set_index("vector_id").loc[vector_ids]
+    strata = lyrics_df.language + "|" + lyrics_df.song_spotify_id.map(primary_playlist).fillna("")
+
+    embedding = fit_transform_large(
+        vectors_path=vectors_path,
+        reducer_path=model_dir.joinpath("lyrics_umap.joblib"),
+        embedding_path=model_dir.joinpath("lyrics_embedding.npy"),
+        strata=strata.reset_index(drop=True),
+        n_samples=cfg.projection.n_samples,
+        batch_size=cfg.projection.batch_size,
+        n_jobs=cfg.projection.n_jobs,
+    )
+    coordinates_df = to_coordinates(vector_ids, embedding, "vector_id", ["lyrics_x", "lyrics_y"])
+    save_coordinates(coordinates_df, tables_dir.joinpath("lyrics_projection.parquet"))
+
+
+def project(reducer_path: Path, coordinates_path: Path, create_reducer, ids, X, id_column: str, columns: list[str], refit: bool) -> None:
+    reducer = None if refit else load_reducer(reducer_path)
+
+    if reducer is None:
+        reducer = create_reducer()
+        coordinates_df = fit_coordinates(reducer, ids, X, id_column, columns)
+        save_reducer(reducer, reducer_path)
+    else:
+        coordinates_df = load_coordinates(coordinates_path, id_column, columns)
+        coordinates_df = update_coordinates(reducer, coordinates_df, ids, X, id_column, columns)
+
+    save_coordinates(coordinates_df, coordinates_path)
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def project_umap(cfg) -> None:
+    """Fit (on first run or `projection.refit=true`) or extend the lyrics and audio UMAP projections.
+
+    With `projection.large_scale=true` the lyrics projection is refit on a stratified sample instead.
+    """
+    tables_dir = Path(cfg.projection.tables_dir)
+    model_dir = Path(cfg.projection.model_dir)
+
+    initialize_pinecone(cfg.pinecone.api_key, cfg.pinecone.environment)
+    index = get_or_create_index(cfg.pinecone.index_name, dimension=cfg.pinecone.dimension, metric="cosine")
+
+    if cfg.projection.large_scale:
+        project_lyrics_large(cfg, index, tables_dir, model_dir)
+    else:
+        lyrics_df = pd.read_parquet(tables_dir.joinpath("lyrics_table.parquet"), columns=["vector_id"])
+        vector_ids, vectors = fetch_vectors_in_batches(index, lyrics_df.vector_id.unique().tolist(), cfg.pinecone.batch_size)
+        project(
+            reducer_path=model_dir.joinpath("lyrics_umap.joblib"),
+            coordinates_path=tables_dir.joinpath("lyrics_projection.parquet"),
+            create_reducer=create_lyrics_reducer,
+            ids=vector_ids,
+            X=np.asarray(vectors, dtype=np.float32),
+            id_column="vector_id",
+            columns=["lyrics_x", "lyrics_y"],
+            refit=cfg.projection.refit,
+        )
+
+    song_df = pd.read_parquet(tables_dir.joinpath("song_table.parquet"), columns=["song_spotify_id", *AUDIO_FEATURES])
+    song_df = song_df.dropna(subset=AUDIO_FEATURES).drop_duplicates("song_spotify_id")
+    project(
+        reducer_path=model_dir.joinpath("audio_umap.joblib"),
+        coordinates_path=tables_dir.joinpath("audio_projection.parquet"),
+        create_reducer=create_audio_reducer,
+        ids=song_df.song_spotify_id,
+        X=song_df[AUDIO_FEATURES].to_numpy(),
+        id_column="song_spotify_id",
+        columns=["audio_x", "audio_y"],
+        refit=cfg.projection.refit,
+    )
+
+
+if __name__ == "__main__":
+    project_umap()
@@ -3,56 +3,119 @@ from pathlib import Path
 import hydra
 from sqlmodel import Session, select
 
-from ..models import Lyrics
-from ..database import engine
+from ..models import Lyrics, LyricsDuplicate
+from ..database import engine, create_db_and_tables
+from ..changelog import advance_cursor, latest_seq, net_changes, read_changes
+from ..dedup import cluster_members
 
 from ..genius import parse_lyrics
 from ..cohere import create_cohere_client, embed_texts
-from ..pinecone import initialize_pinecone, get_or_create_index
+from ..pinecone import initialize_pinecone, get_or_create_index, upsert_vectors, delete_vectors, update_metadata
 
 
-@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
-def push_to_pinecone(cfg):
+CHANGELOG_CONSUMER = "pinecone"
+CHANGELOG_TABLES = ["lyrics", "lyricsduplicate"]
+
+
+def lyrics_vector_id(file_name: str) -> str:
+    return str(file_name.split(".")[0])
+
+
+def lyrics_vector(lyrics: Lyrics, data_dir: str, cohere_client):
+    """`(vector id, embedding, metadata)` of a lyrics file, None when the file is missing"""
+    file_path = Path(data_dir).joinpath(lyrics.file_name)
+    try:
+        with open(file_path, mode="r", encoding="utf-8") as f:
+            lyrics_txt = parse_lyrics(f.read())
+    except FileNotFoundError:
+        print("FileNotFoundError:", file_path)
+        return None
+
+    embedding = embed_texts(cohere_client, texts=[lyrics_txt])
+    metadata = dict(
+        language=lyrics.language,
+        song_spotify_id=lyrics.song_spotify_id
+    )
+    return lyrics_vector_id(lyrics.file_name), embedding, metadata
+
+
+def push_to_pinecone(cfg, index=None, cohere_client=None, full_scan: bool = False) -> None:
+    """Upsert the lyrics changed since the last push and delete the removed ones; all lyrics on the first push or with `full_scan`.
 
-    cohere_client = create_cohere_client(cfg.cohere.api_key)
+    Near-duplicate lyrics (see `dedup`) aren't embedded: their representative's vector lists them in `duplicate_urls`.
+    """
+    if cohere_client is None:
+        cohere_client = create_cohere_client(cfg.cohere.api_key)
 
-    initialize_pinecone(cfg.pinecone.api_key, cfg.pinecone.environment)
-    index = get_or_create_index(cfg.pinecone.index_name, dimension=cfg.pinecone.dimension, metric="cosine")
+    if index is None:
+        initialize_pinecone(cfg.pinecone.api_key, cfg.pinecone.environment)
+        index = get_or_create_index(cfg.pinecone.index_name, dimension=cfg.pinecone.dimension, metric="cosine")
 
     with Session(engine) as session:
-        query = select(Lyrics)
-        results = session.exec(query)
+        head = latest_seq(session)
+        changes = None if full_scan else read_changes(session, CHANGELOG_CONSUMER, tables=CHANGELOG_TABLES, until=head)
+
+        deleted_ids = []
+        refreshed = set()  # representatives whose cluster changed
+        if changes is None:
+            results = session.exec(select(Lyrics).where(Lyrics.genius_url.not_in(select(LyricsDuplicate.genius_url))))
+        else:
+            results = []
+            for table_name, operation, row in net_changes(changes):
+                if table_name == "lyricsduplicate":
+                    member = session.get(Lyrics, row["genius_url"])
+                    if operation == "delete":  # no longer represented, embed it
+                        if member is not None:
+                            results.append(member)
+                    elif member is not None:  # may have been embedded before being found a duplicate
+                        deleted_ids.append(lyrics_vector_id(member.file_name))
+                    refreshed.add(row["representative_url"])
+                elif operation == "delete":
+                    deleted_ids.append(lyrics_vector_id(row["file_name"]))
+                elif (lyrics := session.get(Lyrics, row["genius_url"])) is not None:
+                    if session.get(LyricsDuplicate, lyrics.genius_url) is None:
+                        results.append(lyrics)
 
         # TODO async calls to the two APIs
         ids = []
         metadata = []
         lyrics_embeddings = []
         for lyrics in results:
-            file_path = Path(cfg.pinecone.data_dir).joinpath(lyrics.file_name)
-            try:
-                with open(file_path, mode="r", encoding="utf-8") as f:
-                    lyrics_txt = parse_lyrics(f.read())
-            except FileNotFoundError:
-                print("FileNotFoundError:", file_path)
+            vector = lyrics_vector(lyrics, cfg.genius.save_dir, cohere_client)
+            if vector is None:
                 continue
 
-            embedding = embed_texts(cohere_client, texts=[lyrics_txt])
+            vector_id, embedding, vector_metadata = vector
+            if members := cluster_members(session, lyrics.genius_url):
+                vector_metadata["duplicate_urls"] = members
+            refreshed.discard(lyrics.genius_url)
+            ids.append(vector_id)
             lyrics_embeddings.append(embedding)
+            metadata.append(vector_metadata)
 
-            ids.append(str(lyrics.file_name.split(".")[0]))
-            metadata.append(
-                dict(
-                    language=lyrics.language,
-                    song_spotify_id=lyrics.song_spotify_id
-                )
-            )
+        # representatives already embedded only need their links updated
+        for genius_url in sorted(refreshed):
+            if (lyrics := session.get(Lyrics, genius_url)) is not None and session.get(LyricsDuplicate, genius_url) is None:
+                update_metadata(index, lyrics_vector_id(lyrics.file_name), dict(duplicate_urls=cluster_members(session, genius_url)))
 
     to_upsert = list(zip(ids, lyrics_embeddings, metadata))
 
     for i in range(0, len(ids), cfg.pinecone.batch_size):
         i_end = min(i+cfg.pinecone.batch_size, len(ids))
-        index.upsert(vectors=to_upsert[i:i_end])
+        upsert_vectors(index, to_upsert[i:i_end])
+
+    for i in range(0, len(deleted_ids), cfg.pinecone.batch_size):
+        delete_vectors(index, deleted_ids[i:i+cfg.pinecone.batch_size])
+
+    with Session(engine) as session:
+        advance_cursor(session, CHANGELOG_CONSUMER, head)
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    create_db_and_tables()
+    push_to_pinecone(cfg)
 
 
 if __name__ == "__main__":
-    push_to_pinecone()
+    main()
@@ -3,8 +3,10 @@ from pathlib import Path
 import hydra
 from sqlmodel import Session, select
 
-from ..models import Song
-from ..database import engine
+from ..models import Lyrics, Song, SongPlaylistLink
+from ..database import engine, create_db_and_tables
+from ..changelog import advance_cursor, latest_seq, net_changes, read_changes
+from ..dedup import representative_url
 
 from ..genius import (
     parse_lyrics
@@ -14,18 +16,66 @@ from ..weaviate import (
     create_weaviate_client,
     initialize_weaviate,
     configure_batch,
-    get_or_add_to_batch,
+    delete_objects,
+    set_references,
+    upsert_to_batch,
 )
 
 
-@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
-def push_to_weaviate(cfg):
+CHANGELOG_CONSUMER = "weaviate"
+CHANGELOG_TABLES = ["song", "audiofeatures", "lyrics", "songplaylistlink", "playlist", "lyricsduplicate"]
+# table -> (class, primary key) of the objects removed with its rows
+DELETED_OBJECTS = {
+    "song": ("Song", "spotify_id"),
+    "audiofeatures": ("AudioFeatures", "spotify_id"),
+    "lyrics": ("Lyrics", "genius_url"),
+    "playlist": ("Playlist", "spotify_id"),
+}
+
+
+def changed_song_ids(session: Session, changes) -> set[str]:
+    """Songs whose object or references may differ from what was pushed"""
+    song_ids = set()
+    for table_name, operation, row in net_changes(changes):
+        if table_name in ("song", "audiofeatures"):
+            song_ids.add(row["spotify_id"])
+        elif table_name in ("lyrics", "songplaylistlink"):
+            song_ids.add(row["song_spotify_id"])
+        elif table_name == "playlist":
+            query = select(SongPlaylistLink.song_spotify_id).where(SongPlaylistLink.playlist_spotify_id == row["spotify_id"])
+            song_ids.update(session.exec(query))
+        elif table_name == "lyricsduplicate":
+            if (lyrics := session.get(Lyrics, row["genius_url"])) is not None:
+                song_ids.add(lyrics.song_spotify_id)
+    return song_ids
+
+
+def deleted_objects(changes) -> dict[str, tuple[str, list[str]]]:
+    """Class name -> (primary key, values) of the objects whose rows were deleted"""
+    deleted = {}
+    for table_name, operation, row in net_changes(changes):
+        if operation == "delete" and table_name in DELETED_OBJECTS:
+            class_name, primary_key = DELETED_OBJECTS[table_name]
+            deleted.setdefault(class_name, (primary_key, []))[1].append(row[primary_key])
+    return deleted
+
+
+def push_to_weaviate(cfg, full_scan: bool = False) -> None:
+    """Push the songs changed since the last push and delete the removed objects; all songs on the first push or with `full_scan`"""
     weaviate_client = create_weaviate_client(cfg.weaviate.connection_url, headers={"X-Cohere-Api-Key": cfg.cohere.api_key})
     initialize_weaviate(weaviate_client, schema_dir=cfg.weaviate.schema_dir)
     configure_batch(weaviate_client, batch_size=20, batch_target_rate=1.6)
 
     with Session(engine) as session:
+        head = latest_seq(session)
+        changes = None if full_scan else read_changes(session, CHANGELOG_CONSUMER, tables=CHANGELOG_TABLES, until=head)
+        if changes is not None:
+            for class_name, (primary_key, values) in deleted_objects(changes).items():
+                delete_objects(weaviate_client, class_name, primary_key, values)
+
         query = select(Song)
+        if changes is not None:
+            query = query.where(Song.spotify_id.in_(changed_song_ids(session, changes)))
         results = session.exec(query)
 
         for song in results:
@@ -33,12 +83,10 @@ def push_to_weaviate(cfg):
                 spotify_id=song.spotify_id,
                 name=song.name,
             )
-            song_uuid = get_or_add_to_batch(weaviate_client, data_object=song_obj, class_name="Song", primary_key="spotify_id")
-
-            if weaviate_client.data_object.get_by_id(song_uuid, class_name="Song"):  # Skip song objects already embeded
-                continue
+            # songs pushed before are changed ones: their properties are updated and references replaced
+            song_uuid = upsert_to_batch(weaviate_client, data_object=song_obj, class_name="Song", primary_key="spotify_id")
 
-            audio_features = song.audio_features[0]
+            audio_features = song.audio_features
             audio_features_obj = dict(
                 spotify_id=audio_features.spotify_id,
                 acousticness=audio_features.acousticness,
@@ -53,24 +101,9 @@ def push_to_weaviate(cfg):
                 tempo=audio_features.tempo,
                 valence=audio_features.valence,
             )
+            audio_features_uuid = upsert_to_batch(weaviate_client, data_object=audio_features_obj, class_name="AudioFeatures", primary_key="spotify_id")
 
-            audio_features_uuid = get_or_add_to_batch(weaviate_client, data_object=audio_features_obj, class_name="AudioFeatures", primary_key="spotify_id")
-
-            weaviate_client.batch.add_reference(
-                from_object_uuid=song_uuid,
-                from_property_name="has_audio_features",
-                to_object_uuid=audio_features_uuid,
-                from_object_class_name="Song",
-                to_object_class_name="AudioFeatures",
-            )
-            weaviate_client.batch.add_reference(
-                from_object_uuid=audio_features_uuid,
-                from_property_name="from_song",
-                to_object_uuid=song_uuid,
-                from_object_class_name="AudioFeatures",
-                to_object_class_name="Song",
-            )
-
+            playlist_uuids = []
             for playlist in song.playlists:
                 playlist_obj = dict(
                     spotify_id=playlist.spotify_id,
@@ -78,24 +111,12 @@ def push_to_weaviate(cfg):
                     description=playlist.description,
                     created_at=str(playlist.created_at.astimezone().isoformat())
                 )
-                playlist_uuid = get_or_add_to_batch(weaviate_client, data_object=playlist_obj, class_name="Playlist", primary_key="spotify_id")
-
-                weaviate_client.batch.add_reference(
-                    from_object_uuid=song_uuid,
-                    from_property_name="from_playlists",
-                    to_object_uuid=playlist_uuid,
-                    from_object_class_name="Song",
-                    to_object_class_name="Playlist",
-                )
-                weaviate_client.batch.add_reference(
-                    from_object_uuid=playlist_uuid,
-                    from_property_name="has_songs",
-                    to_object_uuid=song_uuid,
-                    from_object_class_name="Playlist",
-                    to_object_class_name="Song",
-                )
+                playlist_uuids.append(upsert_to_batch(weaviate_client, data_object=playlist_obj, class_name="Playlist", primary_key="spotify_id"))
 
+            lyrics_uuids = []
             for lyrics in song.lyrics:
+                # a near-duplicate references its representative's object instead of having its own vectorized
+                lyrics = session.get(Lyrics, representative_url(session, lyrics.genius_url)) or lyrics
                 file_path = Path(cfg.weaviate.data_dir).joinpath(lyrics.file_name)
                 try:
                     with open(file_path, mode="r", encoding="utf-8") as f:
@@ -111,27 +132,26 @@ def push_to_weaviate(cfg):
                     language=lyrics.language,
                     lyrics=lyrics_txt
                 )
-                lyrics_uuid = get_or_add_to_batch(weaviate_client, data_object=lyrics_obj, class_name="Lyrics", primary_key="genius_url")
-
-                weaviate_client.batch.add_reference(
-                    from_object_uuid=song_uuid,
-                    from_property_name="has_lyrics",
-                    to_object_uuid=lyrics_uuid,
-                    from_object_class_name="Song",
-                    to_object_class_name="Lyrics",
-                )
-                weaviate_client.batch.add_reference(
-                    from_object_uuid=lyrics_uuid,
-                    from_property_name="from_song",
-                    to_object_uuid=song_uuid,
-                    from_object_class_name="Lyrics",
-                    to_object_class_name="Song",
-                )
+                lyrics_uuids.append(upsert_to_batch(weaviate_client, data_object=lyrics_obj, class_name="Lyrics", primary_key="genius_url"))
 
-            # ensure pushing objects before moving to the next song
+            # references need both of their objects created
             weaviate_client.batch.create_objects()
+
+            set_references(weaviate_client, song_uuid, "Song", "has_audio_features", [audio_features_uuid], "AudioFeatures", "from_song")
+            set_references(weaviate_client, song_uuid, "Song", "from_playlists", playlist_uuids, "Playlist", "has_songs")
+            set_references(weaviate_client, song_uuid, "Song", "has_lyrics", list(dict.fromkeys(lyrics_uuids)), "Lyrics", "from_song")
+
+            # ensure pushing references before moving to the next song
             weaviate_client.batch.create_references()
 
+        advance_cursor(session, CHANGELOG_CONSUMER, head)
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    create_db_and_tables()
+    push_to_weaviate(cfg)
+
 
 if __name__ == "__main__":
-    push_to_weaviate()
+    main()
@@ -0,0 +1,159 @@
+import threading
+import time
+
+import hydra
+from sqlmodel import Session, select
+
+from ..models import AudioFeatures, Song, Lyrics
+from ..database import engine, create_db_and_tables
+from ..pinecone import upsert_vectors
+from ..streaming import DurableQueue, consume
+
+from .poll_spotify import poll_spotify, save_audio_features
+from .poll_genius import fetch_song_lyrics, save_lyrics_record
+from .push_to_pinecone import lyrics_vector
+from .dedup_lyrics import dedup_lyrics_record
+
+
+# new songs fan out to both queues; every lyrics record found is queued for embedding
+NEW_SONG_QUEUES = ["audio_features", "lyrics"]
+CONSUMERS = ["audio_features", "lyrics", "embed"]
+
+
+def create_handlers(cfg, spotify_client, genius_client, cohere_client, index, translation_sleep: tuple[int, int]) -> dict:
+    """Queue name -> handler of one message, returning the messages to publish downstream"""
+
+    def handle_audio_features(payload: dict):
+        with Session(engine) as session:
+            save_audio_features(session, spotify_client, payload["spotify_id"])
+        return []
+
+    def handle_lyrics(payload: dict):
+        with Session(engine) as session:
+            song = session.get(Song, payload["spotify_id"])
+            if song is None:
+                return []
+            song_spotify_id, song_name, artist_name = song.spotify_id, song.name, song.artists[0].name
+            # an earlier delivery may have stopped midway: lyrics it saved are queued for embedding again
+            # (an upsert) in case it stopped before publishing them, and are not fetched again
+            saved_urls = [lyrics.genius_url for lyrics in song.lyrics]
+
+            downstream = []
+            for genius_url in saved_urls:
+                if dedup_lyrics_record(session, session.get(Lyrics, genius_url), cfg.genius.save_dir) is None:
+                    downstream.append(("embed", dict(genius_url=genius_url)))
+            for record in fetch_song_lyrics(song_spotify_id, song_name, artist_name, genius_client, cohere_client,
+                                            save_dir=cfg.genius.save_dir, translation_sleep=translation_sleep,
+                                            saved_urls=set(saved_urls)):
+                save_lyrics_record(session, record)
+                # near-duplicates are linked to their representative's vector by the next `push_to_pinecone`
+                if dedup_lyrics_record(session, session.get(Lyrics, record["genius_url"]), cfg.genius.save_dir) is None:
+                    downstream.append(("embed", dict(genius_url=record["genius_url"])))
+        return downstream
+
+    def handle_embed(payload: dict):
+        with Session(engine) as session:
+            lyrics = session.get(Lyrics, payload["genius_url"])
+            vector = lyrics and lyrics_vector(lyrics, cfg.genius.save_dir, cohere_client)
+        if vector:
+            upsert_vectors(index, [vector])
+        return []
+
+    return dict(audio_features=handle_audio_features, lyrics=handle_lyrics, embed=handle_embed)
+
+
+def publish_new_songs(queue: DurableQueue, song_ids: list[str]) -> None:
+    for name in NEW_SONG_QUEUES:
+        queue.publish(name, [dict(spotify_id=song_id) for song_id in song_ids])
+    print(f"[spotify] {len(song_ids)} new songs queued")
+
+
+def publish_missing_songs(queue: DurableQueue) -> None:
+    """Queue the songs without audio features or lyrics that aren't queued yet.
+
+    New songs are committed before they are published, so a crash in between would otherwise lose them.
+    Songs Genius has no lyrics for are queued again on every start, as `poll_genius` retries them on every run.
+    """
+    with Session(engine) as session:
+        missing = dict(
+            audio_features=session.exec(select(Song.spotify_id).where(Song.spotify_id.not_in(select(AudioFeatures.spotify_id)))).all(),
+            lyrics=session.exec(select(Song.spotify_id).where(~Song.lyrics.any())).all(),
+        )
+    for name, song_ids in missing.items():
+        queued = {payload["spotify_id"] for payload in queue.payloads(name)}
+        song_ids = [song_id for song_id in song_ids if song_id not in queued]
+        queue.publish(name, [dict(spotify_id=song_id) for song_id in song_ids])
+        print(f"[{name}] {len(song_ids)} songs missing from the queue queued")
+
+
+def stream(cfg, spotify_client=None, genius_client=None, cohere_client=None, index=None,
+           translation_sleep: tuple[int, int] = (45, 60), stop: threading.Event = None) -> None:
+    """Poll Spotify every `streaming.poll_interval` seconds and handle each new song as soon as it is queued.
+
+    `streaming.stages` selects what runs in this process (`spotify` and/or consumers), so each stage can be
+    scaled in its own processes on the same queue; `streaming.workers.<stage>` is its number of threads.
+    With `streaming.once`, Spotify is polled once and the process exits when the queues it consumes are drained.
+    """
+    stop = stop or threading.Event()
+    queue = DurableQueue(cfg.streaming.queue_path, lease_seconds=cfg.streaming.lease_seconds,
+                         max_attempts=cfg.streaming.max_attempts)
+    stages = list(cfg.streaming.stages) if cfg.streaming.stages else ["spotify", *CONSUMERS]
+
+    if spotify_client is None and {"spotify", "audio_features"} & set(stages):
+        from ..spotify import create_authenticator, create_spotify_client
+        spotify_authenticator = create_authenticator(cfg.spotify.client_id, cfg.spotify.client_secret)
+        spotify_client = create_spotify_client(auth_manager=spotify_authenticator)
+    if genius_client is None and "lyrics" in stages:
+        from ..genius import create_genius_client
+        genius_client = create_genius_client(cfg.genius.client_token)
+    if cohere_client is None and {"lyrics", "embed"} & set(stages):
+        from ..cohere import create_cohere_client
+        cohere_client = create_cohere_client(cfg.cohere.api_key)
+    if index is None and "embed" in stages:
+        from ..pinecone import initialize_pinecone, get_or_create_index
+        initialize_pinecone(cfg.pinecone.api_key, cfg.pinecone.environment)
+        index = get_or_create_index(cfg.pinecone.index_name, dimension=cfg.pinecone.dimension, metric="cosine")
+
+    handlers = create_handlers(cfg, spotify_client, genius_client, cohere_client, index, translation_sleep)
+    consumers = [
+        threading.Thread(target=consume, name=f"{name}-{i}", daemon=True,
+                         args=(queue, name, handlers[name], stop, cfg.streaming.idle_wait))
+        for name in CONSUMERS if name in stages
+        for i in range(cfg.streaming.workers[name])
+    ]
+    for consumer in consumers:
+        consumer.start()
+
+    if "spotify" in stages:
+        publish_missing_songs(queue)
+    try:
+        while not stop.is_set():
+            if "spotify" in stages:
+                poll_spotify(cfg, spotify_client, on_new_songs=lambda song_ids: publish_new_songs(queue, song_ids))
+                print(f"[queues] {queue.depth()}")
+            if cfg.streaming.once:
+                while queue.pending([name for name in CONSUMERS if name in stages]) and not stop.is_set():
+                    stop.wait(cfg.streaming.idle_wait)
+                break
+            stop.wait(cfg.streaming.poll_interval)
+    finally:
+        stop.set()
+        for consumer in consumers:
+            consumer.join()
+        print(f"[queues] {queue.depth()}")
+
+
+@hydra.main(config_name="app.yaml", config_path="../../config", version_base="1.2")
+def main(cfg) -> None:
+    """e.g. `python -m one_music.scripts.stream` or, to scale a stage, `... streaming.stages=[lyrics] streaming.workers.lyrics=4`"""
+    create_db_and_tables()
+    start = time.perf_counter()
+    try:
+        stream(cfg)
+    except KeyboardInterrupt:
+        pass
+    print(f"stopped after {time.perf_counter() - start:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
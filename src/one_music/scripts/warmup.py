@@ -0,0 +1,43 @@
+import time
+
+import numpy as np
+
+from ..startup import DASHBOARD_MODULES, configure_numba_cache, profile_imports
+
+
+def warmup() -> None:
+    """Populate the numba cache and report import times; run at container build"""
+    cache_dir = configure_numba_cache()
+    print(f"numba cache: {cache_dir}")
+
+    timings = profile_imports(DASHBOARD_MODULES)
+
+    from ..projection import create_audio_reducer, create_lyrics_reducer
+    from ..quantization import KINDS, QuantizedMatrix
+    from ..similarity import SimilarityIndex
+
+    rng = np.random.default_rng(0)
+    for name, create_reducer, dimension in [("lyrics UMAP", create_lyrics_reducer, 768), ("audio UMAP", create_audio_reducer, 9)]:
+        start = time.perf_counter()
+        reducer = create_reducer(n_neighbors=5)
+        reducer.fit(rng.random((64, dimension), dtype=np.float32))
+        reducer.transform(rng.random((8, dimension), dtype=np.float32))
+        timings[f"{name} fit + transform"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    SimilarityIndex([str(i) for i in range(64)], rng.random((64, 9))).similar_songs("0", k=3)
+    timings["similarity index"] = time.perf_counter() - start
+
+    vectors = rng.random((512, 16), dtype=np.float32)
+    for kind in KINDS:
+        quantized = QuantizedMatrix.fit(vectors, kind=kind)
+        start = time.perf_counter()
+        quantized.scores(vectors[0])
+        timings[f"{kind} scoring"] = time.perf_counter() - start
+
+    for name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print(f"{seconds:8.2f}s  {name}")
+
+
+if __name__ == "__main__":
+    warmup()
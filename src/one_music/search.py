@@ -0,0 +1,261 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+from .quantization import QuantizedMatrix
+
+
+def l2_normalize(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=-1, keepdims=True)
+    return X / np.where(norms > 0, norms, 1)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the `k` highest scores, best first"""
+    k = min(k, len(scores))
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class HybridIndex:
+    """Weighted lyrics + audio similarity over aligned float32 matrices, one row per lyrics.
+
+    Columns `[:lyrics_dim]` hold the L2-normalized lyrics vector and the rest the L2-normalized
+    robust-scaled audio features of the song, so a weighted sum of both cosine similarities is a single
+    matrix-vector product with `[lyrics_weight * q_lyrics, audio_weight * q_audio]`.
+
+    `matrix` may be a `QuantizedMatrix`: it is scored without decoding, and with `full_matrix` (usually
+    memory-mapped) the `rerank` * k best candidates are re-scored at full precision.
+    """
+
+    def __init__(self, vector_ids, song_ids, matrix: np.ndarray | QuantizedMatrix, lyrics_dim: int, audio_center: np.ndarray,
+                 audio_scale: np.ndarray, block_size: int = 65536, full_matrix: Optional[np.ndarray] = None, rerank: int = 4):
+        self.vector_ids = np.asarray(vector_ids, dtype=object)
+        self.song_ids = np.asarray(song_ids, dtype=object)
+        self.matrix = matrix
+        self.lyrics_dim = lyrics_dim
+        self.audio_center = np.asarray(audio_center, dtype=np.float32)
+        self.audio_scale = np.asarray(audio_scale, dtype=np.float32)
+        self.block_size = block_size
+        self.full_matrix = full_matrix
+        self.rerank = rerank
+        self.song_codes, _ = pd.factorize(self.song_ids)
+        self.positions = {vector_id: position for position, vector_id in enumerate(self.vector_ids)}
+
+    def __len__(self) -> int:
+        return len(self.vector_ids)
+
+    def scale_audio(self, audio_features: np.ndarray) -> np.ndarray:
+        return l2_normalize((np.asarray(audio_features, dtype=np.float32) - self.audio_center) / self.audio_scale)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Matrix-vector product in row blocks so the temporary stays cache-sized, also for memory-mapped matrices.
+
+        When the non-zero query weights span less than half of the columns only those are read, e.g. an
+        audio-only query skips the lyrics vectors.
+        """
+        nonzero = np.flatnonzero(query)
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(nonzero):
+            return scores
+        if isinstance(self.matrix, QuantizedMatrix):
+            return self.matrix.scores(query)
+
+        columns = slice(nonzero[0], nonzero[-1] + 1)
+        if 2 * (nonzero[-1] + 1 - nonzero[0]) > self.matrix.shape[1]:
+            columns = slice(None)  # wide strided slices are copied by BLAS; the full contiguous rows are faster
+        for start in range(0, len(self), self.block_size):
+            block = slice(start, start + self.block_size)
+            np.dot(self.matrix[block, columns], query[columns], out=scores[block])
+        return scores
+
+    def query(self, lyrics_vector: Optional[np.ndarray] = None, audio_vector: Optional[np.ndarray] = None,
+              lyrics_weight: float = 0.5, audio_weight: float = 0.5, k: int = 10, mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Top-k rows for raw query vectors; a missing query vector contributes nothing.
+
+        `lyrics_vector` is an embedding from the same model as the index, `audio_vector` unscaled audio
+        features, `mask` a boolean array of the rows allowed in the results.
+        """
+        query = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        if lyrics_vector is not None:
+            query[:self.lyrics_dim] = lyrics_weight * l2_normalize(lyrics_vector)
+        if audio_vector is not None:
+            query[self.lyrics_dim:] = audio_weight * self.scale_audio(audio_vector)
+
+        return self._search(query, k, mask)
+
+    def similar(self, vector_id: str, k: int = 10, lyrics_weight: float = 0.5, audio_weight: float = 0.5,
+                mask: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Top-k rows for an indexed lyrics, excluding the lyrics of the same song"""
+        row = np.asarray((self.matrix if self.full_matrix is None else self.full_matrix)[self.positions[vector_id]])
+        query = np.concatenate([lyrics_weight * row[:self.lyrics_dim], audio_weight * row[self.lyrics_dim:]])
+
+        same_song = self.song_codes == self.song_codes[self.positions[vector_id]]
+        mask = ~same_song if mask is None else mask & ~same_song
+        return self._search(query, k, mask)
+
+    def _search(self, query: np.ndarray, k: int, mask: Optional[np.ndarray]) -> pd.DataFrame:
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = -np.inf
+
+        if self.full_matrix is None:
+            positions = top_k(scores, k)
+        else:
+            candidates = np.sort(top_k(scores, k * self.rerank))  # sorted reads from the memory map
+            candidates = candidates[np.isfinite(scores[candidates])]
+            scores = np.full(len(self), -np.inf, dtype=np.float32)
+            scores[candidates] = np.asarray(self.full_matrix[candidates], dtype=np.float32) @ query
+            positions = candidates[top_k(scores[candidates], k)]
+        positions = positions[np.isfinite(scores[positions])]
+        return pd.DataFrame(dict(
+            vector_id=self.vector_ids[positions],
+            song_spotify_id=self.song_ids[positions],
+            score=scores[positions],
+        ))
+
+
+def build_hybrid_index(vector_ids: list[str], lyrics_vectors: np.ndarray, lyrics_df: pd.DataFrame, song_df: pd.DataFrame,
+                       features: list[str]) -> HybridIndex:
+    """Align lyrics vectors with the audio features of their song; lyrics without audio features are dropped"""
+    song_df = song_df.dropna(subset=features).drop_duplicates("song_spotify_id").set_index("song_spotify_id")
+    rows = (
+        pd.DataFrame(dict(vector_id=vector_ids, row=np.arange(len(vector_ids))))
+        .merge(lyrics_df[["vector_id", "song_spotify_id"]].drop_duplicates("vector_id"), on="vector_id")
+    )
+    rows = rows.loc[rows.song_spotify_id.isin(song_df.index)]
+
+    audio = song_df.loc[rows.song_spotify_id, features].to_numpy(dtype=np.float32)
+    audio_center = np.median(audio, axis=0)
+    q1, q3 = np.percentile(audio, [25, 75], axis=0)
+    audio_scale = np.where(q3 - q1 > 0, q3 - q1, 1).astype(np.float32)  # same as sklearn's RobustScaler
+
+    lyrics_vectors = np.asarray(lyrics_vectors)[rows.row.to_numpy()]
+    matrix = np.hstack([l2_normalize(lyrics_vectors), l2_normalize((audio - audio_center) / audio_scale)])
+
+    return HybridIndex(rows.vector_id, rows.song_spotify_id, matrix, lyrics_vectors.shape[1], audio_center, audio_scale)
+
+
+def save_hybrid_index(index: HybridIndex, index_dir: str | Path, quantization: Optional[str] = None) -> None:
+    """With `quantization` (see `quantization.KINDS`) the compressed matrix is saved next to the full one used to re-rank"""
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    np.save(index_dir.joinpath("matrix.npy"), index.matrix)
+    if quantization is not None:
+        QuantizedMatrix.fit(index.matrix, kind=quantization).save(index_dir.joinpath("quantized"))
+    pd.DataFrame(dict(vector_id=index.vector_ids, song_spotify_id=index.song_ids)).to_parquet(index_dir.joinpath("rows.parquet"), index=False)
+    with open(index_dir.joinpath("meta.json"), mode="w") as f:
+        json.dump(dict(
+            lyrics_dim=index.lyrics_dim,
+            audio_center=index.audio_center.tolist(),
+            audio_scale=index.audio_scale.tolist(),
+            quantization=quantization,
+        ), f)
+
+
+def load_hybrid_index(index_dir: str | Path, mmap: bool = False) -> Optional[HybridIndex]:
+    """A quantized index holds the compressed matrix in memory and memory-maps the full one to re-rank"""
+    index_dir = Path(index_dir)
+    try:
+        with open(index_dir.joinpath("meta.json")) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        print(f"`{index_dir}` not found")
+        return None
+
+    rows = pd.read_parquet(index_dir.joinpath("rows.parquet"))
+    if meta.pop("quantization", None) is not None:
+        matrix = QuantizedMatrix.load(index_dir.joinpath("quantized"), mmap=mmap)
+        full_matrix = np.load(index_dir.joinpath("matrix.npy"), mmap_mode="r")
+        return HybridIndex(rows.vector_id, rows.song_spotify_id, matrix, full_matrix=full_matrix, **meta)
+
+    matrix = np.load(index_dir.joinpath("matrix.npy"), mmap_mode="r" if mmap else None)
+    return HybridIndex(rows.vector_id, rows.song_spotify_id, matrix, **meta)
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss counters"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SemanticSearch:
+    """Natural-language lyrics search: embed the query text, then look up the nearest lyrics vectors.
+
+    Query embeddings and results are cached separately, so a repeated query never calls the embedding
+    API again, even when its filters change.
+    """
+
+    def __init__(self, embed_query: Callable[[str], list[float]], query_vectors: Callable[[list[float], int, Optional[dict]], list[dict]],
+                 max_entries: int = 1024):
+        self.embed_query = embed_query
+        self.query_vectors = query_vectors
+        self.embeddings = LRUCache(max_entries)
+        self.results = LRUCache(max_entries)
+
+    def search(self, text: str, top_k: int = 10, filters: Optional[dict] = None) -> tuple[list[dict], dict[str, float]]:
+        """Matches as `{"id", "score"}` dicts, and the latency of each stage in seconds"""
+        text = " ".join(text.split())
+        timings = {}
+
+        start = time.perf_counter()
+        result_key = (text, top_k, json.dumps(filters, sort_keys=True))
+        matches = self.results.get(result_key)
+        timings["result cache"] = time.perf_counter() - start
+        if matches is not None:
+            return matches, timings
+
+        start = time.perf_counter()
+        vector = self.embeddings.get(text)
+        if vector is None:
+            vector = self.embed_query(text)
+            self.embeddings.put(text, vector)
+        timings["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matches = [dict(id=match["id"], score=match["score"]) for match in self.query_vectors(vector, top_k, filters)]
+        self.results.put(result_key, matches)
+        timings["query"] = time.perf_counter() - start
+
+        return matches, timings
+
+
+def metadata_filter(languages: Optional[list[str]] = None, song_ids: Optional[list[str]] = None) -> Optional[dict]:
+    """Pinecone metadata filter on the `language` and `song_spotify_id` fields set by `push_to_pinecone`"""
+    conditions = {}
+    if languages:
+        conditions["language"] = {"$in": list(languages)}
+    if song_ids is not None:
+        conditions["song_spotify_id"] = {"$in": list(song_ids)}
+    return conditions or None
@@ -0,0 +1,157 @@
+import copy
+import threading
+from pathlib import Path
+from typing import Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from .startup import CACHE_DIR
+
+
+SIMILARITY_INDEX_PATH = CACHE_DIR.joinpath("similarity_index.joblib")
+
+
+class SimilarityIndex:
+    """Nearest neighbours over robust-scaled audio features.
+
+    Rows are held in a KD-tree; inserted rows go to a small brute-force buffer that is merged into
+    the tree once it exceeds `rebuild_threshold` rows, so inserts never trigger a per-row rebuild.
+    """
+
+    def __init__(self, ids: list[str], X: np.ndarray, data_version: Optional[str] = None, rebuild_threshold: int = 1024):
+        from sklearn.preprocessing import RobustScaler  # deferred: sklearn adds seconds to app start
+
+        self.data_version = data_version
+        self.rebuild_threshold = rebuild_threshold
+        self.scaler = RobustScaler().fit(X)
+        self.ids = np.asarray(ids, dtype=object)
+        self.vectors = self.scaler.transform(X).astype(np.float32)
+        self.positions = {spotify_id: position for position, spotify_id in enumerate(self.ids)}
+        self._rebuild()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _rebuild(self) -> None:
+        from sklearn.neighbors import KDTree
+
+        self.tree = KDTree(self.vectors)
+        self.tree_size = len(self.vectors)
+
+    def insert(self, ids: list[str], X: np.ndarray) -> None:
+        """Add songs with the scaler fitted at build time; ids already indexed are skipped"""
+        is_new = np.array([spotify_id not in self.positions for spotify_id in ids], dtype=bool)
+        if not is_new.any():
+            return
+
+        new_ids = np.asarray(ids, dtype=object)[is_new]
+        self.vectors = np.concatenate([self.vectors, self.scaler.transform(np.asarray(X)[is_new]).astype(np.float32)])
+        for offset, spotify_id in enumerate(new_ids):
+            self.positions[spotify_id] = len(self.ids) + offset
+        self.ids = np.concatenate([self.ids, new_ids])
+
+        if len(self.vectors) - self.tree_size > self.rebuild_threshold:
+            self._rebuild()
+
+    def _candidates(self, vector: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """(distances, positions) of the `k` nearest rows across the tree and the insert buffer"""
+        distances, positions = self.tree.query(vector[None, :], k=min(k, self.tree_size))
+        distances, positions = distances[0], positions[0]
+
+        buffer = self.vectors[self.tree_size:]
+        if len(buffer):
+            buffer_distances = np.linalg.norm(buffer - vector, axis=1)
+            distances = np.concatenate([distances, buffer_distances])
+            positions = np.concatenate([positions, np.arange(self.tree_size, len(self.vectors))])
+            order = np.argsort(distances, kind="stable")[:k]
+            distances, positions = distances[order], positions[order]
+
+        return distances, positions
+
+    def similar_songs(self, spotify_id: str, k: int = 3, filters: Optional[set[str]] = None) -> pd.DataFrame:
+        """`k` nearest songs to `spotify_id`, optionally restricted to the ids in `filters`"""
+        if spotify_id not in self.positions:
+            return pd.DataFrame(columns=["song_spotify_id", "distance"])
+
+        vector = self.vectors[self.positions[spotify_id]]
+        n_candidates = min(k + 1, len(self))
+        while True:
+            distances, positions = self._candidates(vector, n_candidates)
+            ids = self.ids[positions]
+            keep = ids != spotify_id
+            if filters is not None:
+                keep &= np.fromiter((i in filters for i in ids), dtype=bool, count=len(ids))
+
+            # with restrictive filters, widen the search until `k` songs pass or the index is exhausted
+            if keep.sum() >= k or n_candidates >= len(self):
+                break
+            n_candidates = min(n_candidates * 4, len(self))
+
+        return pd.DataFrame(dict(song_spotify_id=ids[keep][:k], distance=distances[keep][:k]))
+
+
+def build_similarity_index(song_df: pd.DataFrame, features: list[str], data_version: Optional[str] = None) -> SimilarityIndex:
+    song_df = song_df.dropna(subset=features).drop_duplicates("song_spotify_id")
+    return SimilarityIndex(song_df.song_spotify_id.tolist(), song_df[features].to_numpy(), data_version=data_version)
+
+
+def update_similarity_index(index: Optional[SimilarityIndex], song_df: pd.DataFrame, features: list[str],
+                            data_version: Optional[str] = None) -> SimilarityIndex:
+    """Index of the songs in `song_df`: a copy of `index` with the new songs inserted, left for sessions still
+    querying it. Rebuilt when there is no index or songs were removed.
+
+    Audio features of indexed songs are not re-read; they don't change once Spotify has analysed a track.
+    """
+    song_df = song_df.dropna(subset=features).drop_duplicates("song_spotify_id")
+    if index is None or not np.isin(index.ids, song_df.song_spotify_id.to_numpy()).all():
+        return build_similarity_index(song_df, features, data_version)
+
+    updated = copy.copy(index)  # `insert` replaces the arrays and the tree, only the positions are updated in place
+    updated.positions = dict(index.positions)
+    new_df = song_df.loc[~song_df.song_spotify_id.isin(index.positions)]
+    updated.insert(new_df.song_spotify_id.tolist(), new_df[features].to_numpy())
+    updated.data_version = data_version
+    return updated
+
+
+def save_similarity_index(index: SimilarityIndex, file_path: str | Path) -> None:
+    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(index, file_path)
+
+
+def load_similarity_index(file_path: str | Path, data_version: Optional[str] = None) -> Optional[SimilarityIndex]:
+    """Persisted index, or None when missing or built from another data version"""
+    try:
+        index = joblib.load(file_path)
+    except FileNotFoundError:
+        return None
+
+    if data_version is not None and index.data_version != data_version:
+        return None
+    return index
+
+
+class SharedSimilarityIndex:
+    """The index of the latest data version, persisted at `file_path` and shared by every session.
+
+    A new data version inserts its new songs into the persisted index instead of rebuilding it, also
+    across restarts; the updated index replaces the current one in a single assignment.
+    """
+
+    def __init__(self, file_path: str | Path = SIMILARITY_INDEX_PATH):
+        self.file_path = Path(file_path)
+        self.index = load_similarity_index(self.file_path)
+        self._lock = threading.Lock()
+
+    def current(self, song_df: pd.DataFrame, features: list[str], data_version: str) -> SimilarityIndex:
+        index = self.index
+        if index is not None and index.data_version == data_version:
+            return index
+
+        with self._lock:  # one session updates, the others wait for its result
+            if self.index is None or self.index.data_version != data_version:
+                self.index = update_similarity_index(self.index, song_df, features, data_version)
+                save_similarity_index(self.index, self.file_path)
+            return self.index
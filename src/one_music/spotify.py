@@ -1,8 +1,14 @@
+import json
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 from spotipy.client import Spotify
 from spotipy.oauth2 import SpotifyClientCredentials
 
+from . import metrics
+
 
 def create_authenticator(client_id: str, client_secret: str) -> SpotifyClientCredentials:
     auth_manager = SpotifyClientCredentials(
@@ -16,6 +22,7 @@ def create_spotify_client(auth_manager: SpotifyClientCredentials) -> Spotify:
     return Spotify(auth_manager=auth_manager)
 
 
+@metrics.instrument()
 def get_user_playlists(client: Spotify, user_id: str):
     """Iterate through all playlists of specified user"""
     response = client.user_playlists(user_id)
@@ -29,6 +36,49 @@ def get_user_playlists(client: Spotify, user_id: str):
             response = None
 
 
+PLAYLIST_FIELDS = ("id", "name", "snapshot_id", "description")
+
+
+@metrics.instrument(size=len)
+def discover_user_playlists(client: Spotify, user_id: str, page_size: int = 50, max_workers: int = 8) -> list[dict]:
+    """All playlists of a user, reduced to `PLAYLIST_FIELDS`; the pages after the first are fetched in parallel.
+
+    The user playlists endpoint has no `fields` filter, so the reduction happens here, before caching.
+    """
+    first_page = client.user_playlists(user_id, limit=page_size, offset=0)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = executor.map(
+            lambda offset: client.user_playlists(user_id, limit=page_size, offset=offset),
+            range(page_size, first_page["total"], page_size),
+        )
+        items = [playlist for page in [first_page, *pages] for playlist in page["items"] if playlist]
+
+    playlists = {}  # offsets shift when playlists are added meanwhile, an item can show up on two pages
+    for playlist in items:
+        playlists[playlist["id"]] = {field: playlist.get(field) for field in PLAYLIST_FIELDS}
+    return list(playlists.values())
+
+
+def cached_user_playlists(client: Spotify, user_id: str, cache_path: str | Path, ttl: float = 86400.0, **kwargs) -> list[dict]:
+    """`discover_user_playlists` through a JSON file that is refreshed once older than `ttl` seconds"""
+    cache_path = Path(cache_path)
+    try:
+        if time.time() - cache_path.stat().st_mtime < ttl:
+            with open(cache_path, encoding="utf-8") as f:
+                return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    playlists = discover_user_playlists(client, user_id, **kwargs)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(cache_path.suffix + ".tmp")
+    with open(tmp_path, mode="w", encoding="utf-8") as f:
+        json.dump(playlists, f)
+    tmp_path.replace(cache_path)
+    return playlists
+
+
+@metrics.instrument()
 def get_playlist_songs(client: Spotify, playlist_id: str, fields: str = "items(track(id, name, album(release_date), artists(id, name)))"):
     response = client.playlist_items(playlist_id, fields=fields)
 
@@ -43,6 +93,7 @@ def get_playlist_songs(client: Spotify, playlist_id: str, fields: str = "items(t
         yield song_obj
 
 
+@metrics.instrument()
 def get_audio_features(client: Spotify, song_id: str):
     response = client.audio_features(song_id)
 
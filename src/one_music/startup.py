@@ -0,0 +1,48 @@
+import importlib
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+
+CACHE_DIR = Path.home().joinpath(".cache", "one_music")  # artifacts rebuilt at runtime, kept out of the source tree
+NUMBA_CACHE_DIR = CACHE_DIR.joinpath("numba")
+
+# modules imported by the dashboard pages, in the order a view needs them
+DASHBOARD_MODULES = [
+    "numpy",
+    "pandas",
+    "pyarrow.parquet",
+    "streamlit",
+    "cohere",
+    "pinecone",
+    "plotly_express",
+    "sklearn.neighbors",
+    "umap",
+]
+
+
+def configure_numba_cache(cache_dir: Optional[str | Path] = None) -> Path:
+    """Persist numba's compiled code; only effective before numba is first imported.
+
+    An existing `NUMBA_CACHE_DIR` environment variable takes precedence, so containers can point it
+    at a directory populated at build time.
+    """
+    cache_dir = Path(os.environ.setdefault("NUMBA_CACHE_DIR", str(cache_dir or NUMBA_CACHE_DIR)))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def profile_imports(modules: list[str]) -> dict[str, float]:
+    """Seconds spent importing each module; shared dependencies are charged to the first module importing them"""
+    timings = {}
+    for module in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"`{module}` failed to import: {e}")
+            continue
+        timings[module] = time.perf_counter() - start
+
+    return timings
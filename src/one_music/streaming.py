@@ -0,0 +1,167 @@
+"""SQLite-backed durable queue and the consumer loop of the streaming ingestion.
+
+Messages are leased rather than removed: a consumer that crashes mid-message lets its lease expire and
+the message is delivered again, so handlers must be idempotent (the ingestion ones upsert by primary key).
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS message_ready ON message (queue, status, available_at);
+"""
+
+
+class DurableQueue:
+    """Named queues in one SQLite file, safe to share between threads and processes"""
+
+    def __init__(self, path: str | Path, lease_seconds: float = 300.0, max_attempts: int = 5):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")  # readers don't block the writer
+        connection.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """One autocommit connection per thread; transactions are explicit"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def publish(self, queue: str, payloads: Iterable[dict], delay: float = 0.0) -> None:
+        now = time.time()
+        rows = [(queue, json.dumps(payload), now + delay, now) for payload in payloads]
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT INTO message (queue, payload, available_at, created_at) VALUES (?, ?, ?, ?)", rows)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def lease(self, queue: str) -> Optional[tuple[int, dict]]:
+        """Oldest available message of `queue`, hidden from other consumers for `lease_seconds`"""
+        now = time.time()
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")  # take the write lock first, so two consumers can't lease the same row
+        try:
+            connection.execute(
+                "UPDATE message SET status = 'dead', error = 'lease expired' "
+                "WHERE queue = ? AND status = 'leased' AND available_at <= ? AND attempts >= ?",
+                (queue, now, self.max_attempts),
+            )
+            row = connection.execute(
+                "SELECT id, payload FROM message WHERE queue = ? AND status IN ('ready', 'leased') AND available_at <= ? "
+                "ORDER BY available_at, id LIMIT 1",
+                (queue, now),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE message SET status = 'leased', attempts = attempts + 1, available_at = ? WHERE id = ?",
+                    (now + self.lease_seconds, row[0]),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def extend_lease(self, message_id: int) -> None:
+        """Keep a message hidden for another `lease_seconds`, while its handler is still running"""
+        self.connection().execute(
+            "UPDATE message SET available_at = ? WHERE id = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, message_id),
+        )
+
+    def ack(self, message_id: int) -> None:
+        self.connection().execute("DELETE FROM message WHERE id = ?", (message_id,))
+
+    def nack(self, message_id: int, error: str, backoff: float = 30.0) -> None:
+        """Retry later with exponential backoff, or park the message as `dead` after `max_attempts`"""
+        self.connection().execute(
+            "UPDATE message SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'ready' END, "
+            "available_at = ? + ? * (1 << (attempts - 1)), error = ? WHERE id = ?",
+            (self.max_attempts, time.time(), backoff, error, message_id),
+        )
+
+    def depth(self) -> dict[str, dict[str, int]]:
+        """Message count per queue and status"""
+        depth = {}
+        for queue, status, count in self.connection().execute("SELECT queue, status, count(*) FROM message GROUP BY queue, status"):
+            depth.setdefault(queue, {})[status] = count
+        return depth
+
+    def pending(self, queues: Optional[list[str]] = None) -> int:
+        """Messages of `queues` (all by default) that will still be delivered, i.e. not dead"""
+        if queues is None:
+            return self.connection().execute("SELECT count(*) FROM message WHERE status != 'dead'").fetchone()[0]
+        placeholders = ", ".join("?" * len(queues))
+        return self.connection().execute(
+            f"SELECT count(*) FROM message WHERE status != 'dead' AND queue IN ({placeholders})", list(queues),
+        ).fetchone()[0]
+
+    def payloads(self, queue: str) -> list[dict]:
+        """Payloads of the messages of `queue` that will still be delivered"""
+        rows = self.connection().execute("SELECT payload FROM message WHERE queue = ? AND status != 'dead'", (queue,))
+        return [json.loads(payload) for payload, in rows]
+
+
+Handler = Callable[[dict], Iterable[tuple[str, dict]]]
+
+
+def keep_leased(queue: DurableQueue, message_id: int, handled: threading.Event) -> None:
+    while not handled.wait(queue.lease_seconds / 2):
+        queue.extend_lease(message_id)
+
+
+def consume(queue: DurableQueue, name: str, handler: Handler, stop: threading.Event, poll_interval: float = 1.0,
+            backoff: float = 30.0) -> None:
+    """Handle the messages of queue `name` until `stop` is set.
+
+    `handler` returns the `(queue, payload)` messages to publish downstream. They are published before the
+    message is acknowledged, so a crash in between duplicates work instead of losing it. The lease is extended
+    every half lease while the handler runs, so slow handlers aren't redelivered to another consumer.
+    """
+    while not stop.is_set():
+        leased = queue.lease(name)
+        if leased is None:
+            stop.wait(poll_interval)
+            continue
+
+        message_id, payload = leased
+        handled = threading.Event()
+        heartbeat = threading.Thread(target=keep_leased, args=(queue, message_id, handled), daemon=True)
+        heartbeat.start()
+        try:
+            downstream = list(handler(payload) or [])
+        except Exception as e:
+            print(f"[{name}] {payload}: {type(e).__name__}: {e}")
+            queue.nack(message_id, f"{type(e).__name__}: {e}", backoff=backoff)
+            continue
+        finally:
+            handled.set()
+            heartbeat.join()
+
+        for downstream_queue in {queue_name for queue_name, _ in downstream}:
+            queue.publish(downstream_queue, [p for queue_name, p in downstream if queue_name == downstream_queue])
+        queue.ack(message_id)
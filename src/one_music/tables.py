@@ -0,0 +1,88 @@
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+LYRICS_COLUMNS = ["genius_url", "vector_id", "song_spotify_id", "song_name", "language"]
+AUDIO_FEATURES = ['acousticness', 'danceability', 'duration_ms', 'energy', 'instrumentalness',
+                  'liveness', 'speechiness', 'tempo', 'valence']
+
+
+def data_version(file_path: str | Path) -> str:
+    """Changes whenever the file is rewritten"""
+    stat = Path(file_path).stat()
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def read_table(file_path: str | Path, columns: Optional[list[str]] = None, filters: Optional[list[tuple]] = None) -> pd.DataFrame:
+    """Read a Parquet table; `columns` and `filters` are pushed down to the pyarrow scan"""
+    if any(op == "in" and not len(values) for _, op, values in filters or []):
+        # an empty `in` list matches nothing, and pyarrow can't infer the type of its values
+        empty_df = pq.read_schema(file_path).empty_table().to_pandas()
+        return empty_df[columns] if columns else empty_df
+    return pd.read_parquet(file_path, columns=columns, filters=filters or None)
+
+
+def column_values(df: pd.DataFrame, column: str) -> list:
+    """Sorted distinct values of a single column, e.g. to populate a selection widget"""
+    return df[column].dropna().drop_duplicates().sort_values().tolist()
+
+
+def filter_rows(df: pd.DataFrame, filters: Optional[list[tuple]] = None, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """`read_table` over a DataFrame already in memory, same `==` and `in` filters"""
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters or []:
+        mask &= df[column].isin(list(value)) if op == "in" else df[column] == value
+    df = df.loc[mask] if len(filters or []) else df
+    return (df[columns] if columns else df).reset_index(drop=True)
+
+
+def playlist_filters(playlists: Optional[list[str]] = None) -> Optional[list[tuple]]:
+    return [("playlist_name", "in", list(playlists))] if playlists else None
+
+
+def lyrics_filters(song_ids: Optional[list[str]] = None, languages: Optional[list[str]] = None) -> list[tuple]:
+    filters = []
+    if song_ids is not None:
+        filters.append(("song_spotify_id", "in", list(song_ids)))
+    if languages:
+        filters.append(("language", "in", list(languages)))
+    return filters
+
+
+def select_lyrics(lyrics_df: pd.DataFrame, index_df: pd.DataFrame, playlists: tuple = (), languages: tuple = ()) -> pd.DataFrame:
+    """Lyrics of the songs in any of `playlists`, in any of `languages`; an empty selection keeps every row"""
+    song_ids = filter_rows(index_df, playlist_filters(playlists)).song_spotify_id.unique().tolist() if playlists else None
+    return filter_rows(lyrics_df, lyrics_filters(song_ids, languages))
+
+
+def select_songs(song_df: pd.DataFrame, lyrics_df: pd.DataFrame) -> pd.DataFrame:
+    """Songs with lyrics in `lyrics_df`"""
+    return filter_rows(song_df, [("song_spotify_id", "in", lyrics_df.song_spotify_id.unique().tolist())])
+
+
+def read_lyrics_text(file_path: str | Path, song_spotify_id: str, language: str) -> Optional[str]:
+    lyrics_df = read_table(
+        file_path,
+        columns=["lyrics_text"],
+        filters=[("song_spotify_id", "==", song_spotify_id), ("language", "==", language)],
+    )
+    if lyrics_df.empty:
+        return None
+    return lyrics_df.lyrics_text.iloc[0]
+
+
+def build_lyrics_index(lyrics_df: pd.DataFrame) -> dict[str, dict[str, int]]:
+    """Map `song_spotify_id` to {language: row position in `lyrics_df`}, languages in sorted order.
+
+    When a song has several lyrics in the same language, the first row is kept.
+    """
+    order = lyrics_df.reset_index(drop=True).sort_values(["song_spotify_id", "language"], kind="stable")
+
+    index = {}
+    for position, song_spotify_id, language in zip(order.index, order.song_spotify_id, order.language):
+        index.setdefault(song_spotify_id, {}).setdefault(language, position)
+
+    return index
@@ -6,6 +6,8 @@ from pydantic import BaseModel
 from weaviate.client import Client
 from weaviate.util import generate_uuid5
 
+from . import metrics
+
 
 class Schema(BaseModel):
     _class: str
@@ -16,6 +18,7 @@ class Schema(BaseModel):
     moduleConfig: Optional[dict]
 
 
+@metrics.instrument()
 def create_weaviate_client(url: str, headers: dict = None) -> Client:
     """Create a weaviate client using SDK"""
     headers = {} if headers is None else headers
@@ -27,6 +30,7 @@ def create_weaviate_client(url: str, headers: dict = None) -> Client:
         raise Exception
 
 
+@metrics.instrument()
 def initialize_weaviate(client: Client, schema_dir: str) -> None:
     if client.schema.contains() is False:
         schemas = load_schemas_from_dir(schema_dir)
@@ -71,7 +75,6 @@ def purge_storage(client: Client):
 
 
 from weaviate import Client
-import time
 
 
 def configure_batch(client: Client, batch_size: int, batch_target_rate: float):
@@ -91,8 +94,8 @@ def configure_batch(client: Client, batch_size: int, batch_target_rate: float):
 
     def callback(batch_results: dict) -> None:
         time_took_to_create_batch = batch_size * (client.batch.creation_time/20)
-        time.sleep(
-            round(max(batch_size/batch_target_rate - time_took_to_create_batch + 1, 0))
+        metrics.rate_limit_sleep(
+            "weaviate", round(max(batch_size/batch_target_rate - time_took_to_create_batch + 1, 0))
         )
 
     client.batch.configure(
@@ -102,6 +105,7 @@ def configure_batch(client: Client, batch_size: int, batch_target_rate: float):
     )
 
 
+@metrics.instrument()
 def get_or_add_to_batch(client: Client, data_object: dict, class_name: str, primary_key: str) -> str:
     query = (
         client.query.get(class_name=class_name, properties=primary_key)
@@ -127,3 +131,66 @@ def get_or_add_to_batch(client: Client, data_object: dict, class_name: str, prim
         uuid = result["data"]["Get"][class_name][0]["_additional"]["id"]
 
     return uuid
+
+
+@metrics.instrument()
+def delete_objects(client: Client, class_name: str, primary_key: str, values: list[str]) -> None:
+    """Delete the objects of `class_name` whose `primary_key` is any of `values`"""
+    operands = [{"path": [primary_key], "operator": "Equal", "valueString": value} for value in values]
+    if not operands:
+        return
+    where = operands[0] if len(operands) == 1 else {"operator": "Or", "operands": operands}
+    client.batch.delete_objects(class_name=class_name, where=where)
+
+
+@metrics.instrument()
+def upsert_to_batch(client: Client, data_object: dict, class_name: str, primary_key: str) -> str:
+    """Like `get_or_add_to_batch`, but also writes `data_object` over an existing object whose properties differ.
+
+    The update merges the properties, so the object keeps its references; changed text is vectorized again.
+    """
+    uuid = get_or_add_to_batch(client, data_object=data_object, class_name=class_name, primary_key=primary_key)
+    existing = client.data_object.get_by_id(uuid, class_name=class_name)
+    if existing is not None and any(existing["properties"].get(key) != value for key, value in data_object.items()):
+        client.data_object.update(data_object, class_name=class_name, uuid=uuid)
+    return uuid
+
+
+def referenced_uuids(client: Client, uuid: str, class_name: str, property_name: str) -> set[str]:
+    """Uuids of the objects `property_name` of an existing object points at; empty for an object not created yet"""
+    existing = client.data_object.get_by_id(uuid, class_name=class_name)
+    beacons = [] if existing is None else existing["properties"].get(property_name) or []
+    return {beacon["beacon"].rsplit("/", 1)[-1] for beacon in beacons}
+
+
+@metrics.instrument()
+def set_references(client: Client, from_uuid: str, from_class_name: str, from_property_name: str,
+                   to_uuids: list[str], to_class_name: str, back_property_name: str) -> None:
+    """Point `from_property_name` at exactly `to_uuids`, and keep the `back_property_name` references of the targets in step.
+
+    The objects on both sides must be created already; references they had to other objects are dropped.
+    """
+    previous = referenced_uuids(client, from_uuid, from_class_name, from_property_name)
+    client.data_object.reference.update(
+        from_uuid=from_uuid,
+        from_property_name=from_property_name,
+        to_uuids=list(to_uuids),
+        from_class_name=from_class_name,
+        to_class_names=to_class_name,
+    )
+    for to_uuid in set(to_uuids) - previous:
+        client.batch.add_reference(
+            from_object_uuid=to_uuid,
+            from_property_name=back_property_name,
+            to_object_uuid=from_uuid,
+            from_object_class_name=to_class_name,
+            to_object_class_name=from_class_name,
+        )
+    for to_uuid in previous - set(to_uuids):
+        client.data_object.reference.delete(
+            from_uuid=to_uuid,
+            from_property_name=back_property_name,
+            to_uuid=from_uuid,
+            from_class_name=to_class_name,
+            to_class_name=from_class_name,
+        )
@@ -6,16 +6,13 @@ import streamlit as st
 import streamlit.components.v1 as components
 
 import cohere
-import umap
-import numpy as np
-import pandas as pd
-from pandas.api.types import (
-    is_categorical_dtype,
-    is_numeric_dtype,
-)
 
-from sklearn.preprocessing import RobustScaler
-from sklearn.neighbors import NearestNeighbors
+from one_music.cohere import create_cohere_client, stream_lyrics
+from one_music.dashboard import filter_dataframe, get_filter_engine, get_lyrics_index, load_lyrics_text
+from one_music.datastore import combined_version, shared_store
+from one_music.generation import GenerationCache, lyrics_prompt, select_snippets
+from one_music.similarity import SharedSimilarityIndex
+from one_music.tables import AUDIO_FEATURES, filter_rows
 
 
 def wait_retry(wait_time, exceptions):
@@ -30,9 +27,9 @@ def wait_retry(wait_time, exceptions):
     return decorator
 
 
-@st.experimental_singleton
-def create_cohere_client() -> cohere.Client:
-    return cohere.client.Client(st.secrets["cohere"]["api_key"])
+@st.cache_resource
+def boot_client() -> cohere.Client:
+    return create_cohere_client(st.secrets["cohere"]["api_key"])
 
 
 @wait_retry(wait_time=60, exceptions=(RetryError,))
@@ -45,79 +42,28 @@ def embed_texts(cohere_client: cohere.Client, texts=[]):
     return embeds
 
 
-@st.experimental_memo
-def load_lyrics_table(file_path):
-    return pd.read_parquet(file_path)
-
-
-@st.experimental_memo
-def load_song_table(file_path, lyrics_df):
-    song_df = pd.read_parquet(file_path)
-    song_df = song_df.dropna(axis=1, how="any")
-    return song_df.loc[song_df.song_spotify_id.isin(lyrics_df.song_spotify_id)]
-
-
-@st.experimental_memo
-def load_index_table(file_path, lyrics_df):
-    index_df = pd.read_parquet(file_path)
-    return index_df.loc[index_df.song_spotify_id.isin(lyrics_df.song_spotify_id)]
-
-
-@st.experimental_memo
-def umap_reduce(X: np.ndarray) -> np.ndarray:
-    return umap.UMAP().fit_transform(X)
-
-
-def add_audio_embedding(song_df, features: list[str]):
-    scaler = RobustScaler()
-    X = scaler.fit_transform(song_df[features])
-    umap_embedding = umap_reduce(X)
-    embedding_df = pd.concat([song_df, pd.DataFrame(umap_embedding, columns=["audio_x", "audio_y"])], axis=1)
-    return embedding_df
-
-
-def filter_dataframe(df: pd.DataFrame, key) -> pd.DataFrame:
-    """Nested filter function; used to filter audio_features"""
-    modify = st.checkbox("Add filters", key=key)
-
-    if not modify:
-        return df
-    
-    df = df.copy()
-
-    modification_container = st.container()
-    with modification_container:
-        to_filter_columns = st.multiselect("Filter dataframe on", df.columns)
-        for column in to_filter_columns:
-            left, right = st.columns((1, 20))
-            # Treat columns with < 10 unique values as categorical
-            if is_categorical_dtype(df[column]) or df[column].nunique() < 10:
-                user_cat_input = right.multiselect(
-                    f"Values for {column}",
-                    df[column].unique(),
-                    default=list(df[column].unique()),
-                )
-                df = df[df[column].isin(user_cat_input)]
-            elif is_numeric_dtype(df[column]):
-                _min = float(df[column].min())
-                _max = float(df[column].max())
-                step = (_max - _min) / 100
-                user_num_input = right.slider(
-                    f"Values for {column}",
-                    min_value=_min,
-                    max_value=_max,
-                    value=(_min, _max),
-                    step=step,
-                )
-                df = df[df[column].between(*user_num_input)]
-            else:
-                user_text_input = right.text_input(
-                    f"Substring or regex in {column}",
-                )
-                if user_text_input:
-                    df = df[df[column].astype(str).str.contains(user_text_input)]
-
-    return df
+@st.cache_data(max_entries=4)
+def load_lyrics_table(data_version, _snapshot):
+    """`lyrics_text` is never loaded; see `load_lyrics_text`"""
+    return filter_rows(_snapshot["lyrics_table"], columns=["song_spotify_id", "language"])
+
+
+@st.cache_data(max_entries=4)
+def load_song_table(data_version, _snapshot, _lyrics_df):
+    song_df = filter_rows(_snapshot["song_table"], [("song_spotify_id", "in", _lyrics_df.song_spotify_id.unique().tolist())])
+    return song_df.dropna(axis=1, how="any")
+
+
+@st.cache_resource
+def get_generation_cache():
+    """Shared across sessions so identical requests are generated once"""
+    return GenerationCache()
+
+
+@st.cache_resource
+def get_similarity_index():
+    """Persisted in the user cache directory; new songs of a data version are inserted, see `one_music.similarity`"""
+    return SharedSimilarityIndex()
 
 
 def app():
@@ -128,51 +74,70 @@ def app():
         layout="centered",
     )
 
-    co = create_cohere_client()
+    co = boot_client()
 
     base_path = Path(__file__).parent.parent
-    lyrics_df = load_lyrics_table(base_path.joinpath("data/tables/lyrics_table.parquet"))
-    song_df = load_song_table(base_path.joinpath("data/tables/song_table.parquet"), lyrics_df)
-    index_df = load_index_table(base_path.joinpath("data/tables/index_table.parquet"), lyrics_df)
-
-    features = RobustScaler().fit_transform(song_df[['valence', 'acousticness', 'danceability', 'duration_ms',
-                                                     'energy', 'instrumentalness', 'liveness', 'speechiness', 'tempo']]
-                                            )
-
-    nbrs = NearestNeighbors(n_neighbors=4).fit(features)
-    distances, idx = nbrs.kneighbors(features)
-    augmented_knn = pd.concat([song_df, pd.DataFrame(idx[:, 1:], columns=["nn1", "nn2", "nn3"])], axis=1)
+    lyrics_path = base_path.joinpath("data/tables/lyrics_table.parquet")
+    # tables of the current data version, swapped in the background when a new export lands
+    snapshot = shared_store(base_path.joinpath("data/tables")).snapshot()
+    version = snapshot.version
+    lyrics_df = load_lyrics_table(version, snapshot)
+    song_df = load_song_table(version, snapshot, lyrics_df)
+    lyrics_index = get_lyrics_index(("lyrics_table", version), lyrics_df)
+    # `song_df` is the songs with lyrics, so the index follows both tables
+    song_version = combined_version({name: snapshot.table_versions[name] for name in ("song_table", "lyrics_table")})
+    similarity_index = get_similarity_index().current(song_df, AUDIO_FEATURES, song_version)
 
     # CONTENT
     st.title("🎶 OneMusic")
 
     st.subheader("Audio features embedding table")
-    st.dataframe(filter_dataframe(song_df, key="page"))
+    filtered_song_df = filter_dataframe(song_df, get_filter_engine(("01_Generative", "song_table", version), lambda: song_df),
+                                        "song_spotify_id", key="page")
+    st.dataframe(filtered_song_df)
 
     spotify_id_generate = st.text_input("Input Spotify id to Generate Lyrics", value="0yLdNVWF3Srea0uzk55zFn")
 
-    snippets = ""
-    for idx, row in lyrics_df.sample(3).iterrows():
-        lyrics_txt = row["lyrics_text"]
-        end = max(idx*100, len(lyrics_txt))
-        start = end-100
-        snippets += lyrics_txt[start:end]
-
-    response = co.generate(
-        model="xlarge",
-        prompt="Write song lyrics based on the three following snippets: " + snippets,
-        max_tokens=300,
-        temperature=2,
+    st.subheader("Similar songs")
+    similar_df = similarity_index.similar_songs(
+        spotify_id_generate,
+        k=3,
+        filters=set(filtered_song_df.song_spotify_id) if len(filtered_song_df) < len(song_df) else None,
     )
-    novel_song = response.generations[0].text
-    st.write(novel_song)
+    st.dataframe(similar_df.merge(song_df[["song_spotify_id", "song_name"]], on="song_spotify_id", how="left"))
 
     with st.sidebar:
         spotify_id_request = st.text_input("Input Spotify id (from plot hover)", value="0yLdNVWF3Srea0uzk55zFn")
         components.iframe(f"https://open.spotify.com/embed/track/{spotify_id_request}?utm_source=generator")
-        available_language = lyrics_df.loc[lyrics_df.song_spotify_id == spotify_id_request, "language"].sort_values()
+        available_language = list(lyrics_index.get(spotify_id_request, {}))
         selected_language = st.selectbox("Select Lyrics Language", options=available_language)
-        st.text(lyrics_df.loc[(lyrics_df.song_spotify_id == spotify_id_request) & (lyrics_df.language == selected_language), "lyrics_text"].values[0])
+        if selected_language is not None:
+            st.text(load_lyrics_text(lyrics_path, version, spotify_id_request, selected_language))
+
+    st.subheader("Generate lyrics")
+    # seed snippets come from the selected song and its nearest neighbours
+    seed_song_ids = [spotify_id_generate, *similar_df.song_spotify_id]
+    seed_lyrics = [(spotify_id, next(iter(lyrics_index[spotify_id]))) for spotify_id in seed_song_ids if spotify_id in lyrics_index]
+    snippet_seed = st.number_input("Snippet seed", value=0, step=1)
+    seed_texts = [load_lyrics_text(lyrics_path, version, *key) for key in seed_lyrics]
+    snippets = tuple(select_snippets([text for text in seed_texts if text], length=100, seed=snippet_seed))  # files may be missing
+
+    prompt = lyrics_prompt(list(snippets))
+    params = dict(model="xlarge", max_tokens=300, temperature=2)
+    cache_key = (prompt, snippets, tuple(sorted(params.items())))
+
+    generation_cache = get_generation_cache()
+    job = generation_cache.get(cache_key)
+    if st.button("Generate", disabled=not snippets):
+        job = generation_cache.submit(cache_key, lambda: stream_lyrics(co, prompt, **params))
+
+    if job is not None:
+        placeholder = st.empty()
+        while not job.done.wait(timeout=0.2):  # stream partial output; a widget interaction stops this loop, not the job
+            placeholder.write(job.text)
+        placeholder.write(job.text)
+        if job.error is not None:
+            st.error(f"Generation failed: {job.error}")
 
 
 if __name__ == "__main__":
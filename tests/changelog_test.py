@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from sqlmodel import select
+
+from one_music.changelog import COMPACTED, advance_cursor, compact, cursor_seq, latest_seq, net_changes, read_changes
+from one_music.models import Artist, ChangeLog, Playlist
+from one_music.pipeline import table_fingerprint
+
+
+def add(session, *records):
+    for record in records:
+        session.add(record)
+        session.commit()
+
+
+def test_read_changes_needs_a_cursor(session):
+    add(session, Artist(spotify_id="a", name="A"))
+    assert read_changes(session, "consumer") is None
+
+    advance_cursor(session, "consumer", 0)
+    assert [change.table_name for change in read_changes(session, "consumer")] == ["artist"]
+
+
+def test_read_changes_after_cursor(session):
+    add(session, Artist(spotify_id="a", name="A"))
+    advance_cursor(session, "consumer", latest_seq(session))
+    add(session, Artist(spotify_id="b", name="B"), Playlist(spotify_id="p", name="P", description=""))
+
+    changes = read_changes(session, "consumer")
+    assert [(change.table_name, change.operation) for change in changes] == [("artist", "insert"), ("playlist", "insert")]
+    assert [change.table_name for change in read_changes(session, "consumer", tables=["playlist"])] == ["playlist"]
+    assert read_changes(session, "consumer", until=changes[0].seq) == changes[:1]
+
+
+def test_net_changes_keeps_last_change_of_each_row(session):
+    advance_cursor(session, "consumer", 0)
+    artist = Artist(spotify_id="a", name="A")
+    add(session, artist, Artist(spotify_id="b", name="B"))
+    artist.name = "A2"
+    add(session, artist)
+    session.delete(session.get(Artist, "b"))
+    session.commit()
+
+    changes = net_changes(read_changes(session, "consumer"))
+    assert [(operation, row["spotify_id"]) for _, operation, row in changes] == [("update", "a"), ("delete", "b")]
+    assert changes[0][2]["name"] == "A2"
+
+
+def test_compact_keeps_unseen_changes_and_last_change_of_each_table(session):
+    add(session, Artist(spotify_id="a", name="A"), Artist(spotify_id="b", name="B"))
+    advance_cursor(session, "consumer", latest_seq(session))
+    add(session, Playlist(spotify_id="p", name="P", description=""))
+
+    assert compact(session) == 1
+    remaining = session.exec(select(ChangeLog.table_name).order_by(ChangeLog.seq)).all()
+    assert remaining == ["artist", "playlist"]
+    assert cursor_seq(session, COMPACTED) == cursor_seq(session, "consumer")
+    assert [change.table_name for change in read_changes(session, "consumer")] == ["playlist"]
+
+
+def test_compact_with_retention_makes_lagging_consumers_rescan(session):
+    add(session, Artist(spotify_id="a", name="A"))
+    advance_cursor(session, "consumer", 0)
+    add(session, Artist(spotify_id="b", name="B"))
+
+    compact(session, retention=timedelta(seconds=-1))
+    assert read_changes(session, "consumer") is None
+
+
+def test_table_fingerprint_follows_its_own_table_only(session):
+    add(session, Artist(spotify_id="a", name="A"), Playlist(spotify_id="p", name="P", description=""))
+    artist_fingerprint, playlist_fingerprint = table_fingerprint("artist"), table_fingerprint("playlist")
+
+    add(session, Artist(spotify_id="b", name="B"))
+    assert table_fingerprint("playlist") == playlist_fingerprint
+    assert table_fingerprint("artist") != artist_fingerprint
+
+    artist_fingerprint = table_fingerprint("artist")
+    advance_cursor(session, "consumer", latest_seq(session))
+    compact(session)
+    assert (table_fingerprint("artist"), table_fingerprint("playlist")) == (artist_fingerprint, playlist_fingerprint)
@@ -0,0 +1,49 @@
+from datetime import date
+
+import pytest
+
+from one_music.charts import ChartHistory
+
+
+def snapshot(playlist_spotify_id, market, song_ids):
+    return [
+        dict(playlist_spotify_id=playlist_spotify_id, market=market, position=position, song_spotify_id=song_id)
+        for position, song_id in enumerate(song_ids, start=1)
+    ]
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = ChartHistory(tmp_path.joinpath("charts"))
+    history.append(snapshot("fr", "France", ["a", "b", "c"]) + snapshot("jp", "Japan", ["x", "y"]), day=date(2023, 1, 25))
+    history.append(snapshot("fr", "France", ["a", "c", "d"]), day=date(2023, 2, 1))
+    return history
+
+
+def test_entries_exits(history):
+    df = history.entries_exits(day=date(2023, 2, 1), days=7)
+    # Japan wasn't polled since, so it is left out rather than reported as emptied
+    assert df[["market", "song_spotify_id", "change", "position"]].values.tolist() == [
+        ["France", "d", "entry", 3],
+        ["France", "b", "exit", 2],
+    ]
+
+
+def test_entries_exits_of_selected_playlists(history):
+    assert history.entries_exits(day=date(2023, 2, 1), playlist_ids=["jp"]).empty
+    assert len(history.entries_exits(day=date(2023, 2, 1), playlist_ids=["fr"])) == 2
+
+
+def test_append_replaces_same_day_poll(history):
+    history.append(snapshot("fr", "France", ["d", "a"]), day=date(2023, 2, 1))
+    chart = history.chart(day=date(2023, 2, 1))
+    assert chart.loc[chart.market == "France", ["position", "song_spotify_id"]].values.tolist() == [[1, "d"], [2, "a"]]
+    assert history.last_day() == date(2023, 2, 1)
+
+
+def test_trajectory_spans_months(history):
+    trajectory = history.trajectory("c")
+    assert trajectory.position.tolist() == [3, 2]
+    assert [day.date() for day in trajectory.date] == [date(2023, 1, 25), date(2023, 2, 1)]
+    assert history.song_months("c") == {"2023-01", "2023-02"}
+    assert history.trajectory("unknown").empty
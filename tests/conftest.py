@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+from sqlmodel import SQLModel, Session, create_engine
+
+
+sys.path.insert(0, str(Path(__file__).parents[1].joinpath("src")))
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """A fresh SQLite database with the change log triggers, standing in for `one_music.database.engine`"""
+    from one_music import pipeline
+    from one_music.changelog import install_triggers
+
+    engine = create_engine(f"sqlite:///{tmp_path.joinpath('database.db')}")
+    SQLModel.metadata.create_all(engine)
+    install_triggers(engine)
+    monkeypatch.setattr(pipeline, "engine", engine)
+    return engine
+
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        yield session
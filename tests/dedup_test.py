@@ -0,0 +1,44 @@
+import random
+
+from one_music.dedup import cluster_members, index_lyrics, lyrics_missing_signature, representative_url
+from one_music.models import Lyrics, LyricsSignature
+
+
+random.seed(0)
+VERSE = " ".join(f"word{random.randrange(500)}" for _ in range(200))
+OTHER_VERSE = " ".join(f"word{random.randrange(500)}" for _ in range(200))
+
+
+def index(session, genius_url, text):
+    duplicate = index_lyrics(session, genius_url, text)
+    session.commit()
+    return duplicate
+
+
+def test_near_duplicates_join_the_first_indexed_lyrics(session):
+    assert index(session, "original", VERSE) is None
+    assert index(session, "other", OTHER_VERSE) is None
+
+    duplicate = index(session, "reupload", VERSE.upper() + " (live)")
+    assert duplicate.representative_url == "original"
+    assert duplicate.similarity >= 0.8
+
+    # a duplicate of a duplicate is represented by the cluster's representative
+    assert index(session, "romanized", VERSE + " outro").representative_url == "original"
+    assert cluster_members(session, "original") == ["reupload", "romanized"]
+    assert representative_url(session, "other") == "other"
+
+
+def test_index_lyrics_is_idempotent(session):
+    index(session, "original", VERSE)
+    first = index(session, "reupload", VERSE)
+    assert index(session, "reupload", VERSE) == first
+
+
+def test_lyrics_without_words_are_marked_indexed(session):
+    session.add(Lyrics(genius_url="instrumental", language="en", file_name="instrumental.txt"))
+    session.commit()
+
+    assert index(session, "instrumental", "\n...\n!!") is None
+    assert session.get(LyricsSignature, "instrumental").signature == b""
+    assert lyrics_missing_signature(session) == []
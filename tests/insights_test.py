@@ -0,0 +1,21 @@
+import pytest
+from streamlit.testing.v1 import AppTest
+
+
+def plot_page(n_points):
+    import pandas as pd
+    from Insights import plot_embedding
+
+    df = pd.DataFrame(dict(song_spotify_id=[f"song{i}" for i in range(n_points)], song_name="name",
+                           lyrics_x=[float(i) for i in range(n_points)], lyrics_y=1.5))
+    plot_embedding(df, x="lyrics_x", y="lyrics_y", id_column="song_spotify_id", color="song_name",
+                   hover_data=["song_name"], key="lyrics")
+
+
+@pytest.mark.parametrize("n_points, sliders", [(0, []), (1, []), (3, ["lyrics_x"])])
+def test_zoom_sliders_only_span_ranges(n_points, sliders):
+    """A selection with a single point (or points on a line) has no range to zoom along that axis"""
+    at = AppTest.from_function(plot_page, args=(n_points,)).run()
+
+    assert not at.exception
+    assert [slider.label for slider in at.slider] == sliders
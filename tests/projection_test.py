@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+
+from one_music.projection import stratified_sample
+
+
+def test_stratified_sample_keeps_every_stratum():
+    strata = pd.Series(["en"] * 90 + ["fr"] * 9 + ["ja"])
+    sample = stratified_sample(strata, n_samples=10)
+
+    assert np.all(np.diff(sample) > 0)
+    assert strata.iloc[sample].value_counts().to_dict() == dict(en=9, fr=1, ja=1)
+
+
+def test_stratified_sample_of_missing_strata():
+    strata = pd.Series(["en"] * 50 + [None] * 50)
+    sample = stratified_sample(strata, n_samples=10)
+
+    assert len(sample) == 10
+    assert strata.iloc[sample].isna().sum() == 5
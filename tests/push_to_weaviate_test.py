@@ -0,0 +1,143 @@
+import copy
+from types import SimpleNamespace
+
+import pytest
+from omegaconf import OmegaConf
+
+from one_music.changelog import cursor_seq, latest_seq
+from one_music.models import AudioFeatures, Lyrics, LyricsDuplicate, Playlist, Song, SongPlaylistLink
+from one_music.scripts import push_to_weaviate as push
+
+PRIMARY_KEYS = dict(Song="spotify_id", AudioFeatures="spotify_id", Playlist="spotify_id", Lyrics="genius_url")
+
+
+class FakeWeaviate:
+    """The parts of the weaviate client the push uses, over objects kept in memory"""
+
+    def __init__(self):
+        self.objects = {class_name: {} for class_name in PRIMARY_KEYS}
+        self.updated = []
+        self.pending_objects, self.pending_references = [], []
+        self.query = SimpleNamespace(get=self.get)
+        self.batch = SimpleNamespace(
+            configure=lambda **kwargs: None,
+            add_data_object=lambda class_name, data_object, uuid: self.pending_objects.append((class_name, uuid, data_object)),
+            add_reference=lambda **kwargs: self.pending_references.append(kwargs),
+            create_objects=self.create_objects,
+            create_references=self.create_references,
+            delete_objects=lambda class_name, where: None,
+        )
+        reference = SimpleNamespace(update=self.update_references, add=self.add_reference, delete=self.delete_reference)
+        self.data_object = SimpleNamespace(get_by_id=self.get_by_id, update=self.update, reference=reference)
+
+    def get(self, class_name, properties):
+        def do():
+            found = [uuid for uuid, obj in self.objects[class_name].items() if obj[PRIMARY_KEYS[class_name]] == where["valueString"]]
+            return {"data": {"Get": {class_name: [{"_additional": {"id": uuid}} for uuid in found[:1]]}}}
+
+        where = {}
+        query = SimpleNamespace(do=do)
+        query.with_additional = query.with_limit = lambda *args, **kwargs: query
+        query.with_where = lambda clause: where.update(clause) or query
+        return query
+
+    def create_objects(self):
+        for class_name, uuid, data_object in self.pending_objects:
+            self.objects[class_name][str(uuid)] = copy.deepcopy(data_object)
+        self.pending_objects.clear()
+
+    def create_references(self):
+        for reference in self.pending_references:
+            self.add_reference(reference["from_object_uuid"], reference["from_property_name"], reference["to_object_uuid"],
+                               reference["from_object_class_name"], reference["to_object_class_name"])
+        self.pending_references.clear()
+
+    def get_by_id(self, uuid, class_name):
+        obj = self.objects[class_name].get(str(uuid))
+        return None if obj is None else {"id": uuid, "properties": copy.deepcopy(obj)}
+
+    def update(self, data_object, class_name, uuid):
+        self.objects[class_name][str(uuid)].update(data_object)
+        self.updated.append((class_name, data_object[PRIMARY_KEYS[class_name]]))
+
+    def update_references(self, from_uuid, from_property_name, to_uuids, from_class_name, to_class_names):
+        beacons = [{"beacon": f"weaviate://localhost/{to_class_names}/{uuid}"} for uuid in to_uuids]
+        self.objects[from_class_name][str(from_uuid)][from_property_name] = beacons
+
+    def add_reference(self, from_uuid, from_property_name, to_uuid, from_class_name, to_class_name):
+        beacons = self.objects[from_class_name][str(from_uuid)].setdefault(from_property_name, [])
+        beacons.append({"beacon": f"weaviate://localhost/{to_class_name}/{to_uuid}"})
+
+    def delete_reference(self, from_uuid, from_property_name, to_uuid, from_class_name, to_class_name):
+        beacons = self.objects[from_class_name][str(from_uuid)][from_property_name]
+        beacons.remove({"beacon": f"weaviate://localhost/{to_class_name}/{to_uuid}"})
+
+    def find(self, class_name, key):
+        return next(obj for obj in self.objects[class_name].values() if obj[PRIMARY_KEYS[class_name]] == key)
+
+    def referenced(self, class_name, key, property_name):
+        """Primary keys of the objects a property points at"""
+        targets = []
+        for beacon in self.find(class_name, key).get(property_name, []):
+            target_class, uuid = beacon["beacon"].split("/")[-2:]
+            targets.append(self.objects[target_class][uuid][PRIMARY_KEYS[target_class]])
+        return sorted(targets)
+
+
+@pytest.fixture
+def weaviate_client(engine, monkeypatch):
+    client = FakeWeaviate()
+    monkeypatch.setattr(push, "engine", engine)
+    monkeypatch.setattr(push, "create_weaviate_client", lambda *args, **kwargs: client)
+    monkeypatch.setattr(push, "initialize_weaviate", lambda *args, **kwargs: None)
+    return client
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    return OmegaConf.create(dict(weaviate=dict(connection_url="", schema_dir="", data_dir=str(tmp_path)), cohere=dict(api_key="")))
+
+
+def add_song(session, tmp_path, spotify_id, genius_url, playlist):
+    tmp_path.joinpath(f"{genius_url}.txt").write_text(f"[Verse]\nlyrics of {genius_url}", encoding="utf-8")
+    features = dict(acousticness=0.1, danceability=0.2, duration_ms=1000, energy=0.3, instrumentalness=0.0, key=1,
+                    liveness=0.1, mode=1, speechiness=0.1, tempo=120.0, valence=0.5)
+    song = Song(spotify_id=spotify_id, name=spotify_id.upper(), playlists=[playlist])
+    session.add(song)
+    session.add(AudioFeatures(spotify_id=spotify_id, **features))
+    session.add(Lyrics(genius_url=genius_url, language="en", file_name=f"{genius_url}.txt", song_spotify_id=spotify_id))
+    session.commit()
+    return song
+
+
+def test_push_updates_songs_already_in_weaviate(session, tmp_path, cfg, weaviate_client):
+    first, second = Playlist(spotify_id="p1", name="P1", description=""), Playlist(spotify_id="p2", name="P2", description="")
+    song = add_song(session, tmp_path, "s1", "l1", first)
+    session.add(second)
+    session.commit()
+
+    push.push_to_weaviate(cfg)
+    assert weaviate_client.referenced("Song", "s1", "from_playlists") == ["p1"]
+    assert weaviate_client.referenced("Song", "s1", "has_lyrics") == ["l1"]
+    assert weaviate_client.updated == []
+
+    # rename the song, move it to the other playlist, and add a near-duplicate of its lyrics on a new song
+    song.name = "S1 (remastered)"
+    session.add(song)
+    session.delete(session.get(SongPlaylistLink, ("s1", "p1")))
+    session.add(SongPlaylistLink(song_spotify_id="s1", playlist_spotify_id="p2"))
+    session.commit()
+    add_song(session, tmp_path, "s2", "l2", second)
+    session.add(LyricsDuplicate(genius_url="l2", representative_url="l1", similarity=0.9))
+    session.commit()
+
+    push.push_to_weaviate(cfg)
+    assert weaviate_client.find("Song", "s1")["name"] == "S1 (remastered)"
+    assert weaviate_client.referenced("Song", "s1", "from_playlists") == ["p2"]
+    assert weaviate_client.referenced("Playlist", "p1", "has_songs") == []
+    assert weaviate_client.referenced("Playlist", "p2", "has_songs") == ["s1", "s2"]
+    assert weaviate_client.referenced("Song", "s2", "has_lyrics") == ["l1"]
+    assert weaviate_client.referenced("Lyrics", "l1", "from_song") == ["s1", "s2"]
+    assert "l2" not in [obj["genius_url"] for obj in weaviate_client.objects["Lyrics"].values()]
+    assert weaviate_client.updated == [("Song", "s1")]
+    assert cursor_seq(session, push.CHANGELOG_CONSUMER) == latest_seq(session)
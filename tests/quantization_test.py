@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from one_music.quantization import QuantizedMatrix
+
+
+@pytest.fixture(scope="module")
+def matrix():
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((2000, 48)).astype(np.float32)
+    return X / np.linalg.norm(X, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("kind, tolerance", [("float16", 1e-3), ("int8", 0.05), ("pq", 0.35)])
+def test_scores_approximate_float32(matrix, kind, tolerance):
+    quantized = QuantizedMatrix.fit(matrix, kind=kind)
+    query = matrix[7]
+
+    scores = quantized.scores(query)
+    assert scores.shape == (len(matrix),) and scores.dtype == np.float32
+    assert np.abs(scores - matrix @ query).max() < tolerance
+    # the query row itself stays among the best candidates, which callers re-rank in float32
+    assert 7 in np.argsort(-scores)[:10]
+
+
+@pytest.mark.parametrize("kind", ["float16", "int8", "pq"])
+def test_scores_match_decoded_rows(matrix, kind):
+    quantized = QuantizedMatrix.fit(matrix, kind=kind)
+    query = matrix[3]
+    np.testing.assert_allclose(quantized.scores(query), quantized.decode(slice(None)) @ query, atol=1e-4)
+
+
+def test_save_load_roundtrip(matrix, tmp_path):
+    quantized = QuantizedMatrix.fit(matrix, kind="int8")
+    quantized.save(tmp_path)
+    loaded = QuantizedMatrix.load(tmp_path, mmap=True)
+    np.testing.assert_array_equal(loaded.scores(matrix[0]), quantized.scores(matrix[0]))
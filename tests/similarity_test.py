@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from one_music.similarity import SharedSimilarityIndex, SimilarityIndex, update_similarity_index
+
+FEATURES = ["energy", "tempo"]
+
+
+def songs(ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(dict(song_spotify_id=ids, energy=rng.random(len(ids)), tempo=rng.uniform(60, 180, len(ids))))
+
+
+@pytest.mark.parametrize("rebuild_threshold", [1, 1024])
+def test_inserted_songs_are_found_from_the_buffer_and_the_tree(rebuild_threshold):
+    X = np.array([[0.0, 0.0], [1.0, 1.0], [5.0, 5.0], [6.0, 6.0]])
+    index = SimilarityIndex(["a", "b", "c", "d"], X, rebuild_threshold=rebuild_threshold)
+    index.insert(["e", "a", "f"], np.array([[0.1, 0.1], [9.0, 9.0], [5.1, 5.1]]))
+
+    assert len(index) == 6 and index.tree_size == (6 if rebuild_threshold == 1 else 4)
+    assert index.similar_songs("a", k=2).song_spotify_id.tolist() == ["e", "b"]
+    assert index.similar_songs("f", k=1).song_spotify_id.tolist() == ["c"]
+    assert index.similar_songs("f", k=2, filters={"e", "a"}).song_spotify_id.tolist() == ["e", "a"]
+
+
+def test_update_inserts_new_songs_into_a_copy():
+    song_df = songs(list("abcdef"))
+    index = update_similarity_index(None, song_df.iloc[:4], FEATURES, data_version="1")
+    updated = update_similarity_index(index, song_df, FEATURES, data_version="2")
+
+    assert updated.scaler is index.scaler  # inserted, not refitted
+    assert len(index) == 4 and "e" not in index.positions and index.data_version == "1"
+    assert len(updated) == 6 and updated.data_version == "2"
+    assert set(updated.similar_songs("e", k=5).song_spotify_id) == set("abcdf")
+
+
+def test_update_rebuilds_when_songs_are_removed():
+    song_df = songs(list("abcd"))
+    index = update_similarity_index(None, song_df, FEATURES, data_version="1")
+    rebuilt = update_similarity_index(index, song_df.iloc[1:], FEATURES, data_version="2")
+
+    assert rebuilt.scaler is not index.scaler
+    assert "a" not in rebuilt.positions
+
+
+def test_shared_index_is_persisted_and_updated_per_version(tmp_path):
+    file_path = tmp_path.joinpath("similarity_index.joblib")
+    first = SharedSimilarityIndex(file_path).current(songs(list("abc")), FEATURES, "1")
+    assert SharedSimilarityIndex(file_path).current(songs(list("abc")), FEATURES, "1").data_version == "1"
+
+    shared = SharedSimilarityIndex(file_path)
+    index = shared.current(songs(list("abcd")), FEATURES, "2")
+    assert index.scaler.center_.tolist() == first.scaler.center_.tolist()  # the persisted index was updated
+    assert shared.current(songs(list("abcd")), FEATURES, "2") is index
+    assert len(index) == 4
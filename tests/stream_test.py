@@ -0,0 +1,28 @@
+import pytest
+
+from one_music.models import AudioFeatures, Lyrics, Song
+from one_music.scripts import stream
+from one_music.streaming import DurableQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return DurableQueue(tmp_path.joinpath("queue.db"))
+
+
+def test_publish_missing_songs_queues_each_song_once(engine, session, queue, monkeypatch):
+    monkeypatch.setattr(stream, "engine", engine)
+    for spotify_id in ["done", "no_features", "no_lyrics"]:
+        session.add(Song(spotify_id=spotify_id, name=spotify_id))
+    features = {name: 0.0 for name in AudioFeatures.__table__.columns.keys() if name != "spotify_id"}
+    session.add(AudioFeatures(spotify_id="done", **features))
+    session.add(AudioFeatures(spotify_id="no_lyrics", **features))
+    session.add(Lyrics(genius_url="url", language="en", file_name="url.txt", song_spotify_id="done"))
+    session.add(Lyrics(genius_url="url2", language="en", file_name="url2.txt", song_spotify_id="no_features"))
+    session.commit()
+    queue.publish("lyrics", [dict(spotify_id="no_lyrics")])  # published before a restart
+
+    stream.publish_missing_songs(queue)
+    stream.publish_missing_songs(queue)
+    assert queue.payloads("audio_features") == [dict(spotify_id="no_features")]
+    assert queue.payloads("lyrics") == [dict(spotify_id="no_lyrics")]
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from one_music.streaming import DurableQueue, consume
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return DurableQueue(tmp_path.joinpath("queue.db"), lease_seconds=0.2, max_attempts=2)
+
+
+def test_lease_hides_message_until_acked(queue):
+    queue.publish("songs", [dict(spotify_id="a"), dict(spotify_id="b")])
+
+    first, second = queue.lease("songs"), queue.lease("songs")
+    assert [first[1], second[1]] == [dict(spotify_id="a"), dict(spotify_id="b")]
+    assert queue.lease("songs") is None
+    assert queue.lease("lyrics") is None
+
+    queue.ack(first[0])
+    assert queue.depth() == dict(songs=dict(leased=1))
+
+
+def test_expired_lease_is_redelivered(queue):
+    queue.publish("songs", [dict(spotify_id="a")])
+    message_id, _ = queue.lease("songs")
+    assert queue.lease("songs") is None
+
+    time.sleep(0.3)
+    assert queue.lease("songs") == (message_id, dict(spotify_id="a"))
+
+
+def test_message_is_dead_after_max_attempts(queue):
+    queue.publish("songs", [dict(spotify_id="a")])
+    queue.lease("songs")
+    time.sleep(0.3)
+    queue.lease("songs")
+    time.sleep(0.3)
+
+    assert queue.lease("songs") is None
+    assert queue.depth() == dict(songs=dict(dead=1))
+    assert queue.pending() == 0
+
+
+def test_nack_retries_with_backoff(queue):
+    queue.publish("songs", [dict(spotify_id="a")])
+    message_id, _ = queue.lease("songs")
+    queue.nack(message_id, "boom", backoff=0.1)
+    assert queue.lease("songs") is None
+
+    time.sleep(0.15)
+    assert queue.lease("songs") == (message_id, dict(spotify_id="a"))
+
+
+def test_consume_publishes_downstream_and_acks(queue):
+    queue.publish("songs", [dict(spotify_id="a")])
+    stop = threading.Event()
+
+    def handler(payload):
+        stop.set()
+        return [("lyrics", payload), ("audio_features", payload)]
+
+    consume(queue, "songs", handler, stop, poll_interval=0.01)
+    assert queue.depth() == dict(lyrics=dict(ready=1), audio_features=dict(ready=1))
+
+
+def test_lease_is_extended_while_handler_runs(queue):
+    queue.publish("lyrics", [dict(spotify_id="a")])
+    stop = threading.Event()
+    redelivered = []
+
+    def handler(payload):
+        time.sleep(0.5)  # longer than the lease
+        redelivered.append(queue.lease("lyrics"))
+        stop.set()
+        return []
+
+    consume(queue, "lyrics", handler, stop, poll_interval=0.01)
+    assert redelivered == [None]
+    assert queue.pending() == 0
+
+
+def test_pending_of_selected_queues(queue):
+    queue.publish("songs", [dict(spotify_id="a")])
+    queue.publish("lyrics", [dict(spotify_id="a"), dict(spotify_id="b")])
+
+    assert queue.pending() == 3
+    assert queue.pending(["lyrics"]) == 2
+    assert queue.pending([]) == 0
+    assert queue.payloads("lyrics") == [dict(spotify_id="a"), dict(spotify_id="b")]